@@ -0,0 +1,177 @@
+# -*- coding: utf-8 -*-
+import sqlite3
+import datetime
+import threading
+import pandas as pd
+
+CREATE_TABLE = """
+create table if not exists baidu_index (
+    keyword text not null,
+    area integer not null,
+    kind text not null,
+    date text not null,
+    value text not null,
+    fetched text not null,
+    primary key (keyword, area, kind, date)
+)
+"""
+
+
+class BaiduIndexCache(object):
+    """
+    A local SQLite table of decrypted Baidu Index values keyed by
+    (keyword, area, kind, date)
+
+    Historical values never change, so a cached value is served as long as
+    it was fetched at least stale_days after its date, or fetched today.
+    Only the trailing few days of a series are therefore fetched again.
+    """
+
+    def __init__(self, path='baidu_index.db', stale_days=3):
+        """
+        Parameters
+        ----------
+        path: string, default 'baidu_index.db'
+            the SQLite file of the cache
+        stale_days: int, default 3
+            how many days it takes for a value to become final
+        """
+        self.path = path
+        self.stale_days = stale_days
+        self.__lock = threading.Lock()
+        self.__conn = sqlite3.connect(path, check_same_thread=False)
+        with self.__conn:
+            self.__conn.execute(CREATE_TABLE)
+
+    @staticmethod
+    def __today():
+        return datetime.date.today().strftime('%Y-%m-%d')
+
+    def missing_dates(self, keywords, area, kinds, start_date, end_date):
+        """
+        Get the dates which are not cached, or not final yet, for at least
+        one of the keywords and kinds
+
+        Parameters
+        ----------
+        keywords: list
+            the keywords to search
+        area: int
+            the area code
+        kinds: list
+            the device kinds, e.g. ['all', 'pc', 'wise']
+        start_date: string
+            the beginning of the time interval, '%Y-%m-%d'
+        end_date: string
+            the end of the time interval, '%Y-%m-%d'
+
+        Returns
+        -------
+        missing : DatetimeIndex
+        """
+        all_date = pd.date_range(start_date, end_date)
+        sql = """
+            select date from baidu_index
+            where keyword = ? and area = ? and date between ? and ?
+                and kind in ({kinds})
+                and (fetched = ? or
+                     julianday(fetched) - julianday(date) >= ?)
+            group by date having count(distinct kind) = ?
+        """.format(kinds=','.join('?' * len(kinds)))
+        missing = pd.DatetimeIndex([])
+        with self.__lock:
+            for keyword in keywords:
+                rows = self.__conn.execute(
+                    sql, [keyword, area, start_date, end_date] + list(kinds) +
+                         [self.__today(), self.stale_days, len(kinds)]
+                ).fetchall()
+                cached = pd.to_datetime([row[0] for row in rows])
+                missing = missing.union(all_date.difference(cached))
+        return missing
+
+    def missing_ranges(self, keywords, area, kinds, start_date, end_date):
+        """
+        Group the missing dates into contiguous (start, end) intervals
+
+        Parameters
+        ----------
+        keywords, area, kinds, start_date, end_date:
+            the same as missing_dates
+
+        Returns
+        -------
+        ranges : list
+            (start_date, end_date) pairs of strings, '%Y-%m-%d'
+        """
+        missing = self.missing_dates(keywords, area, kinds, start_date,
+                                     end_date)
+        ranges = []
+        for date in missing:
+            if ranges and date - ranges[-1][1] == pd.Timedelta('1 day'):
+                ranges[-1][1] = date
+            else:
+                ranges.append([date, date])
+        return [(start.strftime('%Y-%m-%d'), end.strftime('%Y-%m-%d'))
+                for start, end in ranges]
+
+    def put(self, keyword, area, kind, dates, values):
+        """
+        Store the values of a keyword and kind
+
+        Parameters
+        ----------
+        keyword: string
+            the keyword
+        area: int
+            the area code
+        kind: string
+            the device kind
+        dates: list
+            the dates of the values, '%Y-%m-%d'
+        values: list
+            the decrypted values as strings, '' if there is no data
+        """
+        fetched = self.__today()
+        with self.__lock, self.__conn:
+            self.__conn.executemany(
+                'insert or replace into baidu_index values (?, ?, ?, ?, ?, ?)',
+                [(keyword, area, kind, date, value, fetched)
+                 for date, value in zip(dates, values)])
+
+    def get(self, keyword, area, kind, start_date, end_date):
+        """
+        Read the cached values of a keyword and kind
+
+        Parameters
+        ----------
+        keyword: string
+            the keyword
+        area: int
+            the area code
+        kind: string
+            the device kind
+        start_date: string
+            the beginning of the time interval, '%Y-%m-%d'
+        end_date: string
+            the end of the time interval, '%Y-%m-%d'
+
+        Returns
+        -------
+        rows : list
+            (date, value) pairs ordered by date
+        """
+        with self.__lock:
+            return self.__conn.execute(
+                """
+                select date, value from baidu_index
+                where keyword = ? and area = ? and kind = ?
+                    and date between ? and ?
+                order by date
+                """, (keyword, area, kind, start_date, end_date)).fetchall()
+
+    def close(self):
+        self.__conn.close()
+
+
+if __name__ == '__main__':
+    pass
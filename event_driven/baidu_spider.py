@@ -1,18 +1,72 @@
 # -*- coding: utf-8 -*-
-from config import COOKIES, CITY_CODE, PROVINCE_CODE
+from config import COOKIES, CITY_CODE, PROVINCE_CODE, BAIDU_INDEX_URL, \
+    SPIDER_CONCURRENCY, SPIDER_RATE_LIMIT, SPIDER_RETRIES, SPIDER_BACKOFF, \
+    SPIDER_TIMEOUT
+from errors import BaiduIndexError
+from instrument import get_instrument
 from urllib.parse import urlencode
 from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+import numpy as np
+import pandas as pd
+import threading
 import datetime
 import requests
 import json
+import time
 
+# requests sets the Host header from the url, base_url may be a local stub
 headers = {
-    'Host': 'index.baidu.com',
     'Connection': 'keep-alive',
     'X-Requested-With': 'XMLHttpRequest',
     'User-Agent': 'Mozilla/5.0 (Macintosh; Intel Mac OS X 10_13_6) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/70.0.3538.77 Safari/537.36',
 }
 
+# one keep-alive session shared by every BaiduIndex
+session = requests.Session()
+session.mount('http://', requests.adapters.HTTPAdapter(
+    pool_maxsize=max(SPIDER_CONCURRENCY, 10)))
+session.mount('https://', requests.adapters.HTTPAdapter(
+    pool_maxsize=max(SPIDER_CONCURRENCY, 10)))
+
+
+@lru_cache(maxsize=64)
+def translation_table(key):
+    """
+    the str.translate table of a ptbk key, whose first half maps onto its
+    second half
+    """
+    half = len(key) // 2
+    return str.maketrans(key[:half], key[half:])
+
+
+class RateLimiter:
+    """
+        spread calls evenly so that at most rate calls start per second
+        :rate; float, None for no limit
+    """
+
+    def __init__(self, rate):
+        self._interval = 1.0 / rate if rate else 0
+        self._next_time = 0
+        self._lock = threading.Lock()
+
+    def wait(self):
+        if not self._interval:
+            return
+        with self._lock:
+            now = time.monotonic()
+            wait_time = self._next_time - now
+            self._next_time = max(now, self._next_time) + self._interval
+        if wait_time > 0:
+            time.sleep(wait_time)
+
+
+# one budget of requests shared by every BaiduIndex of the process, as the
+# session is, so concurrent downloads together keep to SPIDER_RATE_LIMIT
+rate_limiter = RateLimiter(SPIDER_RATE_LIMIT)
+
 
 class BaiduIndex:
     """
@@ -21,37 +75,122 @@ class BaiduIndex:
         :start_date; string '2018-10-02'
         :end_date; string '2018-10-02'
         :area; int, search by cls.province_code/cls.city_code
+        :cache; BaiduIndexCache, only fetch the dates missing from it
+        :concurrency; int, the number of chunks fetched at the same time
+        :rate_limiter; RateLimiter, the module level rate_limiter shared by
+            every BaiduIndex by default, None for no limit
+        :retries; int, retry a failed request with exponential backoff
+        :base_url; string, 'http://index.baidu.com' or a local stub
+        :kinds; list, the devices to decrypt and keep, from all/pc/wise
+        :instrument; Instrument, records the stages http, decrypt and
+            baidu_cache and the counters http_calls, http_failures and
+            bytes_fetched, None to record nothing
     """
 
     province_code = PROVINCE_CODE
     city_code = CITY_CODE
 
-    def __init__(self, keywords, start_date, end_date, area=0):
+    def __init__(self, keywords, start_date, end_date, area=0, cache=None,
+                 concurrency=SPIDER_CONCURRENCY, rate_limiter=rate_limiter,
+                 retries=SPIDER_RETRIES, base_url=BAIDU_INDEX_URL,
+                 cookies=COOKIES, kinds=('all', 'pc', 'wise'),
+                 instrument=None):
         """
         """
+        self._instrument = get_instrument(instrument)
+        self._concurrency = concurrency
+        self._rate_limiter = rate_limiter
+        self._retries = retries
+        self._base_url = base_url
+        self._cookies = cookies
         self._keywords = keywords if isinstance(keywords,
                                                 list) else keywords.split(',')
-        self._time_range_list = self.get_time_range_list(start_date, end_date)
-        self._all_kind = ['all', 'pc', 'wise']
+        self._start_date = start_date
+        self._end_date = end_date
+        self._all_kind = list(kinds)
         self._area = area
-        self.result = {keyword: defaultdict(list) for keyword in
-                       self._keywords}
+        self._cache = cache
+        if cache is None:
+            self._time_range_list = self.get_time_range_list(start_date,
+                                                             end_date)
+        else:
+            self._time_range_list = []
+            for missing_start, missing_end in cache.missing_ranges(
+                    self._keywords, area, self._all_kind, start_date,
+                    end_date):
+                self._time_range_list += self.get_time_range_list(
+                    missing_start, missing_end)
+        self.result = {keyword: {} for keyword in self._keywords}
+        self._chunks = {keyword: defaultdict(list) for keyword in
+                        self._keywords}
         self.get_result()
 
     def get_result(self):
         """
         """
-        for start_date, end_date in self._time_range_list:
-            encrypt_datas, uniqid = self.get_encrypt_datas(start_date,
-                                                           end_date)
-            key = self.get_key(uniqid)
+        if self._concurrency > 1 and len(self._time_range_list) > 1:
+            with ThreadPoolExecutor(self._concurrency) as pool:
+                all_encrypt_datas = list(pool.map(
+                    lambda time_range: self.fetch_time_range(*time_range),
+                    self._time_range_list))
+        else:
+            all_encrypt_datas = [self.fetch_time_range(start_date, end_date)
+                                 for start_date, end_date in
+                                 self._time_range_list]
+        for encrypt_datas in all_encrypt_datas:
             for encrypt_data in encrypt_datas:
-                for kind in self._all_kind:
-                    encrypt_data[kind]['data'] = self.decrypt_func(key,
-                                                                   encrypt_data[
-                                                                       kind][
-                                                                       'data'])
                 self.format_data(encrypt_data)
+        for keyword in self._keywords:
+            for kind in self._all_kind:
+                chunks = self._chunks[keyword][kind]
+                self.result[keyword][kind] = pd.concat(chunks) if chunks \
+                    else self.to_series(pd.DatetimeIndex([]), [])
+        if self._cache is not None:
+            with self._instrument.stage('baidu_cache'):
+                self.save_to_cache()
+                self.load_from_cache()
+
+    def fetch_time_range(self, start_date, end_date):
+        """
+        download and decrypt the data of one chunk
+        """
+        encrypt_datas, uniqid = self.get_encrypt_datas(start_date, end_date)
+        key = self.get_key(uniqid)
+        with self._instrument.stage('decrypt'):
+            for encrypt_data in encrypt_datas:
+                for kind in self._all_kind:
+                    encrypt_data[kind]['data'] = self.decrypt_func(
+                        key, encrypt_data[kind]['data'])
+        return encrypt_datas
+
+    def save_to_cache(self):
+        """
+        store every fetched day, '' for the days baidu did not return
+        """
+        if not self._time_range_list:
+            return
+        dates = pd.DatetimeIndex(np.concatenate([
+            pd.date_range(start_date, end_date).values
+            for start_date, end_date in self._time_range_list]))
+        for keyword in self._keywords:
+            for kind in self._all_kind:
+                values = self.result[keyword][kind].reindex(dates)
+                digits = values.fillna(0).astype(np.int64).astype(str)
+                values = np.where(values.isna(), '', digits)
+                self._cache.put(keyword, self._area, kind,
+                                dates.strftime('%Y-%m-%d'), values)
+
+    def load_from_cache(self):
+        """
+        rebuild the result of the whole time range from the cache
+        """
+        for keyword in self._keywords:
+            for kind in self._all_kind:
+                rows = self._cache.get(keyword, self._area, kind,
+                                       self._start_date, self._end_date)
+                self.result[keyword][kind] = self.to_series(
+                    pd.to_datetime([row[0] for row in rows]),
+                    [row[1] for row in rows])
 
     def get_encrypt_datas(self, start_date, end_date):
         """
@@ -64,7 +203,7 @@ class BaiduIndex:
             'endDate': end_date,
             'area': self._area,
         }
-        url = 'http://index.baidu.com/api/SearchApi/index?' + urlencode(
+        url = self._base_url + '/api/SearchApi/index?' + urlencode(
             request_args)
         html = self.http_get(url)
         datas = json.loads(html)
@@ -77,7 +216,7 @@ class BaiduIndex:
     def get_key(self, uniqid):
         """
         """
-        url = 'http://index.baidu.com/Interface/api/ptbk?uniqid=%s' % uniqid
+        url = self._base_url + '/Interface/api/ptbk?uniqid=%s' % uniqid
         html = self.http_get(url)
         datas = json.loads(html)
         key = datas['data']
@@ -85,32 +224,58 @@ class BaiduIndex:
 
     def format_data(self, data):
         """
+        add the decrypted chunk of a keyword as one series per kind
         """
         keyword = str(data['word'])
-        time_len = len(data['all']['data'])
-        start_date = data['all']['startDate']
-        cur_date = datetime.datetime.strptime(start_date, '%Y-%m-%d')
-        for i in range(time_len):
-            formated_data = {
-                'date': cur_date.strftime('%Y-%m-%d')
-            }
-            for kind in self._all_kind:
-                formated_data['index'] = data[kind]['data'][i]
-                self.result[keyword][kind].append(formated_data.copy())
+        for kind in self._all_kind:
+            values = data[kind]['data']
+            dates = pd.date_range(data[kind]['startDate'], periods=len(values))
+            self._chunks[keyword][kind].append(self.to_series(dates, values))
 
-            cur_date += datetime.timedelta(days=1)
+    @staticmethod
+    def to_series(dates, values):
+        """
+        parse decrypted strings into an int64 series indexed by date,
+        leaving out the days baidu has no data for ('')
+        """
+        values = np.asarray(values, dtype=str)
+        kept = values != ''
+        series = pd.Series(values[kept].astype(np.int64),
+                           index=pd.DatetimeIndex(dates)[kept], name='index')
+        series.index.name = 'date'
+        return series
 
     def __call__(self, keyword, kind='all'):
+        """
+        :return; Series, the int64 index of the keyword indexed by date
+        """
         return self.result[keyword][kind]
 
-    @staticmethod
-    def http_get(url, cookies=COOKIES):
-        headers['Cookie'] = cookies
-        response = requests.get(url, headers=headers)
-        if response.status_code == 200:
-            return response.text
-        else:
-            return None
+    def http_get(self, url):
+        """
+        get through the shared session, retrying on errors and non-200
+        responses with exponential backoff
+        """
+        request_headers = dict(headers, Cookie=self._cookies)
+        for attempt in range(self._retries + 1):
+            if attempt:
+                time.sleep(SPIDER_BACKOFF * 2 ** (attempt - 1))
+            if self._rate_limiter is not None:
+                self._rate_limiter.wait()
+            self._instrument.count('http_calls')
+            try:
+                with self._instrument.stage('http'):
+                    response = session.get(url, headers=request_headers,
+                                           timeout=SPIDER_TIMEOUT)
+            except requests.RequestException:
+                self._instrument.count('http_failures')
+                continue
+            self._instrument.count('bytes_fetched', len(response.content))
+            if response.status_code == 200:
+                return response.text
+            self._instrument.count('http_failures')
+        raise BaiduIndexError('Failed to get {url} after {n} attempts'.format(
+            url=url, n=self._retries + 1))
 
     @staticmethod
     def get_time_range_list(startdate, enddate):
@@ -134,15 +299,7 @@ class BaiduIndex:
         """
         decrypt data
         """
-        a = key
-        i = data
-        n = {}
-        s = []
-        for o in range(len(a) // 2):
-            n[a[o]] = a[len(a) // 2 + o]
-        for r in range(len(data)):
-            s.append(n[i[r]])
-        return ''.join(s).split(',')
+        return data.translate(translation_table(key)).split(',')
 
 
 if __name__ == '__main__':
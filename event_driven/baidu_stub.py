@@ -0,0 +1,200 @@
+# -*- coding: utf-8 -*-
+import json
+import time
+import random
+import threading
+import datetime
+import numpy as np
+import pandas as pd
+from urllib.parse import urlparse, parse_qs
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+# the characters of the decrypted data, which the ptbk keys map onto
+PLAIN = '0123456789,'
+# the characters the data is encrypted into
+CIPHER = 'ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz'
+
+
+class BaiduIndexStub(object):
+    """
+    A local server answering the two endpoints of index.baidu.com used by
+    BaiduIndex, /api/SearchApi/index and /Interface/api/ptbk, with
+    encrypted data and a fresh key for every request, so that the spider
+    and fit() can run without cookies or network access
+
+    The index of a keyword is random noise around a base level with a
+    spike on the days of its events.
+
+    Examples
+    --------
+    >> with BaiduIndexStub({'降准': ['2018-10-15']}) as stub:
+    ..     BaiduIndex('降准', '2018-10-01', '2018-10-31',
+    ..                base_url=stub.url)('降准')
+    """
+
+    def __init__(self, events=None, delay=0.0, fail_rate=0.0, seed=0,
+                 port=0):
+        """
+        Parameters
+        ----------
+        events: dict, default None
+            keyword -> the dates on which its index spikes
+        delay: float, default 0
+            seconds to wait before answering, like a round trip
+        fail_rate: float, default 0
+            the share of the requests answered with status 500
+        seed: int, default 0
+            the seed of the keys and of the failures
+        port: int, default 0
+            the port to listen on, any free port if 0
+        """
+        self.events = {keyword: pd.DatetimeIndex(pd.to_datetime(dates))
+                       for keyword, dates in (events or {}).items()}
+        self.delay = delay
+        self.fail_rate = fail_rate
+        self.calls = 0
+        self.bytes_sent = 0
+        self.__random = random.Random(seed)
+        self.__keys = {}
+        self.__lock = threading.Lock()
+        self.__server = ThreadingHTTPServer(('127.0.0.1', port),
+                                            self.__handler())
+        self.__server.daemon_threads = True
+        self.__thread = None
+
+    @property
+    def url(self):
+        """
+        The base_url of BaiduIndex pointing at this server
+        """
+        return 'http://127.0.0.1:%d' % self.__server.server_address[1]
+
+    def start(self):
+        self.__thread = threading.Thread(target=self.__server.serve_forever,
+                                         daemon=True)
+        self.__thread.start()
+        return self
+
+    def stop(self):
+        self.__server.shutdown()
+        self.__server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *args):
+        self.stop()
+
+    def values(self, keyword, kind, dates):
+        """
+        The index of a keyword on some days, the same for every request
+
+        Parameters
+        ----------
+        keyword: string
+        kind: string
+            all, pc or wise
+        dates: DatetimeIndex
+
+        Returns
+        -------
+        values : ndarray
+        """
+        seed = sum(map(ord, keyword + kind))
+        days = dates.values.astype('datetime64[D]').astype(np.int64)
+        noise = (days * 7919 + seed * 104729) % 1000
+        values = 1000 + seed % 500 + noise
+        if keyword in self.events:
+            event_days = self.events[keyword].values.astype(
+                'datetime64[D]').astype(np.int64)
+            distance = np.abs(days[:, None] - event_days[None, :]).min(
+                axis=1) if len(event_days) else np.full(len(days), 99)
+            values = np.where(distance <= 3, values * (10 - 2 * distance),
+                              values)
+        return values
+
+    def index(self, query):
+        """
+        The answer of /api/SearchApi/index, encrypted with a new key
+        """
+        start = pd.Timestamp(query['startDate'][0][:10])
+        end = min(pd.Timestamp(query['endDate'][0][:10]),
+                  pd.Timestamp(datetime.date.today()))
+        dates = pd.date_range(start, end)
+        with self.__lock:
+            uniqid = '%032x' % self.__random.getrandbits(128)
+            cipher = ''.join(self.__random.sample(CIPHER, len(PLAIN)))
+            self.__keys[uniqid] = cipher + PLAIN
+        encrypt = str.maketrans(PLAIN, cipher)
+        user_indexes = []
+        for keyword in query['word'][0].split(','):
+            entry = {'word': keyword}
+            for kind in ['all', 'pc', 'wise']:
+                data = ','.join(self.values(keyword, kind, dates).astype(str))
+                entry[kind] = {'startDate': start.strftime('%Y-%m-%d'),
+                               'endDate': end.strftime('%Y-%m-%d'),
+                               'data': data.translate(encrypt)}
+            user_indexes.append(entry)
+        return {'data': {'uniqid': uniqid, 'userIndexes': user_indexes}}
+
+    def ptbk(self, query):
+        """
+        The answer of /Interface/api/ptbk, the key of an earlier answer
+        """
+        with self.__lock:
+            return {'data': self.__keys.pop(query['uniqid'][0], '')}
+
+    def respond(self, path):
+        """
+        Answer a request
+
+        Parameters
+        ----------
+        path: string
+            the path and the query string of the request
+
+        Returns
+        -------
+        status : int
+        body : bytes
+        """
+        if self.delay:
+            time.sleep(self.delay)
+        url = urlparse(path)
+        routes = {'/api/SearchApi/index': self.index,
+                  '/Interface/api/ptbk': self.ptbk}
+        with self.__lock:
+            self.calls += 1
+            failed = self.__random.random() < self.fail_rate
+        if failed:
+            return 500, b''
+        if url.path not in routes:
+            return 404, b''
+        body = json.dumps(routes[url.path](parse_qs(url.query))).encode(
+            'utf-8')
+        with self.__lock:
+            self.bytes_sent += len(body)
+        return 200, body
+
+    def __handler(self):
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def do_GET(self):
+                status, body = stub.respond(self.path)
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        return Handler
+
+
+if __name__ == '__main__':
+    pass
@@ -0,0 +1,326 @@
+# -*- coding: utf-8 -*-
+import os
+import html
+import json
+import time
+import argparse
+import pandas as pd
+import utility
+from concurrent.futures import ThreadPoolExecutor
+from event_driven import EventDriven
+from errors import BaseError, InvalidBatchSpec
+try:
+    import yaml
+except ImportError:
+    yaml = None
+
+# the analyses a batch can run, the methods of EventDriven computing them
+# and the table of the report collecting their results
+ANALYSES = {
+    'index_effect': ('get_index_effect', 'index'),
+    'industry_effect': ('get_industry_effect', 'industry'),
+    'stock_effect': ('get_stock_effect', 'stock'),
+    'market_effect': ('get_market_effect', 'market_effect'),
+    'abnormal_return': ('get_abnormal_return', 'abnormal_return'),
+    'stock_analysis': ('get_stock_analysis', 'stock_analysis'),
+    'market_analysis': ('get_market_analysis', 'market_analysis')
+}
+# the analyses of an event which does not list its own
+DEFAULT_ANALYSES = ['index_effect', 'industry_effect', 'stock_effect']
+# the tables of a report, in the order they are written
+TABLES = ['index', 'industry', 'stock', 'market_effect', 'abnormal_return',
+          'stock_analysis', 'market_analysis', 'timing']
+
+
+def load_spec(path):
+    """
+    Read the specification of a batch from a JSON or YAML file
+
+    Parameters
+    ----------
+    path: string
+        a .json, .yaml or .yml file
+
+    Returns
+    -------
+    spec : dict
+    """
+    with open(path, encoding='utf-8') as f:
+        if path.endswith(('.yaml', '.yml')):
+            if yaml is None:
+                raise InvalidBatchSpec('reading YAML needs PyYAML, '
+                                       'use a JSON file instead')
+            return yaml.safe_load(f)
+        return json.load(f)
+
+
+def check_spec(spec):
+    """
+    Check the specification of a batch and fill in its defaults
+
+    A specification holds a list of events and optionally defaults, the
+    arguments shared by every event:
+
+        defaults:
+          fit: {threshold: 3}
+          industry_effect: {head: 10}
+        events:
+          - name: 降准
+            dates: ['2018-10-15', '2018-07-05']
+          - name: 加息
+            id: 加息2015
+            dates: ['2015-12-17']
+            fit: {window: 30}
+            analyses:
+              stock_effect: {industry: 银行III}
+              stock_analysis: {stock: 600036.XSHG}
+
+    name is the keyword of the Baidu Index and id, which defaults to name,
+    tells the events apart in the report. analyses is a list of names of
+    ANALYSES or a mapping from them to their arguments, DEFAULT_ANALYSES if
+    missing.
+
+    Parameters
+    ----------
+    spec: dict
+
+    Returns
+    -------
+    events : list
+        dicts of id, name, dates, fit and analyses (name -> arguments)
+    """
+    if not isinstance(spec, dict) or not isinstance(spec.get('events'),
+                                                     list):
+        raise InvalidBatchSpec('the spec should hold a list of events')
+    defaults = spec.get('defaults') or {}
+    events = []
+    for number, item in enumerate(spec['events']):
+        if not isinstance(item, dict) or 'name' not in item or \
+                not isinstance(item.get('dates'), list):
+            raise InvalidBatchSpec(
+                'event {number} needs a name and a list of dates'.format(
+                    number=number))
+        analyses = item.get('analyses', DEFAULT_ANALYSES)
+        if isinstance(analyses, list):
+            analyses = {analysis: {} for analysis in analyses}
+        unknown = [analysis for analysis in analyses
+                   if analysis not in ANALYSES]
+        if unknown:
+            raise InvalidBatchSpec('unknown analyses: ' + ', '.join(unknown))
+        events.append({
+            'id': str(item.get('id', item['name'])),
+            'name': item['name'],
+            'dates': [str(date) for date in item['dates']],
+            'fit': dict(defaults.get('fit') or {}, **(item.get('fit') or {})),
+            'analyses': {analysis: dict(defaults.get(analysis) or {},
+                                        **(arguments or {}))
+                         for analysis, arguments in analyses.items()}
+        })
+    ids = [event['id'] for event in events]
+    duplicated = sorted(set(i for i in ids if ids.count(i) > 1))
+    if duplicated:
+        raise InvalidBatchSpec('events need distinct ids, give an id to: ' +
+                               ', '.join(duplicated))
+    return events
+
+
+def run_event(event_driven, event):
+    """
+    Fit one event on a fork of an instance and run its analyses
+
+    Parameters
+    ----------
+    event_driven: EventDriven
+        the instance whose tables are shared
+    event: dict
+        an event of check_spec
+
+    Returns
+    -------
+    results : dict
+        analysis -> the result, None if it failed
+    timing : list
+        one dict per step with event, analysis, seconds, status and error
+    """
+    fork = event_driven.fork()
+    results = {}
+    timing = []
+    steps = [('fit', lambda: fork.fit(event['dates'], event['name'],
+                                      display=False, **event['fit']))]
+    steps += [(analysis, lambda analysis=analysis, arguments=arguments:
+               getattr(fork, ANALYSES[analysis][0])(**arguments))
+              for analysis, arguments in event['analyses'].items()]
+    for analysis, step in steps:
+        start = time.perf_counter()
+        status, error = 'ok', ''
+        try:
+            results[analysis] = step()
+        except Exception as exception:
+            results[analysis] = None
+            status, error = type(exception).__name__, str(exception)
+        timing.append({'event': event['id'], 'analysis': analysis,
+                       'seconds': time.perf_counter() - start,
+                       'status': status, 'error': error})
+        if analysis == 'fit' and status != 'ok':
+            break
+    return results, timing
+
+
+def to_table(analysis, result):
+    """
+    Turn the result of an analysis into rows of its table in the report
+
+    Returns
+    -------
+    table : DataFrame
+    """
+    if analysis == 'stock_analysis':
+        return pd.DataFrame([{key: value for key, value in result.items()
+                              if key != 'all_period_detail'}])
+    if analysis == 'abnormal_return':
+        result = result['summary']
+    return result.reset_index()
+
+
+def run_batch(spec, event_driven=None, threads=4):
+    """
+    Run the analyses of many events, loading the market data once
+
+    The Baidu Index of all events is downloaded together. Then every event
+    is fitted and analysed on its own fork of event_driven, in threads,
+    so the events share the price panels but never their fitted state,
+    and an event which fails does not stop the others.
+
+    Parameters
+    ----------
+    spec: dict or string
+        the specification (see check_spec) or the path of its file
+    event_driven: EventDriven, default None
+        the instance whose data and caches are used, a new one if None
+    threads: int, default 4
+        the number of events analysed at the same time
+
+    Returns
+    -------
+    report : dict
+        table -> DataFrame, for the tables of TABLES with rows; every
+        table starts with the column event
+    """
+    if isinstance(spec, str):
+        spec = load_spec(spec)
+    events = check_spec(spec)
+    event_driven = event_driven if event_driven is not None \
+        else EventDriven()
+    start = time.perf_counter()
+    whole_market = any(analysis in event['analyses']
+                       for event in events
+                       for analysis in ('abnormal_return', 'market_analysis'))
+    event_driven.preload(stock=whole_market)
+    preload = time.perf_counter() - start
+    start = time.perf_counter()
+    try:
+        event_driven.fit_many({event['name']: event['dates']
+                               for event in events}, display=False)
+        download = ('ok', '')
+    except BaseError as exception:
+        # fit() of every event downloads its own index and reports the error
+        download = (type(exception).__name__, str(exception))
+    timing = [{'event': '', 'analysis': 'preload', 'seconds': preload,
+               'status': 'ok', 'error': ''},
+              {'event': '', 'analysis': 'baidu_index',
+               'seconds': time.perf_counter() - start, 'status': download[0],
+               'error': download[1]}]
+    with ThreadPoolExecutor(threads) as pool:
+        outputs = list(pool.map(lambda event: run_event(event_driven, event),
+                                events))
+
+    tables = {table: [] for table in TABLES}
+    for event, (results, event_timing) in zip(events, outputs):
+        timing += event_timing
+        for analysis, result in results.items():
+            if analysis == 'fit' or result is None:
+                continue
+            table = to_table(analysis, result)
+            table.insert(0, 'event', event['id'])
+            tables[ANALYSES[analysis][1]].append(table)
+    report = {table: pd.concat(frames, ignore_index=True)
+              for table, frames in tables.items() if frames}
+    report['timing'] = pd.DataFrame(timing)
+    return report
+
+
+def write_report(report, path, report_format=None):
+    """
+    Write the tables of a batch report
+
+    Parameters
+    ----------
+    report: dict
+        the output of run_batch
+    path: string
+        an .html file, or the directory of one file per table
+    report_format: string, default None
+        'html', 'csv' or 'parquet' (which needs pyarrow or fastparquet),
+        'html' for a path ending with .html and 'csv' otherwise if None
+
+    Returns
+    -------
+    files : list
+        the paths written
+    """
+    if report_format is None:
+        report_format = 'html' if path.endswith(('.html', '.htm')) else 'csv'
+    tables = [table for table in TABLES if table in report]
+    if report_format == 'html':
+        sections = ['<h2>{title}</h2>\n{table}'.format(
+            title=html.escape(table),
+            table=report[table].to_html(index=False, na_rep=''))
+            for table in tables]
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write('<!DOCTYPE html>\n<html>\n<head><meta charset="utf-8">'
+                    '<title>Event study report</title></head>\n<body>\n' +
+                    '\n'.join(sections) + '\n</body>\n</html>\n')
+        return [path]
+    if report_format not in ('csv', 'parquet'):
+        raise InvalidBatchSpec("the format should be one of 'html', 'csv' "
+                               "and 'parquet'")
+    if not os.path.exists(path):
+        os.makedirs(path)
+    files = []
+    for table in tables:
+        filename = os.path.join(path, table + '.' + report_format)
+        if report_format == 'csv':
+            report[table].to_csv(filename, index=False,
+                                 encoding='utf-8-sig')
+        else:
+            report[table].to_parquet(filename, index=False)
+        files.append(filename)
+    return files
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Run the analyses of many events into one report')
+    parser.add_argument('spec', help='the JSON or YAML spec of the events')
+    parser.add_argument('--output', default='report.html',
+                        help='an .html file or a directory of tables')
+    parser.add_argument('--format', default=None,
+                        choices=['html', 'csv', 'parquet'])
+    parser.add_argument('--db', default=utility.DB_PATH)
+    parser.add_argument('--baidu-cache', default='baidu_index.db')
+    parser.add_argument('--threads', type=int, default=4,
+                        help='events analysed at the same time')
+    parser.add_argument('--workers', type=int, default=1,
+                        help='processes of the whole-market analyses')
+    args = parser.parse_args()
+    event = EventDriven(workers=args.workers, baidu_cache=args.baidu_cache,
+                        db_path=args.db)
+    try:
+        report = run_batch(args.spec, event, threads=args.threads)
+    finally:
+        event.close()
+    for filename in write_report(report, args.output, args.format):
+        print(filename)
+    failed = report['timing'].loc[report['timing']['status'] != 'ok']
+    if not failed.empty:
+        print(failed.to_string(index=False))
@@ -0,0 +1,409 @@
+# -*- coding: utf-8 -*-
+import os
+import sys
+import json
+import shutil
+import time
+import sqlite3
+import argparse
+import platform
+import tempfile
+import subprocess
+import tracemalloc
+import numpy as np
+import pandas as pd
+import store
+import synthetic
+from baidu_spider import BaiduIndex
+from baidu_stub import BaiduIndexStub
+from event_driven import EventDriven
+from datetime import datetime as dt
+try:
+    import resource
+except ImportError:
+    resource = None
+
+# the synthetic databases, from a quick check to a whole market
+SCALES = {
+    'small': {'stocks': 100, 'industries': 10, 'years': 3, 'events': 6},
+    'medium': {'stocks': 500, 'industries': 30, 'years': 6, 'events': 12},
+    'large': {'stocks': 3000, 'industries': 100, 'years': 8, 'events': 12}
+}
+# the event fitted by every benchmark
+EVENT_NAME = '降准'
+# the benchmarks, in the order they run
+CASES = ['spider', 'fit', 'get_index_effect', 'get_industry_effect',
+         'get_stock_effect', 'get_market_effect', 'get_abnormal_return',
+         'get_stock_analysis', 'get_market_analysis']
+
+
+def git_commit():
+    """
+    Get the commit of the working tree, with '+' appended if it has
+    uncommitted changes, None outside a git repository
+    """
+    cwd = os.path.dirname(os.path.abspath(__file__))
+    try:
+        commit = subprocess.check_output(
+            ['git', 'rev-parse', 'HEAD'], cwd=cwd,
+            stderr=subprocess.DEVNULL).decode().strip()
+        dirty = subprocess.check_output(
+            ['git', 'status', '--porcelain', '--untracked-files=no'],
+            cwd=cwd, stderr=subprocess.DEVNULL).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    return commit + ('+' if dirty else '')
+
+
+def prepare_database(directory, scale, seed=0, build_store=False):
+    """
+    Write the synthetic data.db of a scale into a directory, unless the
+    one written with the same settings is already there
+
+    Parameters
+    ----------
+    directory: string
+        the directory of data.db, and of its store if it is built
+    scale: dict
+        stocks, industries, years and events
+    seed: int, default 0
+        the seed of the data and of the event dates
+    build_store: boolean, default False
+        Whether to build the columnar store of data.db as well, or else
+        to remove the one of an earlier run
+
+    Returns
+    -------
+    setting : dict
+        db_path, event_date, the rows of the tables and the seconds taken
+    """
+    db_path = os.path.join(directory, 'data.db')
+    setting_path = os.path.join(directory, 'synthetic.json')
+    settings = dict(scale, seed=seed)
+    store_path = os.path.join(directory, 'data_store')
+    start = time.perf_counter()
+    setting = None
+    if os.path.exists(setting_path) and os.path.exists(db_path):
+        with open(setting_path) as f:
+            setting = json.load(f)
+    if setting is None or setting['settings'] != settings:
+        if os.path.exists(store_path):
+            shutil.rmtree(store_path)
+        rows = synthetic.make_database(
+            db_path, stocks=scale['stocks'], industries=scale['industries'],
+            years=scale['years'], seed=seed)
+        dates = synthetic.trading_dates(scale['years'])
+        setting = {
+            'settings': settings,
+            'db_path': db_path,
+            'rows': rows,
+            'event_date': synthetic.make_events(dates, scale['events'], seed)
+        }
+        with open(setting_path, 'w') as f:
+            json.dump(setting, f, ensure_ascii=False)
+    if build_store and not store.PanelStore.exists(store_path):
+        conn = sqlite3.connect(db_path)
+        try:
+            store.build_store(conn, store_path)
+        finally:
+            conn.close()
+    if not build_store and os.path.exists(store_path):
+        shutil.rmtree(store_path)
+    setting['seconds'] = time.perf_counter() - start
+    return setting
+
+
+def measure(prepare, repeat=3, memory=True):
+    """
+    Time a benchmark and measure the memory it allocates
+
+    Parameters
+    ----------
+    prepare: callable
+        called without arguments (and not timed) to get the function to
+        time, which is then called repeat times
+    repeat: int, default 3
+        the number of timed calls
+    memory: boolean, default True
+        Whether to call a freshly prepared function once more under
+        tracemalloc, which slows it down, to get its peak allocation
+
+    Returns
+    -------
+    result : dict
+        cold: the seconds of the first call
+        warm: the fewest seconds of the following calls, cold if repeat
+        is 1
+        peak_mb: the most memory allocated at once by the first call
+    """
+    func = prepare()
+    seconds = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        seconds.append(time.perf_counter() - start)
+    result = {'cold': seconds[0],
+              'warm': min(seconds[1:]) if len(seconds) > 1 else seconds[0],
+              'peak_mb': None}
+    if memory:
+        func = prepare()
+        tracemalloc.start()
+        try:
+            func()
+            result['peak_mb'] = tracemalloc.get_traced_memory()[1] / 2 ** 20
+        finally:
+            tracemalloc.stop()
+    return result
+
+
+def run_scale(name, scale, directory, repeat=3, memory=True, workers=1,
+              build_store=False, cases=CASES, seed=0, delay=0.0):
+    """
+    Run the benchmarks on the synthetic database of a scale
+
+    Parameters
+    ----------
+    name: string
+        the name of the scale
+    scale: dict
+        stocks, industries, years and events
+    directory: string
+        the directory of the database of the scale
+    repeat: int, default 3
+        the number of timed calls of every benchmark
+    memory: boolean, default True
+        Whether to measure the peak allocation
+    workers: int, default 1
+        the workers of EventDriven
+    build_store: boolean, default False
+        Whether to read the columnar store instead of data.db
+    cases: list, default CASES
+        the benchmarks to run
+    seed: int, default 0
+        the seed of the data
+    delay: float, default 0
+        the seconds the stub server waits before answering
+
+    Returns
+    -------
+    report : dict
+    """
+    if not os.path.exists(directory):
+        os.makedirs(directory)
+    setting = prepare_database(directory, scale, seed, build_store)
+    db_path = setting['db_path']
+    event_date = setting['event_date']
+    today = dt.now().strftime('%Y-%m-%d')
+    baidu_path = os.path.join(directory, 'baidu_index.db')
+    conn = sqlite3.connect(db_path)
+    stock, industry = conn.execute(
+        'select stock, industry_name from stock_industry order by stock '
+        'limit 1').fetchone()
+    industry_rows = conn.execute(
+        'select count(*) from stock join stock_industry on stkcode = stock '
+        'where industry_name = ?', (industry,)).fetchone()[0]
+    conn.close()
+    rows = setting['rows']
+    windows = 31 * 31 * len(event_date)
+    # fit() downloads the Baidu Index from 2011 to today
+    baidu_days = (pd.Timestamp(today) - pd.Timestamp('2011-01-01')).days + 1
+
+    with BaiduIndexStub({EVENT_NAME: event_date}, delay=delay) as stub:
+        options = {'base_url': stub.url, 'rate_limiter': None}
+
+        def new_event():
+            event = EventDriven(workers=workers, baidu_cache=baidu_path,
+                                db_path=db_path, result_cache_size=0,
+                                baidu_options=options)
+            event.fit(event_date, EVENT_NAME, display=False)
+            return event
+
+        def prepare_fit():
+            if os.path.exists(baidu_path):
+                os.remove(baidu_path)
+            return new_event
+
+        def prepare_spider():
+            return lambda: BaiduIndex(EVENT_NAME, '2011-01-01', today,
+                                      **options)
+
+        def prepare(method, *args, **kwargs):
+            def prepared():
+                event = new_event()
+                return lambda: getattr(event, method)(*args, **kwargs)
+            return prepared
+
+        benchmarks = {
+            'spider': (prepare_spider, baidu_days, 'days'),
+            'fit': (prepare_fit, baidu_days, 'days'),
+            'get_index_effect': (prepare('get_index_effect'),
+                                 rows['index'], 'rows'),
+            'get_industry_effect': (prepare('get_industry_effect'),
+                                    rows['industry'], 'rows'),
+            'get_stock_effect': (prepare('get_stock_effect',
+                                         industry=industry),
+                                 industry_rows, 'rows'),
+            'get_market_effect': (prepare('get_market_effect'),
+                                  rows['stock'], 'rows'),
+            'get_abnormal_return': (prepare('get_abnormal_return',
+                                            industry=industry),
+                                    industry_rows, 'rows'),
+            'get_stock_analysis': (prepare('get_stock_analysis', stock=stock,
+                                           detail=False), windows, 'windows'),
+            'get_market_analysis': (prepare('get_market_analysis'),
+                                    windows * scale['stocks'], 'windows')
+        }
+        results = {}
+        for case in cases:
+            prepare_case, units, unit = benchmarks[case]
+            stub.calls = stub.bytes_sent = 0
+            result = measure(prepare_case, repeat, memory)
+            result.update({
+                'units': units,
+                'unit': unit,
+                'throughput': units / result['warm'] if result['warm']
+                else None,
+                'http_calls': stub.calls,
+                'bytes_fetched': stub.bytes_sent
+            })
+            results[case] = result
+            print('{scale:>8} {case:<22} cold {cold:8.3f}s  warm {warm:8.3f}s'
+                  '  {throughput:>12,.0f} {unit}/s  peak {peak}'.format(
+                      scale=name, case=case, peak='-' if result['peak_mb']
+                      is None else '%.1f MB' % result['peak_mb'], **result),
+                  file=sys.stderr)
+    return {
+        'settings': setting['settings'],
+        'rows': rows,
+        'setup_seconds': setting['seconds'],
+        'store': build_store,
+        'workers': workers,
+        'cases': results
+    }
+
+
+def run(scales=('small',), directory=None, repeat=3, memory=True,
+        workers=1, build_store=False, cases=CASES, seed=0, delay=0.0):
+    """
+    Run the benchmarks at several scales and report them in a form that
+    can be compared across commits
+
+    Parameters
+    ----------
+    scales: list, default ('small',)
+        the names of SCALES to run
+    directory: string, default None
+        where the databases are kept (one directory per scale) and reused
+        by later runs, a temporary directory if None
+    repeat, memory, workers, build_store, cases, seed, delay:
+        see run_scale
+
+    Returns
+    -------
+    report : dict
+        commit, time, platform, versions and one entry per scale
+    """
+    directory = directory or tempfile.mkdtemp(prefix='event_driven_bench_')
+    report = {
+        'commit': git_commit(),
+        'time': dt.now().isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'pandas': pd.__version__,
+        'platform': platform.platform(),
+        'scales': {}
+    }
+    for name in scales:
+        report['scales'][name] = run_scale(
+            name, SCALES[name], os.path.join(directory, name), repeat, memory,
+            workers, build_store, cases, seed, delay)
+    if resource is not None:
+        # kilobytes on Linux, bytes on macOS
+        scale = 1 if sys.platform == 'darwin' else 1024
+        report['max_rss_mb'] = resource.getrusage(
+            resource.RUSAGE_SELF).ru_maxrss * scale / 2 ** 20
+    return report
+
+
+def compare(base, head):
+    """
+    Compare two reports of run, the ratios below 1 being improvements
+
+    Parameters
+    ----------
+    base: dict
+        the report of the reference commit
+    head: dict
+        the report of the commit to check
+
+    Returns
+    -------
+    result : DataFrame
+        indexed by scale and case
+    """
+    rows = []
+    for name, scale in head['scales'].items():
+        if name not in base['scales']:
+            continue
+        for case, result in scale['cases'].items():
+            old = base['scales'][name]['cases'].get(case)
+            if old is None:
+                continue
+            row = {'scale': name, 'case': case}
+            for field in ['cold', 'warm', 'peak_mb']:
+                row[field] = result[field]
+                row[field + '_ratio'] = result[field] / old[field] \
+                    if result[field] is not None and old[field] else None
+            rows.append(row)
+    return pd.DataFrame(rows).set_index(['scale', 'case'])
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Time EventDriven on synthetic data and a local stub of '
+                    'the Baidu Index')
+    commands = parser.add_subparsers(dest='command')
+    run_parser = commands.add_parser('run', help='run the benchmarks')
+    run_parser.add_argument('--scales', nargs='+', default=['small'],
+                            choices=sorted(SCALES))
+    run_parser.add_argument('--cases', nargs='+', default=CASES,
+                            choices=CASES)
+    run_parser.add_argument('--dir', default=None,
+                            help='keep the databases here for later runs')
+    run_parser.add_argument('--repeat', type=int, default=3)
+    run_parser.add_argument('--workers', type=int, default=1)
+    run_parser.add_argument('--store', action='store_true',
+                            help='read the columnar store of data.db')
+    run_parser.add_argument('--no-memory', action='store_true',
+                            help='skip the tracemalloc pass')
+    run_parser.add_argument('--delay', type=float, default=0.0,
+                            help='seconds of latency of the stub server')
+    run_parser.add_argument('--seed', type=int, default=0)
+    run_parser.add_argument('--output', default=None,
+                            help='write the report to this JSON file')
+    compare_parser = commands.add_parser(
+        'compare', help='compare two reports written by run')
+    compare_parser.add_argument('base')
+    compare_parser.add_argument('head')
+    args = parser.parse_args()
+    if args.command == 'compare':
+        with open(args.base) as f:
+            base = json.load(f)
+        with open(args.head) as f:
+            head = json.load(f)
+        pd.set_option('display.width', 200)
+        print('{base} -> {head}'.format(base=base['commit'],
+                                        head=head['commit']))
+        print(compare(base, head).to_string(float_format='%.3f'))
+    elif args.command == 'run':
+        report = run(args.scales, args.dir, args.repeat, not args.no_memory,
+                     args.workers, args.store, args.cases, args.seed,
+                     args.delay)
+        text = json.dumps(report, indent=2, ensure_ascii=False)
+        if args.output:
+            with open(args.output, 'w') as f:
+                f.write(text)
+        else:
+            print(text)
+    else:
+        parser.print_help()
@@ -0,0 +1,155 @@
+# -*- coding: utf-8 -*-
+import numpy as np
+import pandas as pd
+
+# the fields narrowed to float32 even though a little precision is lost
+LOSSY_FIELDS = ('return',)
+
+
+def narrow(values, lossy=False):
+    """
+    Store a float array in float32 when that loses nothing, or when the
+    loss is acceptable
+
+    Parameters
+    ----------
+    values: ndarray
+        the float array, NaN marking the missing values
+    lossy: boolean, default False
+        Whether to narrow it even if some values change
+
+    Returns
+    -------
+    values : ndarray
+    """
+    values = np.asarray(values)
+    if values.dtype.kind != 'f' or values.dtype.itemsize <= 4:
+        return values
+    narrowed = values.astype(np.float32)
+    if lossy or np.array_equal(narrowed.astype(values.dtype), values,
+                               equal_nan=True):
+        return narrowed
+    return values
+
+
+def compact_frame(data, key):
+    """
+    Shrink one of the long price tables: the entity names become a
+    categorical of integer ids, the returns float32, and the other numeric
+    columns int64 or float32 when no precision is lost
+
+    Parameters
+    ----------
+    data: DataFrame
+        the long table indexed by date
+    key: string
+        the column holding the entity name, e.g. stkcode
+
+    Returns
+    -------
+    data : DataFrame
+    """
+    columns = {}
+    for column in data.columns:
+        values = data[column]
+        if column == key:
+            values = values.astype('category')
+        elif pd.api.types.is_float_dtype(values):
+            array = values.values
+            if values.notna().all() and np.array_equal(np.round(array),
+                                                       array):
+                array = array.astype(np.int64)
+            else:
+                array = narrow(array, lossy=column in LOSSY_FIELDS)
+            values = pd.Series(array, index=values.index, name=column)
+        columns[column] = values
+    return pd.DataFrame(columns, index=data.index)
+
+
+class GroupIndex(object):
+    """
+    The members of every group (e.g. the stocks of every industry) stored
+    as one array sorted by group, so that the members of a group are a
+    contiguous slice found with one dict lookup
+    """
+
+    def __init__(self, members, groups):
+        """
+        Parameters
+        ----------
+        members: array-like
+            the member of each row, e.g. the stock codes
+        groups: array-like
+            the group of each row, e.g. the industry names
+        """
+        group_ids, self.groups = pd.factorize(np.asarray(groups), sort=True)
+        order = np.argsort(group_ids, kind='stable')
+        self.members = np.asarray(members)[order]
+        self.group_ids = group_ids[order]
+        bounds = np.searchsorted(self.group_ids,
+                                 np.arange(len(self.groups) + 1))
+        self.ids = {group: i for i, group in enumerate(self.groups)}
+        self.ranges = {group: (bounds[i], bounds[i + 1])
+                       for group, i in self.ids.items()}
+        self.__member_group = {}
+        for member, i in zip(self.members, self.group_ids):
+            self.__member_group.setdefault(member, self.groups[i])
+
+    @classmethod
+    def from_frame(cls, data, member='stock', group='industry_name'):
+        """
+        Build the index from a lookup table such as stock_industry
+
+        Parameters
+        ----------
+        data: DataFrame
+            the lookup table
+        member: string, default 'stock'
+            the column holding the members
+        group: string, default 'industry_name'
+            the column holding the groups
+
+        Returns
+        -------
+        index : GroupIndex
+        """
+        return cls(data[member].values, data[group].values)
+
+    def get_members(self, group):
+        """
+        Get the members of a group, without copying
+
+        Parameters
+        ----------
+        group: string
+            the name of the group
+
+        Returns
+        -------
+        members : ndarray
+            empty if the group is unknown
+        """
+        start, stop = self.ranges.get(group, (0, 0))
+        return self.members[start:stop]
+
+    def get_group(self, member):
+        """
+        Get the group of a member, the first one if it is in several
+
+        Parameters
+        ----------
+        member: string
+            the name of the member
+
+        Returns
+        -------
+        group : string or None
+        """
+        return self.__member_group.get(member)
+
+    def __contains__(self, group):
+        return group in self.ranges
+
+
+if __name__ == '__main__':
+    pass
@@ -6,14 +6,29 @@ if __name__ == "__main__":
     # 获取降准事件的影响时间范围
     print(event.fit(event.rrr_date, '降准', display=True))
 
+    # 一次性获取多个事件的影响时间范围（百度指数批量下载），之后对其中任一事件调用fit不再重复下载
+    print(event.fit_many({'降准': event.rrr_date, '加息': ['2015-12-17']}))
+
     # 获取降准事件对大盘的影响
     print(event.get_index_effect())
 
     # 获取降准事件对不同行业的影响（按收益率从低到高排序，返回前5的行业）
     print(event.get_industry_effect(ascending=False, head=5))
 
+    # 与10000组随机放置的伪事件窗口比较，给出行业影响的显著性（p值）
+    print(event.get_industry_effect(head=5, resamples=10000))
+
     # 获取降准事件对某一个行业所有股票的影响（按收益率从低到高排序，返回前5的股票）
     print(event.get_stock_effect(industry='银行III'))
 
+    # 获取降准事件对全市场所有股票（相对所属行业）的影响，每次只读取500只股票的数据，内存占用与股票总数无关
+    print(event.get_market_effect(head=10, chunk_size=500))
+
+    # 基于市场模型的事件研究：某一个行业所有股票的累计异常收益率（CAR）及其t统计量
+    print(event.get_abnormal_return(industry='银行III', head=5)['summary'])
+
     # 获取针对降准事件，某一支股票的最优买入卖出时机
     print(event.get_stock_analysis(stock='600036.XSHG', detail=False))
+
+    # 获取针对降准事件，全市场所有股票的最优买入卖出时机（按最优收益率排序）
+    print(event.get_market_analysis(head=10))
@@ -0,0 +1,125 @@
+# -*- coding: utf-8 -*-
+import warnings
+import numpy as np
+import pandas as pd
+from errors import InvalidDetector
+
+# the scale making the median absolute deviation match the standard
+# deviation of normally distributed data
+MAD_SCALE = 1.4826
+# the methods telling the outstanding days of the Baidu Index
+DETECTORS = ('median', 'zscore', 'mad')
+
+
+def influence_windows(values, positions, method='median', threshold=3,
+                      window=60):
+    """
+    Find the first and last day of every window whose Baidu Index stands out
+    from the rest of the window
+
+    Parameters
+    ----------
+    values: ndarray
+        the Baidu Index on a daily grid, NaN on the days without data
+    positions: ndarray
+        the position in values of the first day of each window, which may
+        fall outside values
+    method: string, default 'median'
+        'median': value >= threshold × median of the window
+        'zscore': (value - mean) / std >= threshold
+        'mad': (value - median) / (1.4826 × MAD) >= threshold
+    threshold: float, default 3
+        the multiplier of the detector
+    window: int, default 60
+        the number of days in each window
+
+    Returns
+    -------
+    first : ndarray
+        the offset of the first outstanding day in each window, -1 if none
+    last : ndarray
+        the offset of the last outstanding day in each window, -1 if none
+    """
+    raw = np.asarray(positions)[:, None] + np.arange(window)
+    inside = (raw >= 0) & (raw < len(values))
+    data = np.where(inside, values[np.clip(raw, 0, max(len(values) - 1, 0))]
+                    if len(values) else np.nan, np.nan)
+    with warnings.catch_warnings(), np.errstate(invalid='ignore',
+                                                divide='ignore'):
+        warnings.simplefilter('ignore', RuntimeWarning)
+        if method == 'median':
+            crossed = data >= threshold * np.nanmedian(data, axis=1)[:, None]
+        elif method == 'zscore':
+            score = (data - np.nanmean(data, axis=1)[:, None]) / \
+                    np.nanstd(data, axis=1)[:, None]
+            crossed = score >= threshold
+        elif method == 'mad':
+            median = np.nanmedian(data, axis=1)[:, None]
+            mad = np.nanmedian(np.abs(data - median), axis=1)[:, None]
+            crossed = (data - median) / (MAD_SCALE * mad) >= threshold
+        else:
+            raise InvalidDetector(
+                "method should be one of 'median', 'zscore' and 'mad'")
+    found = crossed.any(axis=1)
+    first = np.where(found, crossed.argmax(axis=1), -1)
+    last = np.where(found, window - 1 - crossed[:, ::-1].argmax(axis=1), -1)
+    return first, last
+
+
+def detect_influenced_dates(baidu_index, event_date, method='median',
+                            threshold=3, window=60, offset=30):
+    """
+    Get the periods during which each event has profound effects from the
+    Baidu Index of the event, evaluating all events in one pass
+
+    The window of an event starts offset days before the event date and
+    lasts window days. When no day stands out the period is the event date
+    alone.
+
+    Parameters
+    ----------
+    baidu_index: DataFrame
+        the Baidu Index indexed by date, with a column named index
+    event_date: DatetimeIndex
+        the event dates
+    method: string, default 'median'
+        the detector, one of 'median', 'zscore' and 'mad'
+    threshold: float, default 3
+        the multiplier of the detector
+    window: int, default 60
+        the number of days in each window
+    offset: int, default 30
+        how many days before the event date each window starts
+
+    Returns
+    -------
+    event_influenced_date : dict
+    """
+    event_date = pd.DatetimeIndex(event_date)
+    series = baidu_index['index'].dropna()
+    start = event_date - pd.Timedelta(days=offset)
+    if series.empty:
+        values = np.array([])
+        positions = np.zeros(len(event_date), dtype=np.int64)
+    else:
+        origin = series.index.min()
+        values = series.reindex(pd.date_range(origin, series.index.max())
+                                ).values.astype(np.float64)
+        positions = np.asarray((start - origin).days, dtype=np.int64)
+    first, last = influence_windows(values, positions, method=method,
+                                    threshold=threshold, window=window)
+
+    event_influenced_date = {}
+    for date, begin, i, j in zip(event_date, start, first, last):
+        if i < 0:
+            event_influenced_date[date] = pd.date_range(start=date, periods=1,
+                                                        freq='D')
+        else:
+            event_influenced_date[date] = pd.date_range(
+                start=begin + pd.Timedelta(days=int(i)),
+                end=begin + pd.Timedelta(days=int(j)))
+    return event_influenced_date
+
+
+if __name__ == '__main__':
+    pass
@@ -0,0 +1,98 @@
+# -*- coding: utf-8 -*-
+import numpy as np
+import pandas as pd
+
+
+def stack_windows(event_influenced_date, calendar=None):
+    """
+    Stack the influenced periods of all events into one frame of
+    (event id, date) pairs
+
+    Parameters
+    ----------
+    event_influenced_date: dict
+        event date -> the influenced period of the event
+    calendar: TradingCalendar, default None
+        if given, each period is cut down to its trading days as one slice
+        of the calendar
+
+    Returns
+    -------
+    windows : DataFrame
+        indexed by date, with the position of the event in the column event
+    """
+    periods = list(event_influenced_date.values())
+    if calendar is not None:
+        bounds = np.array([[calendar.position(period[0], 'left'),
+                            calendar.position(period[-1], 'right')]
+                           if len(period) else [0, 0]
+                           for period in periods],
+                          dtype=np.int64).reshape(-1, 2)
+        lengths = np.maximum(bounds[:, 1] - bounds[:, 0], 0)
+        offsets = np.arange(lengths.sum()) - np.repeat(
+            np.cumsum(lengths) - lengths, lengths)
+        dates = calendar.values[np.repeat(bounds[:, 0], lengths) + offsets]
+    else:
+        lengths = [len(period) for period in periods]
+        dates = np.concatenate([pd.DatetimeIndex(period).values
+                                for period in periods]) if periods else []
+    windows = pd.DataFrame(
+        {'event': np.repeat(np.arange(len(periods)), lengths)},
+        index=pd.DatetimeIndex(dates, name='date'))
+    return windows
+
+
+def aggregate_effect(data, key, event_influenced_date, benchmark=None,
+                     calendar=None):
+    """
+    Compute the mean return, summed volume and rise probability of every
+    entity over the influenced periods of an event
+
+    All windows are joined to the data in one step, reduced per event and
+    entity, and then averaged across events.
+
+    Parameters
+    ----------
+    data: DataFrame
+        the long table indexed by date, with the columns key, return and
+        volume
+    key: string
+        the column holding the entity name, e.g. industry_name
+    event_influenced_date: dict
+        event date -> the influenced period of the event
+    benchmark: Series, default None
+        the daily return of a benchmark indexed by date, whose mean over
+        each period is subtracted from the mean return of the entities
+    calendar: TradingCalendar, default None
+        the market calendar, which keeps only the trading days of the
+        periods before the join
+
+    Returns
+    -------
+    result : DataFrame
+        indexed by entity, with the columns return, up_prob and volume
+        (the mean across events of the summed volume)
+    """
+    windows = stack_windows(event_influenced_date, calendar=calendar)
+    stacked = windows.join(data[[key, 'return', 'volume']], how='inner')
+    per_event = stacked.groupby(['event', key], observed=True).agg({
+        'return': 'mean',
+        'volume': 'sum'
+    })
+    if benchmark is not None:
+        bench = windows.join(benchmark.rename('bench'), how='left')
+        bench = bench.groupby('event')['bench'].mean()
+        per_event['return'] -= bench.reindex(
+            per_event.index.get_level_values('event')).values
+    per_event['up_prob'] = per_event['return'] >= 0
+    result = per_event.groupby(level=key, observed=True).agg({
+        'return': 'mean',
+        'up_prob': 'mean',
+        'volume': 'mean'
+    })
+    result['up_prob'] = result['up_prob'].astype(float)
+    return result
+
+
+if __name__ == '__main__':
+    pass
@@ -0,0 +1,298 @@
+# -*- coding: utf-8 -*-
+import numpy as np
+import pandas as pd
+from trading_calendar import TradingCalendar
+
+# the number of grid cells evaluated at once by panel_best_window
+GRID_BUDGET = 2 ** 22
+
+
+def cumulative_log_return(returns):
+    """
+    Build the prefix sums of log(1 + return) along the date axis so that
+    the compounded return of any window can be read off with two lookups
+
+    Parameters
+    ----------
+    returns: array-like
+        the daily returns ordered by date, one column per entity if 2-D
+
+    Returns
+    -------
+    cum_ret : ndarray
+        an array one row longer than returns, starting with 0
+    """
+    returns = np.asarray(returns, dtype=np.float64)
+    cum_ret = np.zeros((returns.shape[0] + 1,) + returns.shape[1:])
+    np.cumsum(np.log1p(returns), axis=0, out=cum_ret[1:])
+    return cum_ret
+
+
+def cumulative_arrays(returns):
+    """
+    Build every prefix sum of the daily returns used to read window
+    statistics off in two lookups: log(1 + return) for compounded returns,
+    the returns for mean returns, and the number of trading days
+
+    Parameters
+    ----------
+    returns: ndarray
+        the daily returns of shape (dates, entities), NaN on the days an
+        entity did not trade
+
+    Returns
+    -------
+    cumulative : dict
+        log, sum and count, each one row longer than returns and starting
+        with 0
+    """
+    returns = np.asarray(returns, dtype=np.float64)
+    traded = ~np.isnan(returns)
+    returns = np.where(traded, returns, 0.0)
+    total = np.zeros((returns.shape[0] + 1,) + returns.shape[1:])
+    np.cumsum(returns, axis=0, out=total[1:])
+    count = np.zeros(total.shape, dtype=np.int64)
+    np.cumsum(traded, axis=0, out=count[1:])
+    return {
+        'log': cumulative_log_return(returns),
+        'sum': total,
+        'count': count
+    }
+
+
+def window_bounds(dates, event_date, before, after, calendar=None,
+                  unit='calendar'):
+    """
+    Locate the trading rows covered by every window around every event date
+
+    Parameters
+    ----------
+    dates: DatetimeIndex
+        the sorted trading dates of the data
+    event_date: DatetimeIndex
+        the event dates
+    before: int
+        the largest number of days before the event date
+    after: int
+        the largest number of days after the event date
+    calendar: TradingCalendar, default None
+        the market calendar counting the trading days, built from dates if
+        None
+    unit: string, default 'calendar'
+        whether before and after count 'calendar' or 'trading' days
+
+    Returns
+    -------
+    start : ndarray
+        start[e, b] is the first row of the window opened b days before
+        the event e
+    end : ndarray
+        end[e, a] is one past the last row of the window closed a days
+        after the event e
+    """
+    if unit != 'calendar':
+        if calendar is None:
+            calendar = TradingCalendar(dates)
+        return calendar.window_bounds(dates, event_date, before, after, unit)
+    dates = pd.DatetimeIndex(dates).values
+    event_date = pd.DatetimeIndex(event_date).values
+    before_offset = np.arange(before + 1) * np.timedelta64(1, 'D')
+    after_offset = np.arange(after + 1) * np.timedelta64(1, 'D')
+    start = np.searchsorted(dates, event_date[:, None] - before_offset,
+                            side='left')
+    end = np.searchsorted(dates, event_date[:, None] + after_offset,
+                          side='right')
+    return start, end
+
+
+def panel_return_grid(dates, returns, event_date, before, after,
+                      calendar=None, unit='calendar', cumulative=None):
+    """
+    Compute the mean cumulative return across events for every entity and
+    every combination of the days before and after the event date
+
+    The events are walked in order and, like the original loop, a window
+    without any trading day stops the averaging for that combination.
+
+    Parameters
+    ----------
+    dates: DatetimeIndex
+        the sorted dates of the rows of returns
+    returns: ndarray
+        the daily returns of shape (dates, entities), NaN on the days an
+        entity did not trade
+    event_date: DatetimeIndex
+        the event dates
+    before: int
+        the largest number of days before the event date
+    after: int
+        the largest number of days after the event date
+    calendar, unit:
+        the same as window_bounds
+    cumulative: dict, default None
+        the output of cumulative_arrays for returns, computed if None
+
+    Returns
+    -------
+    grid : ndarray
+        grid[s, b, a] is the mean return of buying entity s b days before
+        and selling it a days after the event, NaN if no event could be
+        evaluated
+    """
+    if cumulative is None:
+        cumulative = cumulative_arrays(returns)
+    cum_ret = cumulative['log']
+    cum_count = cumulative['count']
+    start, end = window_bounds(dates, event_date, before, after,
+                               calendar=calendar, unit=unit)
+    start = start[:, :, None]
+    end = end[:, None, :]
+    valid = cum_count[end] > cum_count[start]
+    valid = np.logical_and.accumulate(valid, axis=0)
+    event_ret = np.expm1(cum_ret[end] - cum_ret[start])
+    count = valid.sum(axis=0)
+    total = np.where(valid, event_ret, 0.0).sum(axis=0)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        grid = np.where(count > 0, total / count, np.nan)
+    return np.moveaxis(grid, -1, 0)
+
+
+def window_return_grid(data, event_date, before, after, calendar=None,
+                       unit='calendar'):
+    """
+    Compute the mean cumulative return across events for every combination
+    of the days before and after the event date
+
+    Parameters
+    ----------
+    data: DataFrame
+        the DataFrame of stock or industry indexed by date, with a column
+        named return
+    event_date: DatetimeIndex
+        the event dates
+    before: int
+        the largest number of days before the event date
+    after: int
+        the largest number of days after the event date
+    calendar, unit:
+        the same as window_bounds
+
+    Returns
+    -------
+    grid : ndarray
+        grid[b, a] is the mean return of buying b days before and selling
+        a days after the event, NaN if no event could be evaluated
+    """
+    data = data.dropna().sort_index()
+    return panel_return_grid(data.index, data[['return']].values,
+                             event_date, before, after, calendar=calendar,
+                             unit=unit)[0]
+
+
+def best_window(grid):
+    """
+    Find the best holding window of every entity, leaving out the window
+    that both opens and closes on the event date
+
+    Parameters
+    ----------
+    grid: ndarray
+        the return grids of shape (entities, before + 1, after + 1)
+
+    Returns
+    -------
+    best_buy : ndarray
+        the number of days before the event to buy
+    best_sell : ndarray
+        the number of days after the event to sell
+    best_return : ndarray
+        the mean return of the best window, NaN if there is none
+    """
+    flat = grid.reshape(grid.shape[0], -1).copy()
+    flat[:, 0] = np.nan
+    pos = np.where(np.isnan(flat), -np.inf, flat).argmax(axis=1)
+    best_return = flat[np.arange(flat.shape[0]), pos]
+    best_buy, best_sell = np.unravel_index(pos, grid.shape[1:])
+    return best_buy, best_sell, best_return
+
+
+def panel_best_window(dates, returns, event_date, before, after,
+                      chunk_size=None, calendar=None, unit='calendar',
+                      cumulative=None):
+    """
+    Find the best holding window of every column of a price panel
+
+    The columns are processed in chunks so that the (events × before ×
+    after × entities) intermediate arrays stay within a fixed budget.
+
+    Parameters
+    ----------
+    dates: DatetimeIndex
+        the sorted dates of the rows of returns
+    returns: ndarray
+        the daily returns of shape (dates, entities)
+    event_date: DatetimeIndex
+        the event dates
+    before: int
+        the largest number of days before the event date
+    after: int
+        the largest number of days after the event date
+    chunk_size: int, default None
+        the number of entities per chunk, sized from GRID_BUDGET if None
+    calendar, unit:
+        the same as window_bounds
+    cumulative: dict, default None
+        the output of cumulative_arrays for returns, computed by chunk if
+        None
+
+    Returns
+    -------
+    best_buy, best_sell, best_return : ndarray
+    """
+    if chunk_size is None:
+        cells = len(event_date) * (before + 1) * (after + 1)
+        chunk_size = max(1, GRID_BUDGET // max(cells, 1))
+    best = [np.empty(returns.shape[1], dtype=np.int64),
+            np.empty(returns.shape[1], dtype=np.int64),
+            np.empty(returns.shape[1])]
+    for lo in range(0, returns.shape[1], chunk_size):
+        hi = min(lo + chunk_size, returns.shape[1])
+        grid = panel_return_grid(
+            dates, returns[:, lo:hi], event_date, before, after,
+            calendar=calendar, unit=unit,
+            cumulative=None if cumulative is None else
+            {name: values[:, lo:hi] for name, values in cumulative.items()})
+        for out, value in zip(best, best_window(grid)):
+            out[lo:hi] = value
+    return tuple(best)
+
+
+def grid_to_frame(grid, ind_grid):
+    """
+    Flatten the return grids of a stock and its industry into the detail
+    DataFrame used by get_stock_analysis
+
+    Parameters
+    ----------
+    grid: ndarray
+        the return grid of the stock
+    ind_grid: ndarray
+        the return grid of the industry
+
+    Returns
+    -------
+    result : DataFrame
+    """
+    before, after = np.meshgrid(np.arange(grid.shape[0]),
+                                np.arange(grid.shape[1]), indexing='ij')
+    result = pd.DataFrame({
+        'before': before.ravel(),
+        'after': after.ravel(),
+        'return': grid.ravel(),
+        'ind_ret': ind_grid.ravel()
+    }, index=np.arange(1, grid.size + 1))
+    return result
+
+
+if __name__ == '__main__':
+    pass
@@ -4,7 +4,17 @@ __all__ = [
     'InvalidDateList',
     'NoEventDefined',
     'InvalidStockCode',
-    'InvalidIndustryName'
+    'InvalidIndustryName',
+    'InvalidIndexName',
+    'BaiduIndexError',
+    'InvalidDetector',
+    'InvalidWindowUnit',
+    'InvalidWindowLength',
+    'InvalidSignificanceMethod',
+    'InvalidIngestData',
+    'InvalidRequest',
+    'ServiceBusy',
+    'InvalidBatchSpec'
 ]
 
 
@@ -31,3 +41,53 @@ class InvalidStockCode(BaseError):
 class InvalidIndustryName(BaseError):
     """Base class for exceptions related to invalid industry name"""
     pass
+
+
+class InvalidIndexName(BaseError):
+    """Base class for exceptions related to invalid index name"""
+    pass
+
+
+class BaiduIndexError(BaseError):
+    """Base class for exceptions related to failed Baidu Index requests"""
+    pass
+
+
+class InvalidDetector(BaseError):
+    """Base class for exceptions related to invalid detector settings"""
+    pass
+
+
+class InvalidWindowUnit(BaseError):
+    """Base class for exceptions related to invalid window units"""
+    pass
+
+
+class InvalidWindowLength(BaseError):
+    """Base class for exceptions related to invalid window lengths"""
+    pass
+
+
+class InvalidSignificanceMethod(BaseError):
+    """Base class for exceptions related to invalid significance methods"""
+    pass
+
+
+class InvalidIngestData(BaseError):
+    """Base class for exceptions related to invalid rows to ingest"""
+    pass
+
+
+class InvalidRequest(BaseError):
+    """Base class for exceptions related to invalid service requests"""
+    pass
+
+
+class ServiceBusy(BaseError):
+    """Base class for exceptions related to a service with a full queue"""
+    pass
+
+
+class InvalidBatchSpec(BaseError):
+    """Base class for exceptions related to invalid batch specifications"""
+    pass
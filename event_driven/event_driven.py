@@ -1,23 +1,96 @@
 # -*- coding: utf-8 -*-
+import copy
+import threading
+import numpy as np
 import pandas as pd
 import utility
+import engine
+import effect
+import detector
+import parallel
+import event_study
+import significance
+from panel import Panel, merge_periods
+from compact import GroupIndex, compact_frame
+from trading_calendar import TradingCalendar
+from result_cache import ResultCache
+from instrument import get_instrument
 from errors import *
 from baidu_spider import BaiduIndex
+from baidu_cache import BaiduIndexCache
+from config import BAIDU_MAX_KEYWORDS
 from datetime import datetime as dt
 
 
+def _stock_effect_task(panel, event_influenced_date, benchmark, calendar):
+    panel = panel.between(list(event_influenced_date.values()))
+    return effect.aggregate_effect(panel.to_frame('stkcode'), 'stkcode',
+                                   event_influenced_date, benchmark=benchmark,
+                                   calendar=calendar)
+
+
+def _best_window_task(panel, event_date, before, after, chunk_size, calendar,
+                      unit):
+    return engine.panel_best_window(panel.dates, panel['return'], event_date,
+                                    before, after, chunk_size=chunk_size,
+                                    calendar=calendar, unit=unit,
+                                    cumulative=panel.cumulative())
+
+
 class EventDriven(object):
-    def __init__(self):
-        self.__data = {'industry': utility.get_industry_data(),
-                       'index': utility.get_index_data(),
-                       'stock_ind': utility.get_stock_industry()
-                       }
-        self.__trading_date = self.__data['industry'].index.unique()
-        self.__all_date = pd.date_range(self.__trading_date[0],
-                                        self.__trading_date[-1])
+    def __init__(self, workers=1, baidu_cache='baidu_index.db',
+                 db_path=utility.DB_PATH, compact=False,
+                 result_cache_size=128, result_cache_path=None,
+                 baidu_options=None, instrument=None):
+        """
+        The tables of the database are only read when a method needs them
+
+        Parameters
+        ----------
+        workers: int, default 1
+            the number of processes used by get_stock_effect and
+            get_market_analysis, which run in this process if 1; the
+            processes are started on first use, share the table stock and
+            are kept until close()
+        baidu_cache: string, default 'baidu_index.db'
+            the SQLite file caching the Baidu Index, no cache if None
+        db_path: string, default 'data.db'
+            the SQLite file holding the market data
+        compact: boolean, default False
+            Whether to keep the price tables in memory with categorical
+            names and float32 returns, which takes a fraction of the memory
+            at the cost of some precision in the returns
+        result_cache_size: int, default 128
+            the number of analysis results kept in memory, no caching if 0
+            and result_cache_path is None
+        result_cache_path: string, default None
+            the SQLite file persisting the analysis results across
+            processes, memory only if None
+        baidu_options: dict, default None
+            keyword arguments of BaiduIndex used by fit() and fit_many(),
+            such as base_url to download from a local stub or rate_limiter
+        instrument: Instrument or boolean, default None
+            records the time of every stage and the work done by the
+            database, the spider and the analyses, see get_stats(); True
+            for a new Instrument, nothing is recorded if None
+        """
+        self.__pool = parallel.PanelPool(workers)
+        self.__baidu_cache = BaiduIndexCache(baidu_cache) \
+            if baidu_cache is not None else None
+        self.__instrument = get_instrument(instrument)
+        self.__baidu_options = dict(baidu_options or {})
+        self.__baidu_options.setdefault('instrument', self.__instrument)
+        self.__db = utility.Database(db_path, instrument=self.__instrument)
+        self.__compact = compact
+        self.__results = ResultCache(result_cache_size, result_cache_path) \
+            if result_cache_size or result_cache_path is not None else None
+        self.__data_version = None
+        self.__data = {}
+        self.__data_lock = threading.RLock()
         self.__event_date = None
         self.__event = None
         self.__event_influenced_date = None
+        self.__baidu_index = {}
         self.rrr_date = [pd.to_datetime(time) for time in
                          ['2018-10-15 ', '2018-07-05', '2018-04-25',
                           '2016-03-01', '2015-10-24', '2015-09-06',
@@ -39,34 +112,312 @@ class EventDriven(object):
         """
         raise exception_type(details)
 
-    def __get_event_influenced_date(self):
+    def __get_data(self, name):
         """
-        Get the periods during which an event has profound effects
+        Read a table of the database on first use and keep it
+
+        Parameters
+        ----------
+        name: string
+            industry, index, stock_ind, stock_group (stock_ind as a
+            GroupIndex), trading_date, calendar (trading_date as a
+            TradingCalendar), or stock, industry_panel and index_panel (the
+            whole tables as Panels with their cumulative returns)
+
+        Returns
+        -------
+        data : DataFrame, DatetimeIndex or Panel
+        """
+        # the tables are shared by forks, which may load them concurrently
+        data = self.__data.get(name)
+        if data is not None:
+            return data
+        with self.__data_lock:
+            if name in self.__data:
+                return self.__data[name]
+            loaders = {
+                'industry': self.__db.get_industry_data,
+                'index': self.__db.get_index_data,
+                'stock_ind': self.__db.get_stock_industry,
+                'stock_group': lambda: GroupIndex.from_frame(
+                    self.__get_data('stock_ind')),
+                'trading_date': self.__db.get_trading_date,
+                'calendar': lambda: TradingCalendar(
+                    self.__get_data('trading_date')),
+                'stock': self.__load_stock_panel,
+                'industry_panel': lambda: self.__to_panel(
+                    self.__get_data('industry'), 'industry_name', how='any'),
+                'index_panel': lambda: self.__to_panel(
+                    self.__get_data('index'), 'index')
+            }
+            with self.__instrument.stage('load_' + name):
+                self.__data[name] = self.__shrink(loaders[name](), name)
+            return self.__data[name]
+
+    def __shrink(self, data, name):
+        """
+        Make a table compact when the instance is in compact mode
+
+        Parameters
+        ----------
+        data: DataFrame or Panel
+            the table
+        name: string
+            industry, index or stock, anything else is returned as it is
+
+        Returns
+        -------
+        data : DataFrame or Panel
+        """
+        if not self.__compact:
+            return data
+        if isinstance(data, Panel):
+            return data if self.__db.get_store() is not None \
+                else data.compact()
+        keys = {'industry': 'industry_name', 'index': 'index',
+                'stock': 'stkcode'}
+        return compact_frame(data, keys[name]) if name in keys else data
+
+    def __get_event_data(self, name, entities=None, periods=None):
+        """
+        Get the rows of some entities of a table inside some periods, reading
+        only those rows unless the whole table has been loaded
+
+        Parameters
+        ----------
+        name: string
+            industry or index
+        entities: list, default None
+            the names of the entities, all if None
+        periods: list, default None
+            the periods to read, the influenced periods of the fitted event
+            if None
+
+        Returns
+        -------
+        data : DataFrame
+        """
+        if periods is None:
+            periods = list(self.__event_influenced_date.values())
+        key = {'industry': 'industry_name', 'index': 'index'}[name]
+        data = self.__data.get(name)
+        if data is not None:
+            if entities is not None:
+                data = data.loc[data[key].isin(entities)]
+            keep = np.zeros(len(data), dtype=bool)
+            for start, end in merge_periods(periods):
+                keep |= (data.index >= start) & (data.index <= end)
+            return data.loc[keep]
+        readers = {
+            'industry': self.__db.get_industry_data,
+            'index': self.__db.get_index_data
+        }
+        return self.__shrink(readers[name](entities, periods), name)
+
+    def __memoize(self, compute, *args):
+        """
+        Serve the result of an analysis from the result cache, computing it
+        only once for the fitted event, its influenced periods, the
+        arguments and the current data
+
+        Fitting another event or rewriting the database changes the key, so
+        an outdated result is never served. A rewrite also drops the tables
+        kept in memory.
+
+        Parameters
+        ----------
+        compute: callable
+            the private method computing the result
+        args:
+            the arguments of compute
+
+        Returns
+        -------
+        result : object
+        """
+        # __index_effect is named _EventDriven__index_effect
+        name = 'get_' + compute.__name__.split('__')[-1]
+        with self.__instrument.stage(name):
+            version = self.__db.version()
+            if version != self.__data_version:
+                if self.__data_version is not None:
+                    with self.__data_lock:
+                        self.__data.clear()
+                        self.__db.refresh()
+                self.__data_version = version
+            if self.__results is None:
+                return compute(*args)
+            windows = tuple((str(period[0]), str(period[-1]), len(period))
+                            for period in
+                            self.__event_influenced_date.values()) \
+                if self.__event_influenced_date is not None else None
+            key = (compute.__name__, args, self.__event,
+                   tuple(str(date) for date in self.__event_date), windows,
+                   self.__db.path, version, self.__compact)
+            hits = self.__results.hits
+            result = self.__results.get(key, lambda: compute(*args))
+            self.__instrument.count('result_cache_hits'
+                                    if self.__results.hits > hits
+                                    else 'result_cache_misses')
+            return result
+
+    def __to_panel(self, data, key, how='all'):
+        """
+        Turn a long table into a Panel and compute its cumulative returns
+        once, before the panel is kept, unless the instance is in compact
+        mode where they are computed for every query (see Panel.compact)
+
+        Parameters
+        ----------
+        data: DataFrame
+            the long table indexed by date
+        key: string
+            the column holding the entity name
+        how: string, default 'all'
+            the same as Panel.from_frame
 
         Returns
         -------
-        event_influenced_date : list
-        """
-        event_influenced_date = {}
-        baidu_index = self.get_baidu_index(keywords=self.__event)
-        for date in self.__event_date:
-            subset_range = pd.date_range(start=date - pd.Timedelta('30 days'),
-                                         periods=60, freq='D')
-            data = baidu_index.reindex(subset_range)
-            data = data[data['index'] >= 3 * data['index'].median()]
-            if data.empty:
-                event_influenced_date[date] = pd.date_range(start=date,
-                                                            periods=1,
-                                                            freq='D')
+        panel : Panel
+        """
+        panel = Panel.from_frame(data, key, how=how)
+        if not self.__compact:
+            panel.cumulative()
+        return panel
+
+    def __significance(self, result, panel, benchmark, resamples, method,
+                       seed):
+        """
+        Add the p-values of the effect of the event to an effect table
+
+        Parameters
+        ----------
+        result: DataFrame
+            the effect table indexed by entity
+        panel: Panel
+            the whole history of the entities
+        benchmark: Panel
+            the whole history of the benchmark as its only entity, or None;
+            its cumulative returns are used when it has the dates of panel
+        resamples, method, seed:
+            the settings of significance.effect_significance
+
+        Returns
+        -------
+        result : DataFrame
+        """
+        returns, cumulative = None, None
+        if benchmark is not None:
+            if benchmark.dates.equals(panel.dates):
+                cumulative = {name: values[:, 0] for name, values in
+                              benchmark.cumulative().items()}
             else:
-                event_influenced_date[date] = pd.date_range(
-                    start=data.index[0],
-                    end=data.index[-1])
-        return event_influenced_date
+                returns = pd.Series(benchmark['return'][:, 0],
+                                    index=benchmark.dates).reindex(
+                    panel.dates).values
+        with self.__instrument.stage('significance'):
+            test = significance.effect_significance(
+                panel.dates, panel['return'],
+                list(self.__event_influenced_date.values()),
+                benchmark=returns, resamples=resamples, method=method,
+                seed=seed, cumulative=panel.cumulative(),
+                benchmark_cumulative=cumulative)
+        self.__instrument.count('resamples', resamples)
+        p_values = pd.DataFrame({'p_value': test['p_value'],
+                                 'up_prob_p': test['up_prob_p']},
+                                index=pd.Index(panel.codes))
+        return result.join(p_values)
+
+    def __check_length(self, name, value, minimum=0):
+        """
+        Check that a number of days is an integer of at least minimum
+
+        Parameters
+        ----------
+        name: string
+            the name of the argument
+        value: int
+            the number of days
+        minimum: int, default 0
+            the smallest accepted value, no limit if None
+        """
+        if isinstance(value, bool) or \
+                not isinstance(value, (int, np.integer)) or \
+                (minimum is not None and value < minimum):
+            self.__raise_error(
+                InvalidWindowLength,
+                details='{name} should be an integer{limit}'.format(
+                    name=name, limit='' if minimum is None
+                    else ' of at least {0}'.format(minimum)))
+
+    def __check_detector(self, method, threshold, window, offset):
+        """
+        Check the settings of the detector of fit() and fit_many()
+        """
+        if method not in detector.DETECTORS:
+            self.__raise_error(
+                InvalidDetector,
+                details='method should be one of ' + ', '.join(
+                    "'%s'" % name for name in detector.DETECTORS))
+        if isinstance(threshold, bool) or \
+                not isinstance(threshold, (int, float, np.integer,
+                                           np.floating)) or \
+                not np.isfinite(threshold):
+            self.__raise_error(InvalidDetector,
+                               details='threshold should be a number')
+        self.__check_length('window', window, 1)
+        self.__check_length('offset', offset, None)
+
+    def __get_event_baidu_index(self, event_name):
+        """
+        Get the Baidu Index of an event name up to today, downloading it
+        only if it has not been fetched by this instance today
+
+        Parameters
+        ----------
+        event_name: string
+            the name of the event
+
+        Returns
+        -------
+        baidu_index : DataFrame
+        """
+        # a resident instance fetches the days passed since the last time
+        today = dt.now().strftime('%Y-%m-%d')
+        fetched = self.__baidu_index.get(event_name)
+        if fetched is None or fetched[0] != today:
+            with self.__instrument.stage('baidu_index'):
+                self.__baidu_index[event_name] = (today, self.get_baidu_index(
+                    keywords=event_name, end_date=today,
+                    cache=self.__baidu_cache, **self.__baidu_options))
+        return self.__baidu_index[event_name][1]
+
+    def __check_event_date(self, event_date):
+        """
+        Check and convert a list of event dates
+
+        Parameters
+        ----------
+        event_date: list
+            a list of all event dates
+
+        Returns
+        -------
+        event_date : DatetimeIndex
+        """
+        if type(event_date) is not list:
+            self.__raise_error(InvalidDateList,
+                               details='event_date should be a list')
+        try:
+            event_date = pd.to_datetime(event_date)
+        except ValueError:
+            self.__raise_error(InvalidDateList,
+                               details="Element in date list should in correct string form such as '%Y-%m-%d'")
+        return event_date
 
     @staticmethod
-    def get_baidu_index(keywords, start_date='2011-01-01',
-                        end_date=dt.now().strftime('%Y-%m-%d')):
+    def get_baidu_index(keywords, start_date='2011-01-01', end_date=None,
+                        cache=None, **options):
         """
         Get the Baidu Index for a keyword from a specified time interval
 
@@ -78,6 +429,11 @@ class EventDriven(object):
             the beginning of the time interval
         end_date: string, default today
             the end of the time interval
+        cache: BaiduIndexCache, default None
+            the local cache to serve and store the values, which makes only
+            the missing dates be downloaded
+        options:
+            other keyword arguments of BaiduIndex, such as base_url
 
         Examples
         --------
@@ -94,15 +450,62 @@ class EventDriven(object):
         -------
         baidu_df : DataFrame
         """
-        baidu_index = BaiduIndex(keywords, start_date, end_date)
-        baidu_df = pd.DataFrame(baidu_index(keywords, 'all'))
-        baidu_df.set_index('date', inplace=True)
-        baidu_df = baidu_df[baidu_df['index'] != '']
-        baidu_df['index'] = baidu_df['index'].astype(int)
-        baidu_df.index = pd.to_datetime(baidu_df.index)
+        if end_date is None:
+            end_date = dt.now().strftime('%Y-%m-%d')
+        baidu_index = BaiduIndex(keywords, start_date, end_date, cache=cache,
+                                 kinds=['all'], **options)
+        baidu_df = baidu_index(keywords, 'all').to_frame('index')
+        return baidu_df
+
+    @staticmethod
+    def get_baidu_indexes(keywords, start_date='2011-01-01', end_date=None,
+                          cache=None, **options):
+        """
+        Get the Baidu Index for many keywords from a specified time interval,
+        sending up to BAIDU_MAX_KEYWORDS keywords in each request
+
+        Parameters
+        ----------
+        keywords: list
+            the keywords to search
+        start_date: string, default '2011-01-01'
+            the beginning of the time interval
+        end_date: string, default today
+            the end of the time interval
+        cache: BaiduIndexCache, default None
+            the local cache to serve and store the values
+        options:
+            other keyword arguments of BaiduIndex, such as base_url
+
+        Examples
+        --------
+        >> get_baidu_indexes(['降准', '加息'], '2019-01-11', '2019-01-13')
+                        降准     加息
+        date
+        2019-01-11    2117    743
+        2019-01-12    1252    520
+        2019-01-13    1304    538
+
+        Returns
+        -------
+        baidu_df : DataFrame
+            one column per keyword, NaN on the days without data
+        """
+        if end_date is None:
+            end_date = dt.now().strftime('%Y-%m-%d')
+        columns = {}
+        for i in range(0, len(keywords), BAIDU_MAX_KEYWORDS):
+            batch = keywords[i:i + BAIDU_MAX_KEYWORDS]
+            baidu_index = BaiduIndex(batch, start_date, end_date, cache=cache,
+                                     kinds=['all'], **options)
+            for keyword in batch:
+                columns[keyword] = baidu_index(keyword, 'all')
+        baidu_df = pd.DataFrame(columns, columns=keywords)
+        baidu_df.index.name = 'date'
         return baidu_df
 
-    def fit(self, event_date, event_name, display=True):
+    def fit(self, event_date, event_name, display=True, method='median',
+            threshold=3, window=60, offset=30):
         """
         Get the periods during which an event has profound effects
 
@@ -114,6 +517,15 @@ class EventDriven(object):
             the name of the event
         display: boolean, default True
             Whether to display the result or not
+        method: string, default 'median'
+            how to detect the outstanding days of the Baidu Index, one of
+            'median', 'zscore' and 'mad'
+        threshold: float, default 3
+            the multiplier of the detector
+        window: int, default 60
+            the number of days searched around each event date, at least 1
+        offset: int, default 30
+            how many days before the event date the search starts
 
         Examples
         --------
@@ -136,29 +548,178 @@ class EventDriven(object):
         -------
         self.__event_influenced_date : dict
         """
-        if type(event_date) is not list:
-            self.__raise_error(InvalidDateList,
-                               details='event_date should be a list')
-        try:
-            event_date = pd.to_datetime(event_date)
-        except ValueError:
-            self.__raise_error(InvalidDateList,
-                               details="Element in date list should in correct string form such as '%Y-%m-%d'")
+        event_date = self.__check_event_date(event_date)
+        self.__check_detector(method, threshold, window, offset)
         self.__event_date = event_date
         self.__event = event_name
-        self.__event_influenced_date = self.__get_event_influenced_date()
+        with self.__instrument.stage('fit'):
+            baidu_index = self.__get_event_baidu_index(event_name)
+            with self.__instrument.stage('detect'):
+                self.__event_influenced_date = \
+                    detector.detect_influenced_dates(
+                        baidu_index, event_date, method=method,
+                        threshold=threshold, window=window, offset=offset)
         if display:
             return self.__event_influenced_date
         else:
             return "Event Fits Successfully"
 
-    def get_index_effect(self):
+    def fit_many(self, events, display=True, method='median', threshold=3,
+                 window=60, offset=30):
+        """
+        Get the periods during which each of many events has profound
+        effects, downloading the Baidu Index of all event names together
+
+        The fitted Baidu Index is kept, so a following fit() of any of
+        these events on the same day makes no request.
+
+        Parameters
+        ----------
+        events: dict
+            event name -> a list of all event dates
+        display: boolean, default True
+            Whether to display the result or not
+        method, threshold, window, offset:
+            the settings of the detector, see fit()
+
+        Examples
+        --------
+        >> fit_many({'降准': event.rrr_date, '加息': ['2015-12-17']})
+        {'降准': {Timestamp('2018-10-15 00:00:00'): DatetimeIndex([...])},
+         '加息': {Timestamp('2015-12-17 00:00:00'): DatetimeIndex([...])}}
+
+        Returns
+        -------
+        result : dict
+            event name -> the influenced periods of the event
+        """
+        events = {event_name: self.__check_event_date(event_date)
+                  for event_name, event_date in events.items()}
+        self.__check_detector(method, threshold, window, offset)
+        today = dt.now().strftime('%Y-%m-%d')
+        missing = [event_name for event_name in events
+                   if self.__baidu_index.get(event_name, (None,))[0] != today]
+        with self.__instrument.stage('fit_many'):
+            if missing:
+                with self.__instrument.stage('baidu_index'):
+                    baidu_df = self.get_baidu_indexes(
+                        missing, end_date=today, cache=self.__baidu_cache,
+                        **self.__baidu_options)
+                for event_name in missing:
+                    self.__baidu_index[event_name] = (
+                        today, baidu_df[[event_name]].dropna().astype(
+                            int).rename(columns={event_name: 'index'}))
+            with self.__instrument.stage('detect'):
+                result = {event_name: detector.detect_influenced_dates(
+                    self.__baidu_index[event_name][1], event_date,
+                    method=method, threshold=threshold, window=window,
+                    offset=offset)
+                    for event_name, event_date in events.items()}
+        if display:
+            return result
+        else:
+            return "Events Fit Successfully"
+
+    def fork(self):
+        """
+        Get a new instance with no fitted event, sharing the tables loaded,
+        the database, the caches and the instrument of this one
+
+        Every fork keeps its own fitted event, so many events can be
+        analysed at the same time, from different threads, without
+        loading the market data again or affecting each other.
+
+        Examples
+        --------
+        >> rrr = event.fork()
+        >> rrr.fit(event.rrr_date, '降准', display=False)
+        >> hike = event.fork()
+        >> hike.fit(['2015-12-17'], '加息', display=False)
+
+        Returns
+        -------
+        event : EventDriven
+        """
+        event = copy.copy(self)
+        event.__event_date = None
+        event.__event = None
+        event.__event_influenced_date = None
+        return event
+
+    def preload(self, stock=False):
+        """
+        Read the tables every analysis needs ahead of the first one
+
+        Parameters
+        ----------
+        stock: boolean, default False
+            Whether to load the whole table stock as well, which
+            get_abnormal_return and get_market_analysis need
+        """
+        self.__data_version = self.__db.version()
+        names = ['calendar', 'stock_group', 'index', 'industry',
+                 'index_panel', 'industry_panel']
+        for name in names + (['stock'] if stock else []):
+            self.__get_data(name)
+
+    def close(self):
+        """
+        Stop the worker processes, which the forks of the instance share
+        """
+        self.__pool.close()
+
+    def get_stats(self, reset=False):
+        """
+        Get what the instrument of the instance has recorded
+
+        Examples
+        --------
+        >> event = EventDriven(instrument=True)
+        >> event.fit(event.rrr_date, '降准', display=False)
+        >> event.get_stock_analysis(stock='600036.XSHG', detail=False)
+        >> event.get_stats()
+        {'stages': {'http': {'calls': 38, 'seconds': 7.9},
+                    'fit': {'calls': 1, 'seconds': 8.4},
+                    'read_sqlite': {'calls': 3, 'seconds': 0.21},
+                    'get_stock_analysis': {'calls': 1, 'seconds': 0.29},
+                    ...},
+         'counters': {'http_calls': 38, 'bytes_fetched': 412870,
+                      'rows_read': 14201, 'windows': 23064,
+                      'result_cache_misses': 1, ...}}
+
+        Parameters
+        ----------
+        reset: boolean, default False
+            Whether to start recording afresh afterwards
+
+        Returns
+        -------
+        stats : dict
+            stages: name -> the calls and the seconds
+            counters: name -> total
+            profile: the top functions, when the instrument profiles
+        """
+        stats = self.__instrument.summary()
+        if reset:
+            self.__instrument.reset()
+        return stats
+
+    def get_index_effect(self, resamples=0, method='permutation', seed=None):
         """
         Get the effect of the event on main index (including the mean return
         and rise probability)
 
         Parameters
         ----------
+        resamples: int, default 0
+            the number of pseudo-event sets (or bootstrap samples) the
+            effect is compared with, which adds the p-values of return and
+            up_prob as the columns p_value and up_prob_p if positive
+        method: string, default 'permutation'
+            'permutation': place the windows of the event at random in the
+            history, 'bootstrap': resample the events
+        seed: int, default None
+            the seed of the resampling
 
         Examples
         --------
@@ -180,28 +741,28 @@ class EventDriven(object):
         if self.__event_date is None or self.__event is None:
             self.__raise_error(NoEventDefined,
                                details='Please call the function fit() first')
-        effect_df = pd.DataFrame()
-        name = 'index'
-        result = pd.DataFrame()
-        for date in self.__event_influenced_date.keys():
-            effect_period = self.__event_influenced_date[date]
-            data = self.__data[name]
-            data = data.loc[data.index.intersection(effect_period)]
-            ret = data.groupby(name, as_index=False).agg({
-                'return': 'mean',
-                'volume': 'sum'
-            })
-            ret['date'] = date
-            effect_df = effect_df.append(ret.set_index('date'))
-            result = pd.DataFrame()
-            for index, index_df in effect_df.groupby('index'):
-                result.loc[index, 'return'] = index_df['return'].mean()
-                result.loc[index, 'up_prob'] = sum(index_df['return'] >= 0) / \
-                                               index_df.shape[0]
-            result.index.name = 'index'
+        return self.__memoize(self.__index_effect, resamples, method, seed)
+
+    def __index_effect(self, resamples, method, seed):
+        """
+        Compute get_index_effect()
+        """
+        index = self.__get_event_data('index')
+        calendar = self.__get_data('calendar')
+        with self.__instrument.stage('aggregate'):
+            result = effect.aggregate_effect(index, 'index',
+                                             self.__event_influenced_date,
+                                             calendar=calendar)
+        result = result[['return', 'up_prob']]
+        if resamples > 0:
+            result = self.__significance(result,
+                                         self.__get_data('index_panel'),
+                                         None, resamples, method, seed)
+        result.index.name = 'index'
         return result
 
-    def get_industry_effect(self, ascending=False, head=5):
+    def get_industry_effect(self, ascending=False, head=5, resamples=0,
+                            method='permutation', seed=None):
         """
         Get the effect of the event on industry (including the mean return
         and rise probability)
@@ -212,6 +773,15 @@ class EventDriven(object):
             Whether to sort the return column in an ascending way
         head: int, default 5
             the number of rows of the dataframe to return
+        resamples: int, default 0
+            the number of pseudo-event sets (or bootstrap samples) the
+            effect is compared with, which adds the p-values of return and
+            up_prob as the columns p_value and up_prob_p if positive
+        method: string, default 'permutation'
+            'permutation': place the windows of the event at random in the
+            history, 'bootstrap': resample the events
+        seed: int, default None
+            the seed of the resampling
 
         Examples
         --------
@@ -231,39 +801,37 @@ class EventDriven(object):
         if self.__event_date is None or self.__event is None:
             self.__raise_error(NoEventDefined,
                                details='Please call the function fit() first')
-        index = self.__data['index']
-        index = index.loc[index['index'] == '上证综指']
-        result = pd.DataFrame()
-        effect_df = pd.DataFrame()
-        name = 'industry'
-        for date in self.__event_influenced_date.keys():
-            effect_period = self.__event_influenced_date[date]
-            data = self.__data[name]
-            data = data.loc[data.index.intersection(effect_period)]
-            ret = data.groupby('industry_name', as_index=False).agg({
-                'return': 'mean',
-                'volume': 'sum'
-            })
-            ret['date'] = date
-            ret['return'] -= index.reindex(effect_period)['return'].mean()
-            effect_df = effect_df.append(ret.set_index('date'))
-            result = pd.DataFrame()
-            for ind, index_df in effect_df.groupby('industry_name'):
-                result.loc[ind, 'return'] = index_df['return'].mean()
-                result.loc[ind, 'up_prob'] = sum(index_df['return'] >= 0) / \
-                                             index_df.shape[0]
-            result.index.name = 'industry'
-            if ascending:
-                result = result.loc[result['up_prob'] <= 0.5]
+        return self.__memoize(self.__industry_effect, ascending, head,
+                              resamples, method, seed)
 
-            else:
-                result = result.loc[result['up_prob'] >= 0.5]
-            result.sort_values(by='return', ascending=ascending,
-                               inplace=True)
+    def __industry_effect(self, ascending, head, resamples, method, seed):
+        """
+        Compute get_industry_effect()
+        """
+        index = self.__get_event_data('index', ['上证综指'])
+        industry = self.__get_event_data('industry')
+        calendar = self.__get_data('calendar')
+        with self.__instrument.stage('aggregate'):
+            result = effect.aggregate_effect(industry, 'industry_name',
+                                             self.__event_influenced_date,
+                                             benchmark=index['return'],
+                                             calendar=calendar)
+        result = result[['return', 'up_prob']]
+        if resamples > 0:
+            benchmark = self.__get_data('index_panel').select(['上证综指'])
+            result = self.__significance(
+                result, self.__get_data('industry_panel'), benchmark,
+                resamples, method, seed)
+        result.index.name = 'industry'
+        if ascending:
+            result = result.loc[result['up_prob'] <= 0.5]
+        else:
+            result = result.loc[result['up_prob'] >= 0.5]
+        result.sort_values(by='return', ascending=ascending, inplace=True)
         return result.head(head)
 
-    def get_stock_effect(self, industry=None, ascending=False, head=5):
-
+    def get_stock_effect(self, industry=None, ascending=False, head=5,
+                         resamples=0, method='permutation', seed=None):
         """
         Get the effect of the event on stock (including the mean return
         and rise probability)
@@ -276,6 +844,15 @@ class EventDriven(object):
             Whether to sort the return column in an ascending way
         head: int, default 5
             the number of rows of the dataframe to return
+        resamples: int, default 0
+            the number of pseudo-event sets (or bootstrap samples) the
+            effect is compared with, which adds the p-values of return and
+            up_prob as the columns p_value and up_prob_p if positive
+        method: string, default 'permutation'
+            'permutation': place the windows of the event at random in the
+            history, 'bootstrap': resample the events
+        seed: int, default None
+            the seed of the resampling
 
         Examples
         --------
@@ -295,80 +872,249 @@ class EventDriven(object):
         if self.__event_influenced_date is None:
             self.__raise_error(NoEventDefined,
                                details='Please call the function fit() first')
+        return self.__memoize(self.__stock_effect, industry, ascending, head,
+                              resamples, method, seed)
+
+    def __stock_effect(self, industry, ascending, head, resamples, method,
+                       seed):
+        """
+        Compute get_stock_effect()
+        """
         if industry is None:
             industry = self.get_industry_effect().index[0]
 
-        stock_ind = self.__data['stock_ind']
-        stock_list = stock_ind.loc[stock_ind['industry_name'] == industry]
-        stock_data = utility.get_stock_data(tuple(stock_list.stock.tolist()))
-        stock_data.set_index('date', inplace=True)
-        industry_data = self.__data['industry']
-        industry_ret = industry_data.loc[
-            industry_data['industry_name'] == industry]
-        if industry_ret.empty:
+        stock_list = self.__get_data('stock_group').get_members(industry)
+        industry_ret = self.__get_event_data('industry', [industry])
+        if len(stock_list) == 0 or industry_ret.empty:
             self.__raise_error(InvalidIndustryName,
                                details="Please check and retry with a correct industry name")
+        calendar = self.__get_data('calendar')
+        if self.__pool.is_parallel(len(stock_list)):
+            # the workers share the whole table stock, loaded once
+            panel = self.__get_data('stock')
+            with self.__instrument.stage('aggregate'):
+                results = self.__pool.map(
+                    _stock_effect_task, panel,
+                    [stock for stock in stock_list if stock in panel.codes],
+                    args=(self.__event_influenced_date,
+                          industry_ret['return'], calendar))
+            result = pd.concat(results)
+        else:
+            stock_data = self.__db.get_stock_data(
+                stock_list.tolist(),
+                periods=list(self.__event_influenced_date.values()))
+            stock_data = self.__shrink(stock_data.set_index('date'), 'stock')
+            with self.__instrument.stage('aggregate'):
+                result = effect.aggregate_effect(
+                    stock_data, 'stkcode', self.__event_influenced_date,
+                    benchmark=industry_ret['return'], calendar=calendar)
+        result = result[['return', 'up_prob']]
+        result.index = result.index.astype(str)
+        if resamples > 0:
+            panel = self.__get_data('stock')
+            result = self.__significance(
+                result,
+                panel.select([stock for stock in stock_list
+                              if stock in panel.codes]),
+                self.__get_data('industry_panel').select([industry]),
+                resamples, method, seed)
+        result.index.name = 'stock'
+        if ascending:
+            result = result.loc[result['up_prob'] <= 0.5]
+        else:
+            result = result.loc[result['up_prob'] >= 0.5]
+        result.sort_values(by='return', ascending=ascending, inplace=True)
+        return result.head(head)
+
+    def get_market_effect(self, ascending=False, head=None, chunk_size=500):
+        """
+        Get the effect of the event on every stock of the table
+        stock_industry, measured against its industry and ranked the same
+        way as get_stock_effect
+
+        The stocks are read chunk_size at a time, ordered by industry, and
+        only the ranked rows of the chunks read so far are kept (the head
+        rows if head is given), so the memory taken is bounded by the
+        chunk size rather than by the size of the table.
+
+        Parameters
+        ----------
+        ascending: boolean, default False
+            sort the stocks by return in ascending order or not, keeping
+            the stocks with an up_prob of at most 0.5 if True and at least
+            0.5 if False
+        head: int, default None
+            return the first head stocks, all if None
+        chunk_size: int, default 500
+            the number of stocks read at a time, all at once if None
 
-        effect_df = pd.DataFrame()
-        result = pd.DataFrame()
-        for date in self.__event_influenced_date.keys():
-            effect_period = self.__event_influenced_date[date]
-            # data = stock_data.loc[effect_period].dropna()
-            data = stock_data.loc[stock_data.index.intersection(effect_period)]
-            ret = data.groupby('stkcode', as_index=False).agg({
-                'return': 'mean',
-                'volume': 'sum'
-            })
-            ret['date'] = date
-            ret['return'] -= industry_ret.reindex(effect_period)[
-                'return'].mean()
-            effect_df = effect_df.append(ret.set_index('date'))
-            result = pd.DataFrame()
-            for ind, index_df in effect_df.groupby('stkcode'):
-                result.loc[ind, 'return'] = index_df['return'].mean()
-                result.loc[ind, 'up_prob'] = sum(index_df['return'] >= 0) / \
-                                             index_df.shape[0]
-            result.index.name = 'stock'
+        Examples
+        --------
+        >> get_market_effect(head=3)
+                         industry    return  up_prob
+        stock
+        601688.XSHG     证券III  0.038562     1.00
+        600030.XSHG     证券III  0.031275     0.90
+        000776.XSHE     证券III  0.029944     0.90
+
+        Returns
+        -------
+        result : DataFrame
+        """
+        if self.__event_date is None or self.__event is None:
+            self.__raise_error(NoEventDefined,
+                               details='Please call the function fit() first')
+        return self.__memoize(self.__market_effect, ascending, head,
+                              chunk_size)
+
+    def __market_effect(self, ascending, head, chunk_size):
+        """
+        Compute get_market_effect()
+        """
+        stock_ind = self.__get_data('stock_ind').drop_duplicates('stock')
+        stock_ind = stock_ind.sort_values(['industry_name', 'stock'])
+        industry_of = stock_ind.set_index('stock')['industry_name']
+        industry = self.__get_event_data('industry')
+        calendar = self.__get_data('calendar')
+        result = pd.DataFrame(columns=['industry', 'return', 'up_prob'])
+        for stock_data in self.__db.iter_stock_data(
+                stock_ind['stock'].tolist(),
+                periods=list(self.__event_influenced_date.values()),
+                chunk_size=chunk_size):
+            stock_data = self.__shrink(stock_data.set_index('date'), 'stock')
+            self.__instrument.count('stocks_streamed',
+                                    stock_data['stkcode'].nunique())
+            names = industry_of.reindex(
+                stock_data['stkcode'].astype(str)).values
+            parts = [result]
+            with self.__instrument.stage('aggregate'):
+                for name, rows in stock_data.groupby(names):
+                    industry_ret = industry.loc[
+                        industry['industry_name'] == name, 'return']
+                    if industry_ret.empty:
+                        continue
+                    part = effect.aggregate_effect(
+                        rows, 'stkcode', self.__event_influenced_date,
+                        benchmark=industry_ret, calendar=calendar)
+                    part.index = part.index.astype(str)
+                    part.insert(0, 'industry', name)
+                    parts.append(part[['industry', 'return', 'up_prob']])
+            result = pd.concat(parts)
             if ascending:
                 result = result.loc[result['up_prob'] <= 0.5]
             else:
                 result = result.loc[result['up_prob'] >= 0.5]
-            result.sort_values(by='return', ascending=ascending, inplace=True)
-        return result.head(head)
+            # a stable sort keeps the stocks of equal return in the order
+            # they were read, whatever the chunks
+            result = result.sort_values(by='return', ascending=ascending,
+                                        kind='mergesort')
+            if head is not None:
+                result = result.head(head)
+        result.index.name = 'stock'
+        return result.astype({'return': float, 'up_prob': float})
 
-    def __compute_return(self, data, before, after):
+    def get_abnormal_return(self, industry=None, before=10, after=10,
+                            estimation=120, gap=10, market='上证综指',
+                            head=None):
         """
-        compute the cumulative return for the data (stock data or industry data)
-        during the time interval specified by the before and after argument
-        and the event date
+        Run a market-model event study of the event on the stocks of an
+        industry, or on the whole market: the abnormal return of a stock is
+        its return minus alpha + beta × the market return, both estimated
+        over a window before the event
 
         Parameters
         ----------
-        data: DataFrame
-            the DataFrame of stock or industry
-        before: int
-            how many days before the event date
-        after: int
-            how many days after the event date
+        industry: string, default None
+            the industry of stocks to be analyzed, all stocks if None
+        before: int, default 10
+            the trading days of the event window before the event date
+        after: int, default 10
+            the trading days of the event window after the event date
+        estimation: int, default 120
+            the length of the estimation window in trading days
+        gap: int, default 10
+            the trading days between the estimation and the event windows
+        market: string, default '上证综指'
+            the index used as the market return
+        head: int, default None
+            the number of rows of the summary to return, all if None
+
+        Examples
+        --------
+        >> get_abnormal_return(industry='银行III', head=3)['summary']
+                         car    t_stat     alpha      beta
+        stock
+        600926.XSHG  0.052011  2.413095  0.000412  0.781264
+        601229.XSHG  0.040823  1.986410  0.000305  0.902117
+        600036.XSHG  0.021477  1.201385 -0.000127  1.043568
 
         Returns
         -------
-        event_ret.mean().values : float
+        result : dict
+            summary: the cumulative abnormal return over the whole event
+            window averaged across events (car), its t-statistic, and the
+            mean alpha and beta of every stock, sorted by car
+            car_path: the mean cumulative abnormal return of every stock
+            on every day of the event window
+            t_path: the t-statistic of car_path
         """
+        if self.__event_date is None:
+            self.__raise_error(NoEventDefined,
+                               details='Please call the function fit() first')
+        return self.__memoize(self.__abnormal_return, industry, before,
+                              after, estimation, gap, market, head)
 
-        event_ret = pd.DataFrame()
-        for date in self.__event_date:
-            subset_range = pd.date_range(
-                start=date - pd.Timedelta("{d} days".format(d=before)),
-                end=date + pd.Timedelta("{d} days".format(d=after)))
-            data_df = data.reindex(subset_range).dropna()
-            if data_df.empty:
-                break
-            event_ret.loc[date, 'return'] = (data_df['return'] + 1).prod() - 1
-        return event_ret.mean().values
+    def __abnormal_return(self, industry, before, after, estimation, gap,
+                          market, head):
+        """
+        Compute get_abnormal_return()
+        """
+        panel = self.__get_data('stock')
+        if industry is not None:
+            stock_list = self.__get_data('stock_group').get_members(industry)
+            stock_list = [stock for stock in stock_list
+                          if stock in panel.codes]
+            if not stock_list:
+                self.__raise_error(
+                    InvalidIndustryName,
+                    details="Please check and retry with a correct "
+                            "industry name")
+            panel = panel.select(stock_list)
+        index = self.__get_data('index')
+        index = index.loc[index['index'] == market, 'return']
+        if index.empty:
+            self.__raise_error(InvalidIndexName,
+                               details="Please check and retry with a "
+                                       "correct index name")
+        with self.__instrument.stage('event_study'):
+            study = event_study.event_study(
+                panel.dates, panel['return'],
+                index.groupby(level=0).mean().reindex(panel.dates).values,
+                self.__event_date, before=before, after=after,
+                estimation=estimation, gap=gap)
+        self.__instrument.count('windows', len(self.__event_date) *
+                                len(panel.codes))
+
+        codes = pd.Index(panel.codes, name='stock')
+        days = pd.Index(study['days'], name='day')
+        summary = pd.DataFrame({
+            'car': study['caar'][-1],
+            't_stat': study['t_stat'][-1],
+            'alpha': np.nanmean(study['alpha'], axis=0),
+            'beta': np.nanmean(study['beta'], axis=0)
+        }, index=codes)
+        summary = summary.dropna(subset=['car'])
+        summary.sort_values(by='car', ascending=False, inplace=True)
+        return {
+            'summary': summary if head is None else summary.head(head),
+            'car_path': pd.DataFrame(study['caar'], index=days,
+                                     columns=codes),
+            't_path': pd.DataFrame(study['t_stat'], index=days,
+                                   columns=codes)
+        }
 
     def get_stock_analysis(self, stock, before_periods=30, after_periods=30,
-                           detail=True):
+                           detail=True, unit='calendar'):
         """
         Get the best time for buying and selling the stock
 
@@ -379,9 +1125,12 @@ class EventDriven(object):
         before_periods: int, default 30
             the periods before the event to buy stocks
         after_periods: int, default 30
-            the periods after the event to sell stocks
+            the periods after the event to sell stocks, at least 1
         detail: boolean, default True
-            Whether to return detailed result (for each different time interval)
+            Whether to return detailed result (for each different time
+            interval)
+        unit: string, default 'calendar'
+            whether the periods count 'calendar' days or 'trading' days
 
         Examples
         --------
@@ -402,31 +1151,42 @@ class EventDriven(object):
         if self.__event_date is None:
             self.__raise_error(NoEventDefined,
                                details='Please call the function fit() first')
-        stock_data = utility.get_stock_data(stock, list_bool=False)
+        self.__check_length('before_periods', before_periods)
+        self.__check_length('after_periods', after_periods, 1)
+        return self.__memoize(self.__stock_analysis, stock, before_periods,
+                              after_periods, detail, unit)
+
+    def __stock_analysis(self, stock, before_periods, after_periods, detail,
+                         unit):
+        """
+        Compute get_stock_analysis()
+        """
+        calendar = self.__get_data('calendar')
+        periods = self.__window_periods(calendar, before_periods,
+                                        after_periods, unit)
+        stock_data = self.__db.get_stock_data(stock, list_bool=False,
+                                              periods=periods)
         if stock_data is None or stock_data.empty:
             self.__raise_error(InvalidStockCode,
                                details="Please check and retry with a correct stock code")
         stock_data = stock_data.set_index('date')
-        stock_ind = self.__data['stock_ind'].set_index('stock').loc[
-            stock, 'industry_name']
-        industry_data = self.__data['industry']
-        industry_data = industry_data.loc[
-            industry_data['industry_name'] == stock_ind]
-        result = pd.DataFrame()
-        count = 0
-        for before in range(before_periods + 1):
-            for after in range(after_periods + 1):
-                count += 1
-                result.loc[count, 'before'] = before
-                result.loc[count, 'after'] = after
-                result.loc[count, 'return'] = self.__compute_return(stock_data,
-                                                                    before,
-                                                                    after)
-                result.loc[count, 'ind_ret'] = self.__compute_return(
-                    industry_data, before, after)
+        stock_ind = self.__get_data('stock_group').get_group(stock)
+        if stock_ind is None:
+            self.__raise_error(InvalidStockCode,
+                               details="Please check and retry with a correct stock code")
+        industry_data = self.__get_event_data('industry', [stock_ind],
+                                              periods=periods)
+        with self.__instrument.stage('window_grid'):
+            grid = engine.window_return_grid(stock_data, self.__event_date,
+                                             before_periods, after_periods,
+                                             calendar=calendar, unit=unit)
+            ind_grid = engine.window_return_grid(
+                industry_data, self.__event_date, before_periods,
+                after_periods, calendar=calendar, unit=unit)
+        self.__instrument.count('windows', 2 * grid.size *
+                                len(self.__event_date))
+        result = engine.grid_to_frame(grid, ind_grid)
         result.drop(1, inplace=True)
-        result['before'] = result['before'].astype(int)
-        result['after'] = result['after'].astype(int)
         return {
             'best_buy': int(result.loc[result['return'].idxmax(), 'before']),
             'best_sell': int(result.loc[result['return'].idxmax(), 'after']),
@@ -436,6 +1196,137 @@ class EventDriven(object):
                 ['before', 'after']) if detail else None
         }
 
+    def __window_periods(self, calendar, before, after, unit):
+        """
+        Get the calendar periods covered by the widest window around every
+        event date
+
+        Parameters
+        ----------
+        calendar: TradingCalendar
+            the market calendar
+        before: int
+            the largest number of days before the event date
+        after: int
+            the largest number of days after the event date
+        unit: string
+            'calendar' or 'trading'
+
+        Returns
+        -------
+        periods : list
+            (start, end) pairs of Timestamps
+        """
+        if unit == 'calendar':
+            return [(date - pd.Timedelta(days=before),
+                     date + pd.Timedelta(days=after))
+                    for date in self.__event_date]
+        start, end = calendar.window_positions(self.__event_date, before,
+                                               after, unit)
+        return [(calendar.dates[first], calendar.dates[last - 1])
+                for first, last in zip(start[:, -1], end[:, -1])
+                if first < last]
+
+    def __load_stock_panel(self):
+        """
+        Load the whole stock table as a date × stock panel, with its
+        cumulative returns
+
+        Returns
+        -------
+        panel : Panel
+        """
+        if self.__db.get_store() is not None:
+            return self.__db.get_store().panel('stock')
+        return self.__to_panel(self.__db.get_all_stock_data(), 'stkcode',
+                               how='any')
+
+    def get_market_analysis(self, before_periods=30, after_periods=30,
+                            head=None, chunk_size=None, unit='calendar'):
+        """
+        Get the best time for buying and selling every stock in the table
+        stock_industry, ranked by the best return
+
+        Parameters
+        ----------
+        before_periods: int, default 30
+            the periods before the event to buy stocks
+        after_periods: int, default 30
+            the periods after the event to sell stocks, at least 1
+        head: int, default None
+            the number of rows of the dataframe to return, all if None
+        chunk_size: int, default None
+            the number of stocks evaluated in one array operation
+        unit: string, default 'calendar'
+            whether the periods count 'calendar' days or 'trading' days
+
+        Examples
+        --------
+        >> get_market_analysis(head=3)
+                    industry  best_buy  best_sell  best_return  ind_return
+        stock
+        600926.XSHG    银行III         2         17     0.081932    0.021077
+        601229.XSHG    银行III         1         12     0.063508    0.017263
+        600036.XSHG    银行III         1          9     0.038244    0.014667
+
+        Returns
+        -------
+        result : DataFrame
+        """
+        if self.__event_date is None:
+            self.__raise_error(NoEventDefined,
+                               details='Please call the function fit() first')
+        self.__check_length('before_periods', before_periods)
+        self.__check_length('after_periods', after_periods, 1)
+        return self.__memoize(self.__market_analysis, before_periods,
+                              after_periods, head, chunk_size, unit)
+
+    def __market_analysis(self, before_periods, after_periods, head,
+                          chunk_size, unit):
+        """
+        Compute get_market_analysis()
+        """
+        stock_ind = self.__get_data('stock_ind').drop_duplicates('stock')
+        panel = self.__get_data('stock')
+        stock_ind = stock_ind.loc[stock_ind['stock'].isin(panel.codes)]
+        # in the order of the panel, which the workers then take whole or in
+        # column ranges without copying it
+        stock_ind = stock_ind.iloc[np.argsort(
+            panel.codes.get_indexer(stock_ind['stock']), kind='stable')]
+        codes = stock_ind['stock'].tolist()
+        calendar = self.__get_data('calendar')
+        with self.__instrument.stage('window_grid'):
+            results = self.__pool.map(
+                _best_window_task, panel,
+                codes if len(codes) < len(panel.codes) else None,
+                args=(self.__event_date, before_periods, after_periods,
+                      chunk_size, calendar, unit))
+        best_buy, best_sell, best_return = [
+            np.concatenate(arrays) for arrays in zip(*results)]
+
+        industry = self.__get_data('industry_panel')
+        with self.__instrument.stage('window_grid'):
+            ind_grid = engine.panel_return_grid(
+                industry.dates, industry['return'], self.__event_date,
+                before_periods, after_periods, calendar=calendar, unit=unit,
+                cumulative=industry.cumulative())
+        self.__instrument.count('windows', ind_grid[0].size * len(
+            self.__event_date) * (len(codes) + len(industry.codes)))
+        ind_pos = industry.codes.get_indexer(stock_ind['industry_name'])
+        ind_return = np.where(ind_pos >= 0,
+                              ind_grid[ind_pos, best_buy, best_sell], np.nan)
+
+        result = pd.DataFrame({
+            'industry': stock_ind['industry_name'].values,
+            'best_buy': best_buy,
+            'best_sell': best_sell,
+            'best_return': best_return,
+            'ind_return': ind_return
+        }, index=pd.Index(codes, name='stock'))
+        result = result.dropna(subset=['best_return'])
+        result.sort_values(by='best_return', ascending=False, inplace=True)
+        return result if head is None else result.head(head)
+
 
 if __name__ == '__main__':
     pass
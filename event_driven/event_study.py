@@ -0,0 +1,156 @@
+# -*- coding: utf-8 -*-
+import numpy as np
+import pandas as pd
+
+
+def gather_windows(values, positions, offsets):
+    """
+    Cut the same relative window around many positions out of an array
+    ordered by date, in one fancy-indexing step
+
+    Parameters
+    ----------
+    values: ndarray
+        the data of shape (dates,) or (dates, entities)
+    positions: ndarray
+        the row of day 0 of every window
+    offsets: ndarray
+        the rows of the window relative to day 0
+
+    Returns
+    -------
+    windows : ndarray
+        of shape (positions, offsets) + values.shape[1:], NaN outside the
+        array
+    """
+    rows = np.asarray(positions)[:, None] + np.asarray(offsets)[None, :]
+    inside = (rows >= 0) & (rows < len(values))
+    windows = np.asarray(values, dtype=np.float64)[
+        np.clip(rows, 0, max(len(values) - 1, 0))]
+    mask = inside.reshape(inside.shape + (1,) * (windows.ndim - 2))
+    return np.where(mask, windows, np.nan)
+
+
+def market_model(returns, market):
+    """
+    Fit return = alpha + beta × market + error for every entity and every
+    estimation window at once, from masked moment sums
+
+    This is the least-squares solution of each regression over the days
+    on which both the entity and the market have a return.
+
+    Parameters
+    ----------
+    returns: ndarray
+        the returns of shape (windows, days, entities), NaN if missing
+    market: ndarray
+        the market returns of shape (windows, days), NaN if missing
+
+    Returns
+    -------
+    alpha : ndarray
+        of shape (windows, entities)
+    beta : ndarray
+        of shape (windows, entities)
+    sigma2 : ndarray
+        the variance of the residuals, of shape (windows, entities)
+    n : ndarray
+        the number of days used, of shape (windows, entities)
+    """
+    market = np.broadcast_to(market[:, :, None], returns.shape)
+    valid = ~np.isnan(returns) & ~np.isnan(market)
+    y = np.where(valid, returns, 0.0)
+    x = np.where(valid, market, 0.0)
+    n = valid.sum(axis=1)
+    sx = x.sum(axis=1)
+    sy = y.sum(axis=1)
+    sxx = (x * x).sum(axis=1)
+    sxy = (x * y).sum(axis=1)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        beta = (n * sxy - sx * sy) / (n * sxx - sx * sx)
+        alpha = (sy - beta * sx) / n
+        residual = np.where(valid, y - alpha[:, None, :] -
+                            beta[:, None, :] * x, 0.0)
+        sigma2 = (residual ** 2).sum(axis=1) / (n - 2)
+    enough = n > 2
+    return (np.where(enough, alpha, np.nan), np.where(enough, beta, np.nan),
+            np.where(enough, sigma2, np.nan), n)
+
+
+def event_study(dates, returns, market, event_date, before=10, after=10,
+                estimation=120, gap=10):
+    """
+    Run a market-model event study for all entities and all events as
+    batched array operations
+
+    Day 0 of an event is its first trading day on or after the event date.
+    The estimation window is the estimation trading days ending gap days
+    before the event window opens.
+
+    Parameters
+    ----------
+    dates: DatetimeIndex
+        the sorted trading dates of the rows of returns
+    returns: ndarray
+        the daily returns of shape (dates, entities), NaN if missing
+    market: ndarray
+        the daily returns of the market on the same dates
+    event_date: DatetimeIndex
+        the event dates
+    before: int, default 10
+        the trading days of the event window before day 0
+    after: int, default 10
+        the trading days of the event window after day 0
+    estimation: int, default 120
+        the length of the estimation window in trading days
+    gap: int, default 10
+        the trading days between the estimation and the event windows
+
+    Returns
+    -------
+    result : dict
+        alpha, beta: (events, entities)
+        ar: the abnormal returns, (events, days, entities)
+        car: the cumulative abnormal returns, (events, days, entities)
+        caar: the mean of car across events, (days, entities)
+        t_stat: the t-statistic of caar, (days, entities)
+        days: the offsets of the event window, -before to after
+    """
+    dates = pd.DatetimeIndex(dates).values
+    positions = np.searchsorted(dates, pd.DatetimeIndex(event_date).values,
+                                side='left')
+    days = np.arange(-before, after + 1)
+    est_days = np.arange(-before - gap - estimation, -before - gap)
+
+    alpha, beta, sigma2, n = market_model(
+        gather_windows(returns, positions, est_days),
+        gather_windows(market, positions, est_days))
+    event_ret = gather_windows(returns, positions, days)
+    event_market = gather_windows(market, positions, days)
+    ar = event_ret - alpha[:, None, :] - \
+        beta[:, None, :] * event_market[:, :, None]
+    traded = ~np.isnan(ar)
+    car = np.cumsum(np.where(traded, ar, 0.0), axis=1)
+    # the variance of each CAR grows with the days it has summed
+    car_var = np.cumsum(traded, axis=1) * sigma2[:, None, :]
+    car = np.where(np.isnan(sigma2)[:, None, :], np.nan, car)
+    counted = ~np.isnan(car)
+    events = counted.sum(axis=0)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        caar = np.where(counted, car, 0.0).sum(axis=0) / events
+        caar_std = np.sqrt(np.where(counted, car_var, 0.0).sum(axis=0)) / \
+            events
+        t_stat = caar / caar_std
+    return {
+        'alpha': alpha,
+        'beta': beta,
+        'ar': ar,
+        'car': car,
+        'caar': caar,
+        't_stat': t_stat,
+        'days': days
+    }
+
+
+if __name__ == '__main__':
+    pass
@@ -0,0 +1,145 @@
+# -*- coding: utf-8 -*-
+import argparse
+import pandas as pd
+import utility
+from store import TABLE_KEYS, PanelStore, update_table
+from errors import InvalidIngestData
+
+
+def read_rows(source, table):
+    """
+    Read the new rows of a price table from a CSV file or a DataFrame
+
+    Parameters
+    ----------
+    source: string or DataFrame
+        the path of a CSV file, or a DataFrame, with a column date (or a
+        date index), the entity column of the table and the data columns
+    table: string
+        stock, industry or index
+
+    Returns
+    -------
+    data : DataFrame
+        indexed by date
+    """
+    if table not in TABLE_KEYS:
+        raise InvalidIngestData(
+            'table should be one of ' + ', '.join(TABLE_KEYS))
+    data = pd.read_csv(source) if isinstance(source, str) else source.copy()
+    if 'date' not in data.columns:
+        data = data.reset_index()
+    key = TABLE_KEYS[table]
+    for column in ['date', key]:
+        if column not in data.columns:
+            raise InvalidIngestData(
+                'the rows of {table} need the column {column}'.format(
+                    table=table, column=column))
+    data['date'] = pd.to_datetime(data['date'])
+    data = data.dropna(subset=['date', key])
+    data = data.drop_duplicates(subset=['date', key], keep='last')
+    return data.set_index('date')
+
+
+def upsert(conn, table, data):
+    """
+    Write rows into a price table in one transaction, replacing the rows of
+    the same entity and day
+
+    Parameters
+    ----------
+    conn: Connection
+        the connection to data.db
+    table: string
+        stock, industry or index
+    data: DataFrame
+        the rows indexed by date, from read_rows
+
+    Returns
+    -------
+    count : int
+        the number of rows written
+    """
+    key = TABLE_KEYS[table]
+    columns = [row[1] for row in conn.execute(
+        'pragma table_info("{table}")'.format(table=table))]
+    unknown = [column for column in data.columns if column not in columns]
+    if unknown:
+        raise InvalidIngestData(
+            'unknown columns of {table}: {columns}'.format(
+                table=table, columns=', '.join(unknown)))
+    # dates are written the way the table already stores them
+    sample = conn.execute('select date from "{table}" limit 1'.format(
+        table=table)).fetchone()
+    date_format = '%Y-%m-%d %H:%M:%S' if sample is None or \
+        len(sample[0]) > 10 else '%Y-%m-%d'
+    day = data.index.normalize()
+    names = data[key].astype(str).tolist()
+    data = data.astype(object).where(data.notna(), None)
+    values = [data[column].tolist() if column in data.columns
+              else [None] * len(data) for column in columns]
+    values[columns.index('date')] = day.strftime(date_format).tolist()
+    with conn:
+        conn.executemany(
+            'delete from "{table}" where "{key}" = ? and date >= ? and '
+            'date < ?'.format(table=table, key=key),
+            zip(names, day.strftime('%Y-%m-%d'),
+                (day + pd.Timedelta('1 day')).strftime('%Y-%m-%d')))
+        conn.executemany(
+            'insert into "{table}" ({columns}) values ({params})'.format(
+                table=table,
+                columns=', '.join('"%s"' % column for column in columns),
+                params=', '.join('?' * len(columns))),
+            zip(*values))
+    return len(data)
+
+
+def ingest(source, table, db_path=utility.DB_PATH, store_path=None):
+    """
+    Add new trading days (or corrections) to a price table of data.db and
+    bring the columnar store up to date if it has been built
+
+    Parameters
+    ----------
+    source: string or DataFrame
+        the new rows, see read_rows
+    table: string
+        stock, industry or index
+    db_path: string, default 'data.db'
+        the SQLite file
+    store_path: string, default None
+        the directory of the store, next to the SQLite file if None
+
+    Returns
+    -------
+    summary : dict
+        rows: the number of rows written
+        store: 'updated', 'rebuilt' or None if there is no store
+    """
+    database = utility.Database(db_path, store_path)
+    try:
+        data = read_rows(source, table)
+        database.ensure_indexes()
+        count = upsert(database.conn, table, data)
+        store = None
+        if count and PanelStore.exists(database.store_path):
+            rebuilt = update_table(database.conn, database.store_path, table,
+                                   data)
+            store = 'rebuilt' if rebuilt else 'updated'
+        return {'rows': count, 'store': store}
+    finally:
+        database.close()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Add new rows to a price table of data.db')
+    parser.add_argument('table', choices=sorted(TABLE_KEYS))
+    parser.add_argument('csv', nargs='+', help='CSV files of new rows')
+    parser.add_argument('--db', default=utility.DB_PATH)
+    parser.add_argument('--store', default=None)
+    args = parser.parse_args()
+    for path in args.csv:
+        summary = ingest(path, args.table, args.db, args.store)
+        print('{path}: {rows} rows, store {store}'.format(path=path,
+                                                          **summary))
@@ -0,0 +1,243 @@
+# -*- coding: utf-8 -*-
+import io
+import time
+import pstats
+import cProfile
+import threading
+import tracemalloc
+from collections import defaultdict
+from contextlib import contextmanager, nullcontext
+
+# the stage of a NullInstrument, a reusable context doing nothing
+_NULL_STAGE = nullcontext()
+
+
+class NullInstrument(object):
+    """
+    The instrument of code that is not measured, whose methods do nothing
+    so that the measured places cost one call each
+    """
+
+    enabled = False
+
+    def stage(self, name):
+        return _NULL_STAGE
+
+    def count(self, name, n=1):
+        pass
+
+    def summary(self, top=20):
+        return {'stages': {}, 'counters': {}}
+
+    def reset(self):
+        pass
+
+
+# the shared instrument of everything that is not measured
+NULL = NullInstrument()
+
+
+class Instrument(NullInstrument):
+    """
+    Timers of the stages and counters of the work done by the readers of
+    the database, the Baidu Index spider and EventDriven
+
+    A stage is timed from entry to exit, including the stages inside it,
+    so the time of an outer stage contains the time of the inner ones.
+    The hooks are called after every stage and count with (kind, name,
+    value): ('stage', name, seconds) or ('count', name, n), from the thread
+    that did the work.
+
+    Each thread profiles its own outermost stages, and the profiles are
+    added up when they end. tracemalloc traces the whole process, so the
+    memory peak is recorded for the stages no other stage of any thread
+    is around, and includes what the other threads allocate meanwhile.
+
+    Examples
+    --------
+    >> instrument = Instrument(hooks=[print])
+    >> with instrument.stage('read'):
+    ..     instrument.count('rows_read', 100)
+    count rows_read 100
+    stage read 0.0001
+    """
+
+    enabled = True
+
+    def __init__(self, hooks=None, profile=False, trace_memory=False):
+        """
+        Parameters
+        ----------
+        hooks: list, default None
+            callables taking (kind, name, value)
+        profile: boolean, default False
+            Whether to run cProfile during the outermost stages of every
+            thread, which slows them down
+        trace_memory: boolean, default False
+            Whether to trace the allocations with tracemalloc during the
+            outermost stages and record their peaks, which slows them down
+        """
+        self.hooks = list(hooks or [])
+        self.profile = profile
+        self.trace_memory = trace_memory
+        self.__lock = threading.Lock()
+        self.__started_tracing = False
+        # the depth of the stages of each thread, for the profile
+        self.__local = threading.local()
+        # the depth of the stages of all threads, for the memory peaks
+        self.__active = 0
+        self.reset()
+
+    def reset(self):
+        """
+        Forget the stages, counters and the profile recorded so far
+        """
+        with self.__lock:
+            self.__calls = defaultdict(int)
+            self.__seconds = defaultdict(float)
+            self.__peaks = {}
+            self.__counters = defaultdict(int)
+            self.__stats = None
+
+    def add_hook(self, hook):
+        """
+        Call a hook with (kind, name, value) after every stage and count
+
+        Parameters
+        ----------
+        hook: callable
+        """
+        self.hooks.append(hook)
+
+    @contextmanager
+    def stage(self, name):
+        """
+        Time a block of code as a stage
+
+        Parameters
+        ----------
+        name: string
+            the name of the stage, the times of the stages of the same name
+            are added up
+        """
+        profiler = None
+        if self.profile:
+            depth = getattr(self.__local, 'depth', 0)
+            self.__local.depth = depth + 1
+            if depth == 0:
+                profiler = cProfile.Profile()
+                profiler.enable()
+        outermost = False
+        if self.trace_memory:
+            with self.__lock:
+                outermost = self.__active == 0
+                self.__active += 1
+            if outermost:
+                self.__started_tracing = not tracemalloc.is_tracing()
+                if self.__started_tracing:
+                    tracemalloc.start()
+                tracemalloc.reset_peak()
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            seconds = time.perf_counter() - start
+            peak = None
+            if self.trace_memory:
+                with self.__lock:
+                    self.__active -= 1
+                if outermost:
+                    peak = tracemalloc.get_traced_memory()[1]
+                    if self.__started_tracing:
+                        tracemalloc.stop()
+            if self.profile:
+                self.__local.depth -= 1
+                if profiler is not None:
+                    profiler.disable()
+                    with self.__lock:
+                        if self.__stats is None:
+                            self.__stats = pstats.Stats(profiler)
+                        else:
+                            self.__stats.add(profiler)
+            with self.__lock:
+                self.__calls[name] += 1
+                self.__seconds[name] += seconds
+                if peak is not None:
+                    self.__peaks[name] = max(self.__peaks.get(name, 0), peak)
+            for hook in self.hooks:
+                hook('stage', name, seconds)
+
+    def count(self, name, n=1):
+        """
+        Add to a counter
+
+        Parameters
+        ----------
+        name: string
+            the name of the counter
+        n: int, default 1
+            the amount to add
+        """
+        with self.__lock:
+            self.__counters[name] += n
+        for hook in self.hooks:
+            hook('count', name, n)
+
+    def summary(self, top=20):
+        """
+        Summarize what has been recorded
+
+        Parameters
+        ----------
+        top: int, default 20
+            the number of functions of the profile to keep, by cumulative
+            time
+
+        Returns
+        -------
+        summary : dict
+            stages: name -> {'calls', 'seconds'}, and 'peak_mb' for the
+            outermost stages when tracing memory
+            counters: name -> total
+            profile: the top functions of the outermost stages that have
+            ended, as text, only when profiling
+        """
+        with self.__lock:
+            stages = {}
+            for name in self.__calls:
+                stages[name] = {'calls': self.__calls[name],
+                                'seconds': self.__seconds[name]}
+                if name in self.__peaks:
+                    stages[name]['peak_mb'] = self.__peaks[name] / 2 ** 20
+            result = {'stages': stages, 'counters': dict(self.__counters)}
+            if self.profile:
+                stream = io.StringIO()
+                if self.__stats is not None:
+                    self.__stats.stream = stream
+                    self.__stats.sort_stats('cumulative').print_stats(top)
+                result['profile'] = stream.getvalue()
+        return result
+
+
+def get_instrument(instrument):
+    """
+    Turn the instrument argument of a class into an instrument
+
+    Parameters
+    ----------
+    instrument: Instrument, boolean or None
+        an Instrument to share, True for a new one, None or False for none
+
+    Returns
+    -------
+    instrument : Instrument or NullInstrument
+    """
+    if instrument is None or instrument is False:
+        return NULL
+    if instrument is True:
+        return Instrument()
+    return instrument
+
+
+if __name__ == '__main__':
+    pass
@@ -0,0 +1,247 @@
+# -*- coding: utf-8 -*-
+import numpy as np
+import pandas as pd
+from compact import LOSSY_FIELDS, narrow
+from engine import cumulative_arrays
+from errors import InvalidStockCode
+
+
+def merge_periods(periods):
+    """
+    Merge periods which overlap or touch into sorted disjoint intervals
+
+    Parameters
+    ----------
+    periods: list
+        DatetimeIndex or (start, end) pairs
+
+    Returns
+    -------
+    merged : list
+        (start, end) pairs of Timestamps, both ends included
+    """
+    bounds = sorted((pd.Timestamp(period[0]), pd.Timestamp(period[-1]))
+                    for period in periods if len(period))
+    merged = []
+    for start, end in bounds:
+        if merged and start <= merged[-1][1] + pd.Timedelta('1 day'):
+            merged[-1][1] = max(merged[-1][1], end)
+        else:
+            merged.append([start, end])
+    return [(start, end) for start, end in merged]
+
+
+class Panel(object):
+    """
+    Dense date × entity arrays built from one of the long price tables
+
+    Every field is a 2-D float array with one row per date and one column
+    per entity (stock code, industry name or index name). Days on which an
+    entity has no data are NaN.
+    """
+
+    def __init__(self, dates, codes, fields, cumulative=None,
+                 keep_cumulative=True):
+        """
+        Parameters
+        ----------
+        dates: DatetimeIndex
+            the sorted dates of the rows
+        codes: Index
+            the names of the columns
+        fields: dict
+            field name -> 2-D ndarray of shape (len(dates), len(codes))
+        cumulative: dict, default None
+            the prefix sums of the returns from engine.cumulative_arrays
+            when they have been computed beforehand
+        keep_cumulative: boolean, default True
+            Whether to keep the prefix sums computed by cumulative() for
+            the following calls
+        """
+        self.dates = pd.DatetimeIndex(dates)
+        self.codes = pd.Index(codes)
+        self.fields = fields
+        self.keep_cumulative = keep_cumulative
+        self.__cumulative = cumulative
+
+    def cumulative(self):
+        """
+        Get the prefix sums of the returns, computed once on first use
+        unless they came with the panel, or on every call if the panel does
+        not keep them
+
+        Returns
+        -------
+        cumulative : dict
+            log, sum and count, one row longer than the panel
+        """
+        if self.__cumulative is not None:
+            return self.__cumulative
+        cumulative = cumulative_arrays(self.fields['return'])
+        if self.keep_cumulative:
+            self.__cumulative = cumulative
+        return cumulative
+
+    def __slice_cumulative(self, pos):
+        if self.__cumulative is None:
+            return None
+        return {name: values[:, pos]
+                for name, values in self.__cumulative.items()}
+
+    @classmethod
+    def from_frame(cls, data, key, fields=('return', 'volume'), how='any'):
+        """
+        Build a panel from a long DataFrame indexed by date
+
+        By default rows with a missing value in any of the fields are
+        dropped first, the same way the analysis functions call dropna() on
+        their inputs.
+
+        Parameters
+        ----------
+        data: DataFrame
+            the long table indexed by date
+        key: string
+            the column holding the entity name, e.g. stkcode
+        fields: tuple, default ('return', 'volume')
+            the numeric columns to keep
+        how: string, default 'any'
+            drop a row if 'any' or 'all' of its fields are missing
+
+        Returns
+        -------
+        panel : Panel
+        """
+        fields = [field for field in fields if field in data.columns]
+        data = data.dropna(subset=fields, how=how).dropna(subset=[key])
+        date_pos, dates = pd.factorize(data.index, sort=True)
+        code_pos, codes = pd.factorize(data[key], sort=True)
+        arrays = {}
+        for field in fields:
+            values = np.full((len(dates), len(codes)), np.nan)
+            values[date_pos, code_pos] = data[field].values
+            arrays[field] = values
+        return cls(dates, codes, arrays)
+
+    def to_frame(self, key):
+        """
+        Turn the panel back into a long DataFrame indexed by date, ordered
+        by entity and then by date
+
+        Parameters
+        ----------
+        key: string
+            the name of the column holding the entity name
+
+        Returns
+        -------
+        data : DataFrame
+        """
+        values = {field: array.T.ravel() for field, array in
+                  self.fields.items()}
+        present = np.zeros(len(self.dates) * len(self.codes), dtype=bool)
+        for array in values.values():
+            present |= ~np.isnan(array)
+        data = pd.DataFrame(values)
+        data.insert(0, key, np.repeat(self.codes.values, len(self.dates)))
+        data.index = pd.DatetimeIndex(np.tile(self.dates.values,
+                                              len(self.codes)), name='date')
+        return data.loc[present]
+
+    def __getitem__(self, field):
+        return self.fields[field]
+
+    def __len__(self):
+        return len(self.codes)
+
+    def select(self, codes):
+        """
+        Keep only the given entities, in the given order, without copying
+        the arrays when they are a contiguous range of the panel
+
+        Parameters
+        ----------
+        codes: list
+            the entity names to keep, every one of which must be present
+
+        Returns
+        -------
+        panel : Panel
+        """
+        pos = self.codes.get_indexer(codes)
+        if (pos < 0).any():
+            missing = [str(code) for code, p in zip(codes, pos) if p < 0]
+            raise InvalidStockCode('not in the panel: ' + ', '.join(
+                missing[:10]) + (', ...' if len(missing) > 10 else ''))
+        if len(pos) and (np.diff(pos) == 1).all():
+            return self.columns(pos[0], pos[-1] + 1)
+        return Panel(self.dates, self.codes[pos],
+                     {field: values[:, pos]
+                      for field, values in self.fields.items()},
+                     self.__slice_cumulative(pos), self.keep_cumulative)
+
+    def between(self, periods):
+        """
+        Keep only the dates inside any of the periods
+
+        Parameters
+        ----------
+        periods: list
+            DatetimeIndex or (start, end) pairs
+
+        Returns
+        -------
+        panel : Panel
+        """
+        keep = np.zeros(len(self.dates), dtype=bool)
+        for start, end in merge_periods(periods):
+            keep |= (self.dates >= start) & (self.dates <= end)
+        return Panel(self.dates[keep], self.codes,
+                     {field: values[keep]
+                      for field, values in self.fields.items()},
+                     keep_cumulative=self.keep_cumulative)
+
+    def compact(self):
+        """
+        Store the returns in float32, and the other fields too when no
+        precision is lost
+
+        The prefix sums of the returns are dropped and computed again on
+        every call of cumulative(), from the float32 returns: kept in
+        float64 and int64 they would take about three times the memory of
+        the narrowed fields, and narrowing them too would lose precision
+        in every window read off them.
+
+        Returns
+        -------
+        panel : Panel
+        """
+        return Panel(self.dates, self.codes,
+                     {field: narrow(values, lossy=field in LOSSY_FIELDS)
+                      for field, values in self.fields.items()},
+                     keep_cumulative=False)
+
+    def columns(self, start, stop):
+        """
+        Take a contiguous range of entities without copying the arrays
+
+        Parameters
+        ----------
+        start: int
+            the position of the first entity
+        stop: int
+            one past the position of the last entity
+
+        Returns
+        -------
+        panel : Panel
+        """
+        return Panel(self.dates, self.codes[start:stop],
+                     {field: values[:, start:stop]
+                      for field, values in self.fields.items()},
+                     self.__slice_cumulative(slice(start, stop)),
+                     self.keep_cumulative)
+
+
+if __name__ == '__main__':
+    pass
@@ -0,0 +1,247 @@
+# -*- coding: utf-8 -*-
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+import multiprocessing
+import threading
+import numpy as np
+from panel import Panel
+
+# the panel attached by a worker process, set by _attach
+_worker_panel = None
+# the fewest entities a PanelPool splits across its workers by default,
+# below which starting the tasks costs more than it saves
+MIN_PARALLEL_SIZE = 200
+
+
+class SharedPanel(object):
+    """
+    A copy of a Panel whose arrays live in shared memory, so that worker
+    processes can map the price data instead of unpickling it
+
+    The prefix sums of the returns are computed once here and shared too.
+    """
+
+    def __init__(self, panel):
+        """
+        Parameters
+        ----------
+        panel: Panel
+            the panel to share
+        """
+        self.__blocks = []
+        fields = self.__share(panel.fields)
+        cumulative = self.__share(panel.cumulative()) \
+            if 'return' in panel.fields else None
+        self.spec = (panel.dates, panel.codes, fields, cumulative)
+
+    def __share(self, arrays):
+        specs = {}
+        for name, values in arrays.items():
+            values = np.ascontiguousarray(values)
+            block = shared_memory.SharedMemory(create=True,
+                                               size=max(values.nbytes, 1))
+            np.ndarray(values.shape, values.dtype, buffer=block.buf)[...] = \
+                values
+            self.__blocks.append(block)
+            specs[name] = (block.name, values.shape, values.dtype.str)
+        return specs
+
+    def close(self):
+        """
+        Release and remove the shared memory blocks
+        """
+        for block in self.__blocks:
+            block.close()
+            block.unlink()
+        self.__blocks = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+def attach_panel(spec):
+    """
+    Map a panel shared by SharedPanel into the current process
+
+    Parameters
+    ----------
+    spec: tuple
+        the spec attribute of the SharedPanel
+
+    Returns
+    -------
+    panel : Panel
+    blocks : list
+        the shared memory handles, which must stay alive with the panel
+    """
+    dates, codes, fields, cumulative = spec
+    blocks = []
+
+    def attach(specs):
+        arrays = {}
+        for field, (name, shape, dtype) in specs.items():
+            block = shared_memory.SharedMemory(name=name)
+            arrays[field] = np.ndarray(shape, dtype, buffer=block.buf)
+            blocks.append(block)
+        return arrays
+
+    return Panel(dates, codes, attach(fields),
+                 attach(cumulative) if cumulative is not None else None), \
+        blocks
+
+
+def _attach(spec):
+    global _worker_panel
+    _worker_panel = attach_panel(spec)
+
+
+def _run(func, columns, args):
+    panel = _worker_panel[0]
+    panel = panel.columns(*columns) if isinstance(columns, tuple) \
+        else panel.select(columns)
+    return func(panel, *args)
+
+
+class PanelPool(object):
+    """
+    A pool of worker processes sharing one panel, started on first use and
+    kept for the following calls until close()
+
+    The panel is copied into shared memory once and mapped by every worker,
+    so a call only pickles the entities of its tasks and the extra
+    arguments. Calls on fewer than min_size entities run in this process,
+    where they are faster than a round trip to the workers. The workers
+    are spawned rather than forked, which is safe from the threads of the
+    service and of the batch runner, and the pool can be used from many
+    threads at once.
+    """
+
+    def __init__(self, workers=1, min_size=MIN_PARALLEL_SIZE,
+                 chunks_per_worker=4):
+        """
+        Parameters
+        ----------
+        workers: int, default 1
+            the number of processes, every call runs in this process if 1
+        min_size: int, default MIN_PARALLEL_SIZE
+            the fewest entities a call needs to be split across the workers
+        chunks_per_worker: int, default 4
+            the number of groups of entities given to each worker
+        """
+        self.workers = workers
+        self.min_size = min_size
+        self.chunks_per_worker = chunks_per_worker
+        self.__lock = threading.Lock()
+        self.__panel = None
+        self.__shared = None
+        self.__pool = None
+
+    def is_parallel(self, size):
+        """
+        Whether a call on size entities is split across the workers
+        """
+        return self.workers > 1 and size >= max(self.min_size, 2)
+
+    def __start(self, panel):
+        """
+        Share a panel with new workers, stopping those sharing another one
+        """
+        self.__stop()
+        self.__shared = SharedPanel(panel)
+        self.__pool = ProcessPoolExecutor(
+            self.workers, mp_context=multiprocessing.get_context('spawn'),
+            initializer=_attach, initargs=(self.__shared.spec,))
+        self.__panel = panel
+
+    def __stop(self):
+        if self.__pool is not None:
+            self.__pool.shutdown(wait=True)
+            self.__shared.close()
+        self.__panel = self.__shared = self.__pool = None
+
+    def map(self, func, panel, codes=None, args=()):
+        """
+        Apply func to groups of entities of a panel and collect the results
+        in the order of the entities
+
+        Parameters
+        ----------
+        func: callable
+            a module level function called as func(panel, *args)
+        panel: Panel
+            the panel shared with the workers, which are restarted when it
+            is not the panel of the previous call
+        codes: list, default None
+            the entities, every one of which must be in the panel, all of
+            them if None
+        args: tuple, default ()
+            the extra arguments of func, which are pickled for every task
+
+        Returns
+        -------
+        results : list
+        """
+        size = len(panel) if codes is None else len(codes)
+        if not self.is_parallel(size):
+            return [func(panel if codes is None else panel.select(codes),
+                         *args)]
+        n_chunks = min(size, self.workers * self.chunks_per_worker)
+        bounds = np.linspace(0, size, n_chunks + 1).astype(int)
+        tasks = [(start, stop) if codes is None else list(codes[start:stop])
+                 for start, stop in zip(bounds[:-1], bounds[1:])]
+        # the tasks are submitted before the lock is released, so a restart
+        # by another thread waits for them to finish
+        with self.__lock:
+            if self.__panel is not panel:
+                self.__start(panel)
+            futures = [self.__pool.submit(_run, func, task, args)
+                       for task in tasks]
+        return [future.result() for future in futures]
+
+    def close(self):
+        """
+        Stop the workers and release the shared panel
+        """
+        with self.__lock:
+            self.__stop()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+def map_panel(func, panel, workers=1, args=(), chunks_per_worker=4):
+    """
+    Apply func to consecutive column ranges of a panel in a pool of worker
+    processes started for this call and collect the results in column
+    order
+
+    Parameters
+    ----------
+    func: callable
+        a module level function called as func(panel, *args)
+    panel: Panel
+        the panel to split by entity
+    workers: int, default 1
+        the number of processes, func runs in this process if 1
+    args: tuple, default ()
+        the extra arguments of func, which are pickled for every task
+    chunks_per_worker: int, default 4
+        the number of column ranges given to each worker
+
+    Returns
+    -------
+    results : list
+    """
+    with PanelPool(workers, min_size=2,
+                   chunks_per_worker=chunks_per_worker) as pool:
+        return pool.map(func, panel, args=args)
+
+
+if __name__ == '__main__':
+    pass
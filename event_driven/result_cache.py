@@ -0,0 +1,120 @@
+# -*- coding: utf-8 -*-
+import copy
+import pickle
+import sqlite3
+import hashlib
+import threading
+from collections import OrderedDict
+
+CREATE_TABLE = """
+create table if not exists result (
+    key text primary key,
+    value blob not null
+)
+"""
+
+
+class ResultCache(object):
+    """
+    A bounded least-recently-used cache of analysis results, optionally
+    backed by a SQLite file so that the results survive the process
+
+    The keys are tuples of plain values. Everything that can change a
+    result (the event, its influenced periods, the arguments, the version
+    of the data) has to be part of the key, so an outdated result is never
+    found rather than removed. Results are copied in and out so callers can
+    modify what they get.
+    """
+
+    def __init__(self, maxsize=128, path=None):
+        """
+        Parameters
+        ----------
+        maxsize: int, default 128
+            the number of results kept in memory
+        path: string, default None
+            the SQLite file persisting the results, memory only if None
+        """
+        self.maxsize = maxsize
+        self.path = path
+        self.hits = 0
+        self.misses = 0
+        self.__lock = threading.Lock()
+        self.__memory = OrderedDict()
+        self.__conn = None
+        if path is not None:
+            self.__conn = sqlite3.connect(path, check_same_thread=False)
+            with self.__conn:
+                self.__conn.execute(CREATE_TABLE)
+
+    @staticmethod
+    def __digest(key):
+        return hashlib.sha1(repr(key).encode('utf-8')).hexdigest()
+
+    def __remember(self, digest, value):
+        self.__memory[digest] = value
+        self.__memory.move_to_end(digest)
+        while len(self.__memory) > self.maxsize:
+            self.__memory.popitem(last=False)
+
+    def get(self, key, compute):
+        """
+        Get the result of a key, computing and storing it if missing
+
+        Parameters
+        ----------
+        key: tuple
+            the description of the result
+        compute: callable
+            called without arguments to compute the result
+
+        Returns
+        -------
+        value : object
+        """
+        digest = self.__digest(key)
+        with self.__lock:
+            if digest in self.__memory:
+                self.__memory.move_to_end(digest)
+                self.hits += 1
+                return copy.deepcopy(self.__memory[digest])
+            if self.__conn is not None:
+                row = self.__conn.execute(
+                    'select value from result where key = ?',
+                    (digest,)).fetchone()
+                if row is not None:
+                    value = pickle.loads(row[0])
+                    self.__remember(digest, value)
+                    self.hits += 1
+                    return copy.deepcopy(value)
+            self.misses += 1
+        value = compute()
+        with self.__lock:
+            self.__remember(digest, copy.deepcopy(value))
+            if self.__conn is not None:
+                with self.__conn:
+                    self.__conn.execute(
+                        'insert or replace into result values (?, ?)',
+                        (digest, pickle.dumps(value)))
+        return value
+
+    def clear(self):
+        """
+        Remove every result, from memory and from the file
+        """
+        with self.__lock:
+            self.__memory.clear()
+            if self.__conn is not None:
+                with self.__conn:
+                    self.__conn.execute('delete from result')
+
+    def __len__(self):
+        return len(self.__memory)
+
+    def close(self):
+        if self.__conn is not None:
+            self.__conn.close()
+
+
+if __name__ == '__main__':
+    pass
@@ -0,0 +1,389 @@
+# -*- coding: utf-8 -*-
+import json
+import inspect
+import argparse
+import threading
+import numpy as np
+import pandas as pd
+import utility
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor, TimeoutError
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from event_driven import EventDriven
+from errors import BaseError, BaiduIndexError, InvalidRequest, ServiceBusy
+
+# the requests served, and the methods of EventDriven answering them
+METHODS = {
+    'fit': 'fit',
+    'index_effect': 'get_index_effect',
+    'industry_effect': 'get_industry_effect',
+    'stock_effect': 'get_stock_effect',
+    'market_effect': 'get_market_effect',
+    'abnormal_return': 'get_abnormal_return',
+    'stock_analysis': 'get_stock_analysis',
+    'market_analysis': 'get_market_analysis'
+}
+# the arguments of fit() which tell fitted events apart
+FIT_ARGS = ('method', 'threshold', 'window', 'offset')
+
+
+def to_json(value):
+    """
+    Convert a result of EventDriven into plain JSON values
+
+    DataFrames become {'columns', 'index', 'data'}, dates ISO strings and
+    NaN null.
+
+    Parameters
+    ----------
+    value: object
+        a DataFrame, Series, dict, list, date or number
+
+    Returns
+    -------
+    value : object
+    """
+    if isinstance(value, (pd.DataFrame, pd.Series)):
+        return json.loads(value.to_json(orient='split', date_format='iso',
+                                        force_ascii=False))
+    if isinstance(value, pd.Index):
+        return to_json(value.to_series())['data']
+    if isinstance(value, dict):
+        return {str(key.isoformat() if isinstance(key, pd.Timestamp)
+                    else key): to_json(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [to_json(item) for item in value]
+    if isinstance(value, pd.Timestamp):
+        return value.isoformat()
+    if isinstance(value, np.generic):
+        value = value.item()
+    if isinstance(value, float) and np.isnan(value):
+        return None
+    return value
+
+
+class AnalysisService(object):
+    """
+    Serve the analyses of EventDriven to many clients from one process
+    which keeps the market data and the fitted events in memory
+
+    Every event is fitted once, by a fork of the base instance, and kept
+    for the following requests (up to max_events, least recently used
+    first out). Identical requests arriving while one is being computed
+    wait for its result instead of computing it again. At most
+    max_pending distinct requests are queued or running; beyond that
+    ServiceBusy is raised, which the HTTP server answers with 503.
+
+    A request is a method of METHODS and a dict of parameters holding
+    event_name, event_date, optionally the settings of fit() (method,
+    threshold, window, offset) and the arguments of the method.
+
+    Examples
+    --------
+    >> service = AnalysisService(EventDriven())
+    >> service.call('industry_effect', {'event_name': '降准',
+    ..                                  'event_date': ['2018-10-15'],
+    ..                                  'head': 3})
+    """
+
+    def __init__(self, event_driven=None, threads=4, max_pending=32,
+                 max_events=64, timeout=None):
+        """
+        Parameters
+        ----------
+        event_driven: EventDriven, default None
+            the base instance whose tables and caches are shared, a new
+            one if None
+        threads: int, default 4
+            the number of requests computed at the same time
+        max_pending: int, default 32
+            the number of distinct requests queued or running
+        max_events: int, default 64
+            the number of fitted events kept
+        timeout: float, default None
+            seconds the HTTP server waits for a result before answering
+            504, no limit if None
+        """
+        self.event_driven = event_driven if event_driven is not None \
+            else EventDriven()
+        self.max_events = max_events
+        self.timeout = timeout
+        self.requests = 0
+        self.coalesced = 0
+        self.rejected = 0
+        self.__pool = ThreadPoolExecutor(threads)
+        self.__slots = threading.BoundedSemaphore(max_pending)
+        self.__lock = threading.Lock()
+        self.__pending = {}
+        self.__events = OrderedDict()
+        self.__fitting = {}
+
+    @staticmethod
+    def __event_key(params):
+        """
+        Identify the fitted event a request needs, keeping the event dates
+        in the order fit() receives them
+        """
+        if 'event_name' not in params or 'event_date' not in params:
+            raise InvalidRequest('a request needs event_name and event_date')
+        event_date = params['event_date']
+        if not isinstance(event_date, list):
+            raise InvalidRequest('event_date should be a list')
+        return (params['event_name'], tuple(map(str, event_date)),
+                tuple((name, params[name]) for name in FIT_ARGS
+                      if name in params))
+
+    def __get_event(self, params):
+        """
+        Get the fork of the base instance fitted to the event of a request,
+        fitting it only once however many requests need it together
+
+        Returns
+        -------
+        event : EventDriven
+        influenced : dict
+            the influenced periods returned by fit()
+        """
+        key = self.__event_key(params)
+        with self.__lock:
+            if key in self.__events:
+                self.__events.move_to_end(key)
+                return self.__events[key]
+            future = self.__fitting.get(key)
+            owner = future is None
+            if owner:
+                future = self.__fitting[key] = Future()
+        if not owner:
+            return future.result()
+        try:
+            event = self.event_driven.fork()
+            influenced = event.fit(
+                list(params['event_date']), params['event_name'],
+                display=True, **{name: value for name, value in key[2]})
+            fitted = (event, influenced)
+            with self.__lock:
+                self.__events[key] = fitted
+                while len(self.__events) > self.max_events:
+                    self.__events.popitem(last=False)
+            future.set_result(fitted)
+            return fitted
+        except BaseException as error:
+            future.set_exception(error)
+            raise
+        finally:
+            with self.__lock:
+                del self.__fitting[key]
+
+    def __run(self, method, params):
+        """
+        Compute a request
+        """
+        event, influenced = self.__get_event(params)
+        if method == 'fit':
+            return influenced
+        kwargs = {name: value for name, value in params.items()
+                  if name not in ('event_name', 'event_date') + FIT_ARGS}
+        if method in ('index_effect', 'industry_effect', 'stock_effect') \
+                and 'significance' in kwargs:
+            kwargs['method'] = kwargs.pop('significance')
+        # only the arguments are checked, a TypeError raised inside the
+        # method is an error of the server
+        try:
+            inspect.signature(getattr(EventDriven, METHODS[method])).bind(
+                event, **kwargs)
+        except TypeError as error:
+            raise InvalidRequest(str(error))
+        return getattr(event, METHODS[method])(**kwargs)
+
+    def __release(self, key):
+        with self.__lock:
+            del self.__pending[key]
+        self.__slots.release()
+
+    def submit(self, method, params):
+        """
+        Queue a request, or join the identical one already queued
+
+        Parameters
+        ----------
+        method: string
+            a key of METHODS
+        params: dict
+            the event and the arguments of the method; the significance
+            test of the effects is chosen with significance instead of
+            method, which belongs to fit()
+
+        Returns
+        -------
+        future : Future
+            resolving to the result of the EventDriven method
+        """
+        if method not in METHODS:
+            raise InvalidRequest('unknown request ' + str(method))
+        if not isinstance(params, dict):
+            raise InvalidRequest('the parameters should be an object')
+        self.__event_key(params)
+        key = (method, json.dumps(params, sort_keys=True, default=str))
+        with self.__lock:
+            self.requests += 1
+            future = self.__pending.get(key)
+            if future is not None:
+                self.coalesced += 1
+                return future
+            if not self.__slots.acquire(blocking=False):
+                self.rejected += 1
+                raise ServiceBusy('too many requests are pending')
+            future = self.__pool.submit(self.__run, method, params)
+            self.__pending[key] = future
+        future.add_done_callback(lambda _: self.__release(key))
+        return future
+
+    def call(self, method, params, timeout=None):
+        """
+        Compute a request and wait for its result
+
+        Parameters
+        ----------
+        method, params:
+            see submit
+        timeout: float, default None
+            seconds to wait, no limit if None
+
+        Returns
+        -------
+        result : object
+        """
+        return self.submit(method, params).result(timeout)
+
+    def stats(self):
+        """
+        Describe the load of the service
+
+        Returns
+        -------
+        stats : dict
+            requests, coalesced, rejected, pending, events (fitted and
+            kept) and instrument (the get_stats() of the base instance)
+        """
+        with self.__lock:
+            return {
+                'requests': self.requests,
+                'coalesced': self.coalesced,
+                'rejected': self.rejected,
+                'pending': len(self.__pending),
+                'events': len(self.__events),
+                'instrument': self.event_driven.get_stats()
+            }
+
+    def server(self, host='127.0.0.1', port=8000):
+        """
+        Create the HTTP server of the service
+
+        POST /<request> with the parameters as a JSON object answers the
+        result as JSON; GET /stats answers stats() and GET /health 'ok'.
+        Errors are answered as {'error': name, 'message': details} with
+        status 400 for invalid requests, 502 when the Baidu Index cannot be
+        downloaded, 503 when busy, 504 on timeout and 500 for any other
+        error.
+
+        Parameters
+        ----------
+        host: string, default '127.0.0.1'
+        port: int, default 8000
+            any free port if 0
+
+        Returns
+        -------
+        server : ThreadingHTTPServer
+            call serve_forever() to serve
+        """
+        service = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def send(self, status, value):
+                body = json.dumps(to_json(value), ensure_ascii=False).encode(
+                    'utf-8')
+                self.send_response(status)
+                self.send_header('Content-Type',
+                                 'application/json; charset=utf-8')
+                self.send_header('Content-Length', str(len(body)))
+                if status == 503:
+                    self.send_header('Retry-After', '1')
+                self.end_headers()
+                self.wfile.write(body)
+
+            def error(self, status, name, message):
+                self.send(status, {'error': name, 'message': message})
+
+            def do_GET(self):
+                if self.path == '/stats':
+                    self.send(200, service.stats())
+                elif self.path == '/health':
+                    self.send(200, 'ok')
+                else:
+                    self.error(404, 'NotFound', self.path)
+
+            def do_POST(self):
+                length = int(self.headers.get('Content-Length') or 0)
+                try:
+                    params = json.loads(self.rfile.read(length) or b'{}')
+                except ValueError as error:
+                    self.error(400, 'InvalidJSON', str(error))
+                    return
+                try:
+                    result = service.call(self.path.strip('/'), params,
+                                          service.timeout)
+                except ServiceBusy as error:
+                    self.error(503, 'ServiceBusy', str(error))
+                except TimeoutError:
+                    self.error(504, 'Timeout', 'the result is not ready')
+                except BaiduIndexError as error:
+                    self.error(502, type(error).__name__, str(error))
+                except BaseError as error:
+                    self.error(400, type(error).__name__, str(error))
+                except Exception as error:
+                    self.error(500, type(error).__name__, str(error))
+                else:
+                    self.send(200, result)
+
+            def log_message(self, *args):
+                pass
+
+        server = ThreadingHTTPServer((host, port), Handler)
+        server.daemon_threads = True
+        return server
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Serve the analyses of EventDriven over HTTP/JSON')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--db', default=utility.DB_PATH)
+    parser.add_argument('--baidu-cache', default='baidu_index.db')
+    parser.add_argument('--workers', type=int, default=1,
+                        help='processes of the whole-market analyses')
+    parser.add_argument('--threads', type=int, default=4,
+                        help='requests computed at the same time')
+    parser.add_argument('--max-pending', type=int, default=32)
+    parser.add_argument('--timeout', type=float, default=None)
+    parser.add_argument('--compact', action='store_true')
+    parser.add_argument('--preload-stock', action='store_true',
+                        help='load the whole table stock at start')
+    args = parser.parse_args()
+    event = EventDriven(workers=args.workers, baidu_cache=args.baidu_cache,
+                        db_path=args.db, compact=args.compact,
+                        instrument=True)
+    event.preload(stock=args.preload_stock)
+    service = AnalysisService(event, threads=args.threads,
+                              max_pending=args.max_pending,
+                              timeout=args.timeout)
+    server = service.server(args.host, args.port)
+    print('serving on http://{host}:{port}'.format(
+        host=args.host, port=server.server_address[1]))
+    try:
+        server.serve_forever()
+    finally:
+        event.close()
@@ -0,0 +1,212 @@
+# -*- coding: utf-8 -*-
+import numpy as np
+import pandas as pd
+from engine import GRID_BUDGET
+from errors import InvalidSignificanceMethod
+
+
+def prefix_sums(values):
+    """
+    Build the prefix sums of the values and of the number of values along
+    the date axis, so that the mean over any window takes two lookups
+
+    Parameters
+    ----------
+    values: ndarray
+        the data ordered by date, NaN if missing
+
+    Returns
+    -------
+    sums : ndarray
+        one row longer than values, starting with 0
+    counts : ndarray
+        the number of values present, laid out like sums
+    """
+    values = np.asarray(values, dtype=np.float64)
+    present = ~np.isnan(values)
+    sums = np.zeros((values.shape[0] + 1,) + values.shape[1:])
+    counts = np.zeros(sums.shape, dtype=np.int64)
+    np.cumsum(np.where(present, values, 0.0), axis=0, out=sums[1:])
+    np.cumsum(present, axis=0, out=counts[1:])
+    return sums, counts
+
+
+def window_means(sums, counts, start, stop):
+    """
+    Compute the mean over many windows at once
+
+    Parameters
+    ----------
+    sums, counts: ndarray
+        the output of prefix_sums
+    start: ndarray
+        the first row of every window, of any shape
+    stop: ndarray
+        one past the last row of every window, of the same shape
+
+    Returns
+    -------
+    means : ndarray
+        of shape start.shape + sums.shape[1:], NaN for an empty window
+    """
+    count = counts[stop] - counts[start]
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return np.where(count > 0, (sums[stop] - sums[start]) / count,
+                        np.nan)
+
+
+def effect_statistics(per_event):
+    """
+    Reduce the effect of every event to the mean return and the rise
+    probability across events, the same way aggregate_effect does
+
+    Parameters
+    ----------
+    per_event: ndarray
+        the effects of shape (..., events, entities), NaN if the entity
+        has no data in the window of the event
+
+    Returns
+    -------
+    mean_return : ndarray
+        of shape (..., entities)
+    up_prob : ndarray
+        of shape (..., entities)
+    """
+    present = ~np.isnan(per_event)
+    count = present.sum(axis=-2)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        mean_return = np.where(present, per_event, 0.0).sum(axis=-2) / count
+        up_prob = (present & (per_event >= 0)).sum(axis=-2) / count
+    return mean_return, up_prob
+
+
+def effect_significance(dates, returns, periods, benchmark=None,
+                        resamples=1000, method='permutation', seed=None,
+                        cumulative=None, benchmark_cumulative=None):
+    """
+    Measure how likely the effect of an event on every entity is to arise
+    by chance, evaluating all resamples as array operations over prefix
+    sums
+
+    'permutation' places every window of the event at random positions in
+    the history, keeping its length, and compares the observed effect with
+    those of the pseudo-events. 'bootstrap' resamples the events with
+    replacement and tests whether the mean return differs from 0 and the
+    rise probability from 0.5.
+
+    Parameters
+    ----------
+    dates: DatetimeIndex
+        the sorted dates of the rows of returns
+    returns: ndarray
+        the daily returns of shape (dates, entities), NaN if missing
+    periods: list
+        the influenced period of every event (DatetimeIndex or (start,
+        end) pairs)
+    benchmark: ndarray, default None
+        the daily returns of the benchmark on the same dates, whose mean
+        over each window is subtracted
+    resamples: int, default 1000
+        the number of pseudo-event sets or bootstrap samples
+    method: string, default 'permutation'
+        'permutation' or 'bootstrap'
+    seed: int, default None
+        the seed of the random generator
+    cumulative: dict, default None
+        the prefix sums of returns from engine.cumulative_arrays, computed
+        if None
+    benchmark_cumulative: dict, default None
+        the prefix sums of benchmark laid out the same way, 1-D, which are
+        used instead of benchmark when given
+
+    Returns
+    -------
+    result : dict
+        return, up_prob: the observed statistics of every entity
+        p_value, up_prob_p: their two-sided p-values
+    """
+    dates = pd.DatetimeIndex(dates).values
+    returns = np.asarray(returns, dtype=np.float64)
+    start = np.array([np.searchsorted(dates, np.datetime64(
+        pd.Timestamp(period[0])), side='left') for period in periods],
+                     dtype=np.int64)
+    stop = np.array([np.searchsorted(dates, np.datetime64(
+        pd.Timestamp(period[-1])), side='right') for period in periods],
+                    dtype=np.int64)
+    if cumulative is not None:
+        sums, counts = cumulative['sum'], cumulative['count']
+    else:
+        sums, counts = prefix_sums(returns)
+    if benchmark_cumulative is not None:
+        bench_sums = benchmark_cumulative['sum']
+        bench_counts = benchmark_cumulative['count']
+        benchmark = bench_sums
+    elif benchmark is not None:
+        bench_sums, bench_counts = prefix_sums(benchmark)
+
+    def per_event(first, last):
+        effect = window_means(sums, counts, first, last)
+        if benchmark is not None:
+            effect = effect - window_means(bench_sums, bench_counts, first,
+                                           last)[..., None]
+        return effect
+
+    observed = per_event(start, stop)
+    mean_return, up_prob = effect_statistics(observed)
+    rng = np.random.default_rng(seed)
+    n_entity = max(returns.shape[1], 1)
+    chunk = max(1, GRID_BUDGET // max(len(start) * n_entity, 1))
+
+    if method == 'permutation':
+        length = stop - start
+        null = [[np.empty((0, returns.shape[1]), dtype=np.float32)]
+                for _ in range(2)]
+        for lo in range(0, resamples, chunk):
+            size = min(chunk, resamples - lo)
+            first = rng.integers(0, np.maximum(len(dates) - length, 0) + 1,
+                                 size=(size, len(start)))
+            stats = effect_statistics(per_event(first, first + length))
+            for i, stat in enumerate(stats):
+                null[i].append(stat.astype(np.float32))
+        p_values = []
+        for stat, samples in zip((mean_return, up_prob), null):
+            samples = np.concatenate(samples, axis=0)
+            with np.errstate(invalid='ignore'):
+                center = np.nanmean(samples, axis=0) \
+                    if len(samples) else np.zeros_like(stat)
+                deviation = np.abs(stat - center)
+                hits = (np.abs(samples - center) >= deviation - 1e-12).sum(
+                    axis=0)
+            p_values.append(np.where(np.isnan(stat), np.nan,
+                                     (hits + 1) / (resamples + 1)))
+    elif method == 'bootstrap':
+        p_values = []
+        below = [np.zeros(returns.shape[1], dtype=np.int64)
+                 for _ in range(2)]
+        above = [np.zeros(returns.shape[1], dtype=np.int64)
+                 for _ in range(2)]
+        for lo in range(0, resamples, chunk):
+            size = min(chunk, resamples - lo)
+            pick = rng.integers(0, len(start), size=(size, len(start)))
+            stats = effect_statistics(observed[pick])
+            for i, (stat, null) in enumerate(zip(stats, (0.0, 0.5))):
+                below[i] += (stat <= null).sum(axis=0)
+                above[i] += (stat >= null).sum(axis=0)
+        for stat, low, high in zip((mean_return, up_prob), below, above):
+            p_value = np.minimum(1.0, 2 * (np.minimum(low, high) + 1) /
+                                 (resamples + 1))
+            p_values.append(np.where(np.isnan(stat), np.nan, p_value))
+    else:
+        raise InvalidSignificanceMethod(
+            "method should be one of 'permutation' and 'bootstrap'")
+    return {
+        'return': mean_return,
+        'up_prob': up_prob,
+        'p_value': p_values[0],
+        'up_prob_p': p_values[1]
+    }
+
+
+if __name__ == '__main__':
+    pass
@@ -0,0 +1,344 @@
+# -*- coding: utf-8 -*-
+import os
+import io
+import json
+import numpy as np
+import pandas as pd
+from panel import Panel
+from engine import cumulative_arrays
+
+# the prefix sums of the returns saved next to every table, see
+# engine.cumulative_arrays
+CUMULATIVE = ('log', 'sum', 'count')
+
+# table name -> the column holding the entity name
+TABLE_KEYS = {
+    'stock': 'stkcode',
+    'industry': 'industry_name',
+    'index': 'index'
+}
+
+
+class PanelStore(object):
+    """
+    A directory of memory-mapped .npy arrays holding the price tables of
+    data.db as dense date × entity panels
+
+    Layout::
+
+        <path>/meta.json
+        <path>/<table>/dates.npy
+        <path>/<table>/codes.npy
+        <path>/<table>/<field>.npy
+        <path>/<table>/cum_<log|sum|count>.npy
+        <path>/stock_industry/stock.npy
+        <path>/stock_industry/industry_name.npy
+    """
+
+    def __init__(self, path):
+        """
+        Parameters
+        ----------
+        path: string
+            the directory of the store
+        """
+        self.path = path
+        with open(os.path.join(path, 'meta.json')) as f:
+            self.meta = json.load(f)
+        self.__panels = {}
+
+    @staticmethod
+    def exists(path):
+        """
+        Whether a store has been built in the directory
+        """
+        return os.path.isfile(os.path.join(path, 'meta.json'))
+
+    def __load(self, table, name):
+        return np.load(os.path.join(self.path, table, name + '.npy'),
+                       mmap_mode='r')
+
+    def panel(self, table):
+        """
+        Map a table as a Panel without reading the arrays into memory
+
+        Parameters
+        ----------
+        table: string
+            stock, industry or index
+
+        Returns
+        -------
+        panel : Panel
+        """
+        if table not in self.__panels:
+            fields = {field: self.__load(table, field)
+                      for field in self.meta[table]['fields']}
+            cumulative = {name: self.__load(table, 'cum_' + name)
+                          for name in CUMULATIVE} \
+                if self.meta[table].get('cumulative') else None
+            self.__panels[table] = Panel(self.__load(table, 'dates'),
+                                         self.__load(table, 'codes'),
+                                         fields, cumulative)
+        return self.__panels[table]
+
+    def frame(self, table, codes=None, periods=None):
+        """
+        Read a table back as the long DataFrame indexed by date returned by
+        the functions in utility
+
+        Parameters
+        ----------
+        table: string
+            stock, industry or index
+        codes: list, default None
+            only read these entities, all if None
+        periods: list, default None
+            only read the dates inside these periods, all if None
+
+        Returns
+        -------
+        data : DataFrame
+        """
+        panel = self.panel(table)
+        if codes is not None:
+            panel = panel.select([code for code in codes
+                                  if code in panel.codes])
+        if periods is not None:
+            panel = panel.between(periods)
+        return panel.to_frame(TABLE_KEYS[table])
+
+    def stock_industry(self):
+        """
+        Read the lookup table from stock code to industry name
+
+        Returns
+        -------
+        stock_ind_data : DataFrame
+        """
+        return pd.DataFrame({
+            'stock': self.__load('stock_industry', 'stock'),
+            'industry_name': self.__load('stock_industry', 'industry_name')
+        })
+
+
+def build_table(conn, path, table):
+    """
+    Convert one price table of a database into the arrays of a PanelStore
+
+    Parameters
+    ----------
+    conn: Connection
+        the connection to data.db
+    path: string
+        the directory of the store, created if missing
+    table: string
+        stock, industry or index
+
+    Returns
+    -------
+    meta : dict
+        the description of the table in meta.json
+    """
+    key = TABLE_KEYS[table]
+    data = pd.read_sql("select * from '{table}'".format(table=table),
+                       conn, index_col='date', parse_dates=['date'])
+    fields = [column for column in data.columns if column != key and
+              pd.api.types.is_numeric_dtype(data[column])]
+    panel = Panel.from_frame(data, key, fields=fields, how='all')
+    os.makedirs(os.path.join(path, table), exist_ok=True)
+    np.save(os.path.join(path, table, 'dates.npy'), panel.dates.values)
+    np.save(os.path.join(path, table, 'codes.npy'),
+            np.asarray(panel.codes, dtype=str))
+    for field, values in panel.fields.items():
+        np.save(os.path.join(path, table, field + '.npy'), values)
+    for name, values in panel.cumulative().items():
+        np.save(os.path.join(path, table, 'cum_' + name + '.npy'), values)
+    return {'key': key, 'fields': list(panel.fields), 'cumulative': True}
+
+
+def write_meta(path, meta):
+    """
+    Write meta.json, which marks the store as complete
+
+    Parameters
+    ----------
+    path: string
+        the directory of the store
+    meta: dict
+        table name -> the description of the table
+    """
+    with open(os.path.join(path, 'meta.json'), 'w') as f:
+        json.dump(meta, f)
+
+
+def build_store(conn, path):
+    """
+    Convert the tables stock, industry, index and stock_industry of a
+    database into a PanelStore
+
+    Parameters
+    ----------
+    conn: Connection
+        the connection to data.db
+    path: string
+        the directory of the store, created if missing
+
+    Returns
+    -------
+    store : PanelStore
+    """
+    meta = {}
+    for table in TABLE_KEYS:
+        meta[table] = build_table(conn, path, table)
+
+    stock_ind = pd.read_sql('select * from stock_industry', conn)
+    os.makedirs(os.path.join(path, 'stock_industry'), exist_ok=True)
+    for column in ['stock', 'industry_name']:
+        np.save(os.path.join(path, 'stock_industry', column + '.npy'),
+                np.asarray(stock_ind[column], dtype=str))
+    write_meta(path, meta)
+    return PanelStore(path)
+
+
+def append_rows(filename, rows):
+    """
+    Append rows to a .npy file in place by rewriting its header, which
+    np.save pads so that the shape can grow
+
+    Parameters
+    ----------
+    filename: string
+        the .npy file of a C-ordered array
+    rows: ndarray
+        the rows to append, whose shape matches the array but for the
+        first axis
+
+    Returns
+    -------
+    appended : boolean
+        False if the file could not be extended in place, in which case it
+        is left unchanged
+    """
+    with open(filename, 'r+b') as f:
+        version = np.lib.format.read_magic(f)
+        if version == (1, 0):
+            shape, fortran_order, dtype = \
+                np.lib.format.read_array_header_1_0(f)
+        elif version == (2, 0):
+            shape, fortran_order, dtype = \
+                np.lib.format.read_array_header_2_0(f)
+        else:
+            return False
+        offset = f.tell()
+        rows = np.ascontiguousarray(rows, dtype=dtype)
+        if fortran_order or rows.shape[1:] != tuple(shape[1:]):
+            return False
+        header = io.BytesIO()
+        write_header = np.lib.format.write_array_header_1_0 \
+            if version == (1, 0) else np.lib.format.write_array_header_2_0
+        write_header(header, {
+            'descr': np.lib.format.dtype_to_descr(dtype),
+            'fortran_order': False,
+            'shape': (shape[0] + rows.shape[0],) + tuple(shape[1:])
+        })
+        if len(header.getvalue()) != offset:
+            return False
+        f.seek(offset + int(np.prod(shape)) * dtype.itemsize)
+        f.write(rows.tobytes())
+        f.seek(0)
+        f.write(header.getvalue())
+    return True
+
+
+def update_table(conn, path, table, data):
+    """
+    Bring one table of a PanelStore up to date with rows just written to
+    the database, without rebuilding it when possible
+
+    Values of dates already in the store are overwritten in place, missing
+    ones included as the database holds NULL there, and new trading days
+    after the last one are appended to the arrays. The prefix sums of the
+    returns are recomputed from the first changed day only. New
+    entities or dates inserted in the middle need new columns or rows
+    inside the arrays, so the table is then rebuilt from the database.
+
+    Parameters
+    ----------
+    conn: Connection
+        the connection to data.db, already holding the rows
+    path: string
+        the directory of the store
+    table: string
+        stock, industry or index
+    data: DataFrame
+        the rows written, indexed by date
+
+    Returns
+    -------
+    rebuilt : boolean
+        Whether the table had to be rebuilt
+    """
+    store = PanelStore(path)
+    key = TABLE_KEYS[table]
+    fields = store.meta[table]['fields']
+    panel = store.panel(table)
+    new = Panel.from_frame(data, key, fields=fields, how='all')
+    row = panel.dates.get_indexer(new.dates)
+    column = panel.codes.get_indexer(new.codes)
+    appended = row < 0
+    if (column < 0).any() or (appended.any() and len(panel.dates) and
+                              new.dates[appended].min() <= panel.dates[-1]):
+        store.meta[table] = build_table(conn, path, table)
+        write_meta(path, store.meta)
+        return True
+
+    folder = os.path.join(path, table)
+    extend = [('dates', new.dates[appended].values.astype(
+        panel.dates.values.dtype))]
+    # the cells of the rows written on dates already in the store
+    written_row = panel.dates.get_indexer(data.index)
+    written_column = panel.codes.get_indexer(data[key])
+    written = (written_row >= 0) & (written_column >= 0)
+    written_row, written_column = written_row[written], \
+        written_column[written]
+    for field in fields:
+        values = new[field]
+        existing = np.load(os.path.join(folder, field + '.npy'),
+                           mmap_mode='r+')
+        if written.any() and field in data.columns:
+            existing[written_row, written_column] = \
+                data[field].values[written]
+            existing.flush()
+        del existing
+        added = np.full((appended.sum(), len(panel.codes)), np.nan)
+        added[:, column] = values[appended]
+        extend.append((field, added))
+    if 'return' in fields and store.meta[table].get('cumulative'):
+        first = written_row.min() if written.any() else len(panel.dates)
+        returns = np.load(os.path.join(folder, 'return.npy'), mmap_mode='r')
+        returns = np.concatenate([returns[first:], dict(extend)['return']])
+        for name, tail in cumulative_arrays(returns).items():
+            existing = np.load(os.path.join(folder, 'cum_' + name + '.npy'),
+                               mmap_mode='r+')
+            tail = existing[first] + tail[1:]
+            existing[first + 1:] = tail[:len(existing) - first - 1]
+            existing.flush()
+            del existing
+            extend.append(('cum_' + name, tail[len(panel.dates) - first:]))
+    del panel, store
+    for name, rows in extend:
+        if len(rows) and not append_rows(os.path.join(folder, name + '.npy'),
+                                         rows):
+            meta = PanelStore(path).meta
+            meta[table] = build_table(conn, path, table)
+            write_meta(path, meta)
+            return True
+    write_meta(path, PanelStore(path).meta)
+    return False
+
+
+if __name__ == '__main__':
+    import utility
+    database = utility.Database()
+    build_store(database.conn, database.store_path)
@@ -0,0 +1,171 @@
+# -*- coding: utf-8 -*-
+import os
+import sqlite3
+import numpy as np
+import pandas as pd
+
+# the names of the indexes, so that the defaults such as market='上证综指'
+# of get_abnormal_return work on a synthetic database
+INDEX_NAMES = ['上证综指', '深圳成指', '上证50', '沪深500', '中证500',
+               '中小板指数', '创业板指数']
+# the first trading day of a synthetic database
+START_DATE = '2011-01-04'
+
+
+def trading_dates(years, start_date=START_DATE):
+    """
+    Get the business days of some years, which stand for the trading days
+
+    Parameters
+    ----------
+    years: int
+        the number of years
+    start_date: string, default START_DATE
+        the first day
+
+    Returns
+    -------
+    dates : DatetimeIndex
+    """
+    start = pd.Timestamp(start_date)
+    return pd.bdate_range(start, start + pd.DateOffset(years=years) -
+                          pd.Timedelta('1 day'))
+
+
+def make_events(dates, events, seed=0):
+    """
+    Draw the event dates among the trading days, away from both ends so
+    that every window fits
+
+    Parameters
+    ----------
+    dates: DatetimeIndex
+        the trading days
+    events: int
+        the number of events
+    seed: int, default 0
+        the seed of the random generator
+
+    Returns
+    -------
+    event_date : list
+        sorted strings '%Y-%m-%d', the form fit() takes
+    """
+    rng = np.random.default_rng(seed)
+    margin = min(160, len(dates) // 4)
+    picked = rng.choice(np.arange(margin, len(dates) - margin),
+                        size=min(events, len(dates) - 2 * margin),
+                        replace=False)
+    return list(dates[np.sort(picked)].strftime('%Y-%m-%d'))
+
+
+def make_database(path, stocks=300, industries=30, years=8,
+                  indexes=len(INDEX_NAMES), missing=0.05, seed=0,
+                  start_date=START_DATE):
+    """
+    Write a database of random market data with the tables and columns of
+    data.db: stock(date, stkcode, return, volume), industry(date,
+    industry_name, return, volume), index(date, index, return, volume) and
+    stock_industry(stock, industry_name)
+
+    The returns follow a one-factor model: every industry moves with the
+    market and every stock with its industry, so that the effects and the
+    market model have something to find. Stocks miss a share of the days,
+    like suspended stocks.
+
+    Parameters
+    ----------
+    path: string
+        the SQLite file, replaced if it exists
+    stocks: int, default 300
+        the number of stocks
+    industries: int, default 30
+        the number of industries
+    years: int, default 8
+        the number of years of trading days
+    indexes: int, default all of INDEX_NAMES
+        the number of indexes
+    missing: float, default 0.05
+        the share of the days without a row of a stock
+    seed: int, default 0
+        the seed of the random generator
+    start_date: string, default START_DATE
+        the first trading day
+
+    Returns
+    -------
+    summary : dict
+        the number of rows of every table and the trading days
+    """
+    rng = np.random.default_rng(seed)
+    if os.path.exists(path):
+        os.remove(path)
+    dates = trading_dates(years, start_date)
+    days = dates.strftime('%Y-%m-%d %H:%M:%S').tolist()
+    n_day = len(dates)
+    market = rng.normal(0.0003, 0.012, n_day)
+
+    conn = sqlite3.connect(path)
+    try:
+        with conn:
+            conn.execute('create table "stock" (date text, stkcode text, '
+                         '"return" real, volume real)')
+            conn.execute('create table "industry" (date text, industry_name '
+                         'text, "return" real, volume real)')
+            conn.execute('create table "index" (date text, "index" text, '
+                         '"return" real, volume real)')
+            conn.execute('create table "stock_industry" (stock text, '
+                         'industry_name text)')
+
+            index_names = INDEX_NAMES[:indexes] + [
+                '指数%03d' % i for i in range(len(INDEX_NAMES), indexes)]
+            for name in index_names:
+                returns = market * rng.uniform(0.8, 1.2) + \
+                    rng.normal(0, 0.003, n_day)
+                volume = rng.integers(10 ** 8, 10 ** 9, n_day).astype(float)
+                conn.executemany('insert into "index" values (?, ?, ?, ?)',
+                                 zip(days, [name] * n_day, returns.tolist(),
+                                     volume.tolist()))
+
+            industry_names = ['行业%03dIII' % i for i in range(industries)]
+            industry_returns = []
+            for name in industry_names:
+                returns = market * rng.uniform(0.5, 1.5) + \
+                    rng.normal(0, 0.008, n_day)
+                industry_returns.append(returns)
+                volume = rng.integers(10 ** 6, 10 ** 8, n_day).astype(float)
+                conn.executemany('insert into "industry" values (?, ?, ?, ?)',
+                                 zip(days, [name] * n_day, returns.tolist(),
+                                     volume.tolist()))
+
+            codes = ['%06d.%s' % (600000 + i if i % 2 == 0 else i,
+                                  'XSHG' if i % 2 == 0 else 'XSHE')
+                     for i in range(stocks)]
+            members = rng.integers(0, industries, stocks)
+            conn.executemany('insert into "stock_industry" values (?, ?)',
+                             zip(codes, [industry_names[i] for i in members]))
+            stock_rows = 0
+            for code, member in zip(codes, members):
+                kept = np.flatnonzero(rng.random(n_day) >= missing)
+                returns = industry_returns[member][kept] * \
+                    rng.uniform(0.6, 1.4) + rng.normal(0, 0.02, len(kept))
+                volume = rng.integers(10 ** 5, 10 ** 7, len(kept)).astype(
+                    float)
+                conn.executemany('insert into "stock" values (?, ?, ?, ?)',
+                                 zip([days[i] for i in kept],
+                                     [code] * len(kept), returns.tolist(),
+                                     volume.tolist()))
+                stock_rows += len(kept)
+    finally:
+        conn.close()
+    return {
+        'stock': stock_rows,
+        'industry': industries * n_day,
+        'index': len(index_names) * n_day,
+        'stock_industry': stocks,
+        'days': n_day
+    }
+
+
+if __name__ == '__main__':
+    pass
@@ -0,0 +1,155 @@
+# -*- coding: utf-8 -*-
+import numpy as np
+import pandas as pd
+from errors import InvalidWindowUnit
+
+
+class TradingCalendar(object):
+    """
+    The sorted trading dates of the market, mapping any calendar date to
+    trading-day positions with a binary search
+
+    A window of dates becomes a (start, stop) slice of positions, so the
+    arrays ordered by trading date can be cut without building an index.
+    """
+
+    def __init__(self, dates):
+        """
+        Parameters
+        ----------
+        dates: DatetimeIndex
+            the trading dates, sorted or not
+        """
+        self.dates = pd.DatetimeIndex(dates).unique().sort_values()
+        self.values = self.dates.values
+
+    def __len__(self):
+        return len(self.dates)
+
+    def position(self, date, side='left'):
+        """
+        Get the position of a date, or of the dates in an array
+
+        Parameters
+        ----------
+        date: Timestamp or DatetimeIndex
+            the calendar date(s)
+        side: string, default 'left'
+            'left': the first trading day on or after the date
+            'right': one past the last trading day on or before the date
+
+        Returns
+        -------
+        position : int or ndarray
+        """
+        if isinstance(date, (pd.Timestamp, str)):
+            return int(np.searchsorted(self.values,
+                                       pd.Timestamp(date).to_datetime64(),
+                                       side=side))
+        return np.searchsorted(self.values, pd.DatetimeIndex(date).values,
+                               side=side)
+
+    def slice(self, start, end):
+        """
+        Get the positions of the trading days between two calendar dates
+
+        Parameters
+        ----------
+        start: Timestamp
+            the first calendar date, included
+        end: Timestamp
+            the last calendar date, included
+
+        Returns
+        -------
+        window : slice
+        """
+        return slice(self.position(start, 'left'),
+                     self.position(end, 'right'))
+
+    def window_positions(self, event_date, before, after, unit='calendar'):
+        """
+        Locate every window around every event date as positions in the
+        calendar
+
+        Parameters
+        ----------
+        event_date: DatetimeIndex
+            the event dates
+        before: int
+            the largest number of days before the event date
+        after: int
+            the largest number of days after the event date
+        unit: string, default 'calendar'
+            'calendar': count calendar days, a window b days before and a
+            days after covers the trading days between those dates
+            'trading': count trading days, a window covers the b trading
+            days before the event day, the event day if it is a trading
+            day, and the a trading days after it
+
+        Returns
+        -------
+        start : ndarray
+            start[e, b] is the first position of the window opened b days
+            before the event e
+        end : ndarray
+            end[e, a] is one past the last position of the window closed a
+            days after the event e
+        """
+        event_date = pd.DatetimeIndex(event_date).values
+        if unit == 'calendar':
+            before_offset = np.arange(before + 1) * np.timedelta64(1, 'D')
+            after_offset = np.arange(after + 1) * np.timedelta64(1, 'D')
+            start = np.searchsorted(self.values,
+                                    event_date[:, None] - before_offset,
+                                    side='left')
+            end = np.searchsorted(self.values,
+                                  event_date[:, None] + after_offset,
+                                  side='right')
+        elif unit == 'trading':
+            first = np.searchsorted(self.values, event_date, side='left')
+            last = np.searchsorted(self.values, event_date, side='right')
+            start = np.clip(first[:, None] - np.arange(before + 1), 0,
+                            len(self))
+            end = np.clip(last[:, None] + np.arange(after + 1), 0,
+                          len(self))
+        else:
+            raise InvalidWindowUnit(
+                "unit should be one of 'calendar' and 'trading'")
+        return start, end
+
+    def window_bounds(self, dates, event_date, before, after,
+                      unit='calendar'):
+        """
+        Locate the windows of window_positions in the rows of data whose
+        dates are a subset of the calendar, e.g. the trading days of one
+        stock
+
+        Parameters
+        ----------
+        dates: DatetimeIndex
+            the sorted dates of the rows
+        event_date, before, after, unit:
+            the same as window_positions
+
+        Returns
+        -------
+        start : ndarray
+            start[e, b] is the first row of the window opened b days
+            before the event e
+        end : ndarray
+            end[e, a] is one past the last row of the window closed a days
+            after the event e
+        """
+        start, end = self.window_positions(event_date, before, after, unit)
+        dates = pd.DatetimeIndex(dates).values
+        if len(dates) == len(self) and np.array_equal(dates, self.values):
+            return start, end
+        # a calendar position maps to the rows dated on or after it
+        rows = np.searchsorted(dates, self.values, side='left')
+        rows = np.append(rows, len(dates))
+        return rows[start], rows[end]
+
+
+if __name__ == '__main__':
+    pass
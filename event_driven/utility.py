@@ -1,74 +1,376 @@
 # -*- coding: utf-8 -*-
-import pandas as pd
+import os
 import sqlite3
+import threading
+import pandas as pd
+from panel import merge_periods
+from store import PanelStore, TABLE_KEYS
+from instrument import get_instrument
 
-conn = sqlite3.connect('data.db')
+# the database read by default
+DB_PATH = 'data.db'
+# the directory of the columnar copy of data.db, built by store.py
+STORE_PATH = 'data_store'
+# the most parameters bound to one statement, below SQLite's default of 999
+MAX_PARAMS = 900
+# beyond this many disjoint periods one covering interval is read instead
+MAX_PERIODS = 200
 
 
-def get_industry_data():
+class Database(object):
     """
-    Read all the data from the table industry
+    Readers of the tables of data.db, and of its columnar store when it has
+    been built
 
-    Returns
-    -------
-    ind_data : DataFrame
+    Nothing is opened until the first read.
     """
-    ind_data = pd.read_sql('Select * from industry', conn, index_col='date',
-                           parse_dates=['date'])
-    return ind_data
 
+    def __init__(self, path=DB_PATH, store_path=None, instrument=None):
+        """
+        Parameters
+        ----------
+        path: string, default DB_PATH
+            the SQLite file
+        store_path: string, default None
+            the directory of the columnar store, STORE_PATH next to the
+            SQLite file if None
+        instrument: Instrument, default None
+            records the reads as the stages read_store and read_sqlite and
+            the counter rows_read, nothing is recorded if None
+        """
+        self.path = path
+        self.instrument = get_instrument(instrument)
+        self.store_path = store_path if store_path is not None else \
+            os.path.join(os.path.dirname(path), STORE_PATH)
+        self.__conn = None
+        self.__store = None
+        self.__indexed = False
+        # one connection is shared by the threads reading through it
+        self.__lock = threading.RLock()
 
-def get_index_data():
-    """
-    Read all the data from the table index
+    @property
+    def conn(self):
+        """
+        The connection to the SQLite file, opened on first use
+        """
+        with self.__lock:
+            if self.__conn is None:
+                self.__conn = sqlite3.connect(self.path,
+                                              check_same_thread=False)
+        return self.__conn
 
-    Returns
-    -------
-    index_data : DataFrame
-    """
-    index_data = pd.read_sql("select * from 'index'", conn,
-                             index_col='date', parse_dates=['date'])
-    return index_data
+    def get_store(self):
+        """
+        Open the columnar store if it has been built
 
+        Returns
+        -------
+        store : PanelStore or None
+        """
+        if self.__store is None and PanelStore.exists(self.store_path):
+            self.__store = PanelStore(self.store_path)
+        return self.__store
 
-def get_stock_data(stock_list, list_bool=True):
-    """
-    Read from the table stock to get the data of a stock (or stocks)
+    def version(self):
+        """
+        Identify the current contents of the data by the modification times
+        of the SQLite file and of the store, which change on every write
 
-    Parameters
-    ----------
-    stock_list: tuple or string
-        a list of stock code (stocks codes)
-    list_bool: boolean, default True
-        Whether to get the data of a list of stocks or a stock
+        Returns
+        -------
+        version : tuple
+        """
+        # creating the indexes writes the file, so it is done beforehand
+        self.ensure_indexes()
+        times = []
+        for path in [self.path, os.path.join(self.store_path, 'meta.json')]:
+            times.append(os.path.getmtime(path) if os.path.exists(path)
+                         else None)
+        return tuple(times)
 
-    Returns
-    -------
-    stock_data : DataFrame
-    """
-    if list_bool:
-        sql_command = "select * from stock where stkcode IN {stock_list}"
-    else:
-        sql_command = "select * from stock where stkcode = \'{stock_list}\'"
+    def refresh(self):
+        """
+        Forget the opened store, so that a rebuilt one is opened on the next
+        read
+        """
+        self.__store = None
 
-    try:
-        stock_data = pd.read_sql(sql_command.format(stock_list=stock_list),
-                                 conn, parse_dates=['date'])
-        return stock_data
-    except pd.io.sql.DatabaseError:
-        return None
+    def ensure_indexes(self):
+        """
+        Create the indexes on (entity, date) of the price tables and on the
+        dates of the table industry, which the trading calendar is read
+        from, once
 
+        A read-only database is left as it is.
+        """
+        if self.__indexed:
+            return
+        self.__indexed = True
+        try:
+            with self.__lock, self.conn:
+                for table, key in TABLE_KEYS.items():
+                    self.conn.execute(
+                        'create index if not exists "{table}_{key}_date" '
+                        'on "{table}" ("{key}", date)'.format(table=table,
+                                                              key=key))
+                self.conn.execute('create index if not exists '
+                                  '"industry_date" on industry (date)')
+        except sqlite3.Error:
+            pass
 
-def get_stock_industry():
+    def read_table(self, table, codes=None, periods=None, index_col='date'):
+        """
+        Read the rows of a price table with the entity and date filters
+        pushed down into parameterized SQL
+
+        Parameters
+        ----------
+        table: string
+            stock, industry or index
+        codes: list, default None
+            only read these entities, all if None
+        periods: list, default None
+            only read the dates inside these periods (DatetimeIndex or
+            (start, end) pairs), all if None
+        index_col: string, default 'date'
+            the column to use as index, None to keep date as a column
+
+        Returns
+        -------
+        data : DataFrame
+        """
+        if self.get_store() is not None:
+            with self.instrument.stage('read_store'):
+                data = self.get_store().frame(table, codes, periods)
+            self.instrument.count('rows_read', len(data))
+            return data if index_col is not None else data.reset_index()
+        self.ensure_indexes()
+        conditions = []
+        params = []
+        if periods is not None:
+            periods = merge_periods(periods)
+            if len(periods) > MAX_PERIODS:
+                periods = [(periods[0][0], periods[-1][1])]
+            conditions.append('(' + (' or '.join(
+                ['(date >= ? and date < ?)'] * len(periods)) or '0') + ')')
+            for start, end in periods:
+                params += [start.strftime('%Y-%m-%d'),
+                           (end + pd.Timedelta('1 day')).strftime('%Y-%m-%d')]
+        chunks = [None]
+        if codes is not None:
+            codes = list(codes)
+            size = MAX_PARAMS - len(params)
+            chunks = [codes[i:i + size]
+                      for i in range(0, max(len(codes), 1), size)]
+        frames = []
+        with self.__lock, self.instrument.stage('read_sqlite'):
+            for chunk in chunks:
+                where = list(conditions)
+                if chunk is not None:
+                    where.append('"{key}" IN ({params})'.format(
+                        key=TABLE_KEYS[table],
+                        params=','.join('?' * len(chunk))))
+                sql_command = 'select * from "{table}"'.format(table=table)
+                if where:
+                    sql_command += ' where ' + ' and '.join(where)
+                frames.append(pd.read_sql(
+                    sql_command, self.conn, index_col=index_col,
+                    parse_dates=['date'],
+                    params=params + (chunk if chunk is not None else [])))
+            self.instrument.count('rows_read', sum(map(len, frames)))
+        return frames[0] if len(frames) == 1 else pd.concat(frames)
+
+    def get_industry_data(self, industries=None, periods=None):
+        """
+        Read the data from the table industry
+
+        Parameters
+        ----------
+        industries: list, default None
+            only read these industries, all if None
+        periods: list, default None
+            only read the dates inside these periods, all if None
+
+        Returns
+        -------
+        ind_data : DataFrame
+        """
+        return self.read_table('industry', industries, periods)
+
+    def get_index_data(self, indexes=None, periods=None):
+        """
+        Read the data from the table index
+
+        Parameters
+        ----------
+        indexes: list, default None
+            only read these indexes, all if None
+        periods: list, default None
+            only read the dates inside these periods, all if None
+
+        Returns
+        -------
+        index_data : DataFrame
+        """
+        return self.read_table('index', indexes, periods)
+
+    def get_stock_data(self, stock_list, list_bool=True, periods=None):
+        """
+        Read from the table stock to get the data of a stock (or stocks)
+
+        Parameters
+        ----------
+        stock_list: tuple or string
+            a list of stock code (stocks codes)
+        list_bool: boolean, default True
+            Whether to get the data of a list of stocks or a stock
+        periods: list, default None
+            only read the dates inside these periods, all if None
+
+        Returns
+        -------
+        stock_data : DataFrame
+        """
+        codes = list(stock_list) if list_bool else [stock_list]
+        try:
+            return self.read_table('stock', codes, periods, index_col=None)
+        except pd.errors.DatabaseError:
+            return None
+
+    def iter_stock_data(self, stock_list, periods=None, chunk_size=500):
+        """
+        Read the table stock a chunk of stocks at a time, so that only the
+        rows of one chunk are in memory at once
+
+        Parameters
+        ----------
+        stock_list: list
+            the stock codes, read in this order
+        periods: list, default None
+            only read the dates inside these periods, all if None
+        chunk_size: int, default 500
+            the number of stocks read at a time, all at once if None
+
+        Yields
+        ------
+        stock_data : DataFrame
+            the rows of the next chunk of stocks, like get_stock_data
+        """
+        codes = list(stock_list)
+        size = chunk_size or max(len(codes), 1)
+        for i in range(0, len(codes), size):
+            try:
+                stock_data = self.read_table('stock', codes[i:i + size],
+                                             periods, index_col=None)
+            except pd.errors.DatabaseError:
+                return
+            yield stock_data
+
+    def get_all_stock_data(self):
+        """
+        Read all the data from the table stock
+
+        Returns
+        -------
+        stock_data : DataFrame
+        """
+        return self.read_table('stock')
+
+    def get_stock_industry(self):
+        """
+        Read all the data from the table stock_industry
+
+        Returns
+        -------
+        stock_ind_data : DataFrame
+        """
+        if self.get_store() is not None:
+            return self.get_store().stock_industry()
+        with self.__lock, self.instrument.stage('read_sqlite'):
+            stock_ind_data = pd.read_sql("select * from stock_industry",
+                                         self.conn)
+        self.instrument.count('rows_read', len(stock_ind_data))
+        return stock_ind_data
+
+    def get_trading_date(self):
+        """
+        Read the trading dates, which are the dates of the table industry
+
+        Each date is found from the previous one with a seek in the index on
+        the dates, so one row per day is read rather than the whole table.
+
+        Returns
+        -------
+        trading_date : DatetimeIndex
+        """
+        if self.get_store() is not None:
+            return self.get_store().panel('industry').dates
+        self.ensure_indexes()
+        with self.__lock, self.instrument.stage('read_sqlite'):
+            trading_date = pd.read_sql(
+                'with recursive days(date) as ('
+                'select min(date) from industry union all '
+                'select (select min(date) from industry '
+                'where date > days.date) from days '
+                'where days.date is not null) '
+                'select date from days where date is not null', self.conn,
+                parse_dates=['date'])
+        self.instrument.count('rows_read', len(trading_date))
+        return pd.DatetimeIndex(trading_date['date'])
+
+    def close(self):
+        """
+        Close the connection if it has been opened
+        """
+        if self.__conn is not None:
+            self.__conn.close()
+            self.__conn = None
+
+
+# the Database behind the module level functions, created on first use
+_database = None
+
+
+def get_database():
     """
-    Read all the data from the table stock_industry
+    Get the Database of DB_PATH shared by the module level functions
 
     Returns
     -------
-    stock_ind_data : DataFrame
+    database : Database
     """
-    stock_ind_data = pd.read_sql("select * from stock_industry", conn)
-    return stock_ind_data
+    global _database
+    if _database is None:
+        _database = Database()
+    return _database
+
+
+def get_store():
+    return get_database().get_store()
+
+
+def get_industry_data(industries=None, periods=None):
+    return get_database().get_industry_data(industries, periods)
+
+
+def get_index_data(indexes=None, periods=None):
+    return get_database().get_index_data(indexes, periods)
+
+
+def get_stock_data(stock_list, list_bool=True, periods=None):
+    return get_database().get_stock_data(stock_list, list_bool, periods)
+
+
+def iter_stock_data(stock_list, periods=None, chunk_size=500):
+    return get_database().iter_stock_data(stock_list, periods, chunk_size)
+
+
+def get_all_stock_data():
+    return get_database().get_all_stock_data()
+
+
+def get_stock_industry():
+    return get_database().get_stock_industry()
 
 
 if __name__ == '__main__':
@@ -0,0 +1,7 @@
+# -*- coding: utf-8 -*-
+import os
+import sys
+
+# the modules of event_driven import each other by their plain names
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(
+    os.path.abspath(__file__))), 'event_driven'))
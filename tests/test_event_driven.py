@@ -0,0 +1,548 @@
+# -*- coding: utf-8 -*-
+import os
+import json
+import shutil
+import sqlite3
+import threading
+import http.client
+import numpy as np
+import pandas as pd
+import pytest
+import detector
+import synthetic
+import significance
+from event_driven import EventDriven
+from baidu_stub import BaiduIndexStub
+from service import AnalysisService
+from store import TABLE_KEYS, PanelStore, CUMULATIVE, build_store
+from ingest import ingest
+from errors import BaiduIndexError
+
+EVENT_NAME = '事件'
+
+
+@pytest.fixture(scope='module')
+def market(tmp_path_factory):
+    """
+    A small synthetic database, the dates of its events and a Baidu Index
+    stub spiking on them
+    """
+    directory = tmp_path_factory.mktemp('market')
+    db_path = str(directory / 'data.db')
+    synthetic.make_database(db_path, stocks=60, industries=6, years=3,
+                            seed=1)
+    event_date = synthetic.make_events(synthetic.trading_dates(3), 5,
+                                       seed=1)
+    with BaiduIndexStub({EVENT_NAME: event_date}) as stub:
+        yield {'directory': directory, 'db_path': db_path,
+               'event_date': event_date, 'stub': stub,
+               'baidu_cache': str(directory / 'baidu_index.db')}
+
+
+def fitted(market, db_path=None, **kwargs):
+    kwargs.setdefault('result_cache_size', 0)
+    event = EventDriven(baidu_cache=market['baidu_cache'],
+                        db_path=db_path or market['db_path'],
+                        baidu_options={'base_url': market['stub'].url,
+                                       'rate_limiter': None}, **kwargs)
+    event.fit(market['event_date'], EVENT_NAME, display=False)
+    return event
+
+
+def read_table(db_path, table):
+    conn = sqlite3.connect(db_path)
+    try:
+        data = pd.read_sql('select * from "{table}"'.format(table=table),
+                           conn, parse_dates=['date'])
+    finally:
+        conn.close()
+    return data.set_index('date')
+
+
+def reference_effect(data, key, influenced, benchmark=None):
+    """
+    The effect table the way the original loops computed it, one event at
+    a time on the calendar days of its period
+    """
+    per_event = []
+    for period in influenced.values():
+        rows = data.loc[data.index.intersection(period)]
+        ret = rows.groupby(key)['return'].mean()
+        if benchmark is not None:
+            ret -= benchmark.reindex(period).mean()
+        per_event.append(ret)
+    per_event = pd.concat(per_event, axis=1)
+    return pd.DataFrame({
+        'return': per_event.mean(axis=1),
+        'up_prob': (per_event >= 0).sum(axis=1) / per_event.notna().sum(
+            axis=1)
+    })
+
+
+def ranked(result, ascending=False):
+    result = result.loc[result['up_prob'] <= 0.5] if ascending \
+        else result.loc[result['up_prob'] >= 0.5]
+    return result.sort_values(by='return', ascending=ascending)
+
+
+def assert_same_rows(result, expected):
+    result = result[['return', 'up_prob']]
+    expected = expected.loc[result.index]
+    assert len(result) > 0
+    np.testing.assert_allclose(result.values.astype(float),
+                               expected.values.astype(float), rtol=1e-9)
+
+
+def test_effects_match_the_original_loops(market):
+    event = fitted(market)
+    influenced = event.fit(market['event_date'], EVENT_NAME)
+    index = read_table(market['db_path'], 'index')
+    industry = read_table(market['db_path'], 'industry')
+    stock = read_table(market['db_path'], 'stock')
+
+    expected = reference_effect(index, 'index', influenced)
+    assert_same_rows(event.get_index_effect(), expected)
+
+    benchmark = index.loc[index['index'] == '上证综指', 'return']
+    expected = ranked(reference_effect(industry, 'industry_name',
+                                       influenced, benchmark))
+    result = event.get_industry_effect(head=None)
+    assert list(result.index) == list(expected.index)
+    assert_same_rows(result, expected)
+
+    name = result.index[0]
+    conn = sqlite3.connect(market['db_path'])
+    members = [row[0] for row in conn.execute(
+        'select stock from stock_industry where industry_name = ?',
+        (name,))]
+    conn.close()
+    benchmark = industry.loc[industry['industry_name'] == name, 'return']
+    expected = ranked(reference_effect(
+        stock.loc[stock['stkcode'].isin(members)], 'stkcode', influenced,
+        benchmark))
+    result = event.get_stock_effect(industry=name, head=None)
+    assert list(result.index) == list(expected.index)
+    assert_same_rows(result, expected)
+
+
+def test_stock_analysis_matches_the_original_loops(market):
+    event = fitted(market)
+    stock = read_table(market['db_path'], 'stock')
+    code = stock['stkcode'].iloc[0]
+    data = stock.loc[stock['stkcode'] == code]
+    detail = event.get_stock_analysis(code, 8, 8)['all_period_detail']
+    event_date = pd.to_datetime(market['event_date'])
+    for (before, after), row in detail.iterrows():
+        returns = []
+        for date in event_date:
+            window = data.reindex(pd.date_range(
+                date - pd.Timedelta(days=before),
+                date + pd.Timedelta(days=after))).dropna()
+            if window.empty:
+                break
+            returns.append((window['return'] + 1).prod() - 1)
+        expected = np.mean(returns) if returns else np.nan
+        np.testing.assert_allclose(row['return'], expected, rtol=1e-9)
+
+
+def test_stock_analysis_in_trading_days(market):
+    event = fitted(market)
+    stock = read_table(market['db_path'], 'stock')
+    code = stock['stkcode'].iloc[0]
+    data = stock.loc[stock['stkcode'] == code]
+    calendar = read_table(market['db_path'], 'industry').index.unique(
+        ).sort_values()
+    detail = event.get_stock_analysis(code, 6, 6, unit='trading')[
+        'all_period_detail']
+    event_date = pd.to_datetime(market['event_date'])
+    for (before, after), row in detail.iterrows():
+        returns = []
+        for date in event_date:
+            first = calendar.searchsorted(date, side='left')
+            last = calendar.searchsorted(date, side='right')
+            window = data.reindex(
+                calendar[max(first - before, 0):last + after]).dropna()
+            if window.empty:
+                break
+            returns.append((window['return'] + 1).prod() - 1)
+        expected = np.mean(returns) if returns else np.nan
+        np.testing.assert_allclose(row['return'], expected, rtol=1e-9)
+
+
+def test_abnormal_return_matches_a_regression_per_event(market):
+    before, after, estimation, gap = 5, 5, 60, 5
+    event = fitted(market)
+    result = event.get_abnormal_return(before=before, after=after,
+                                       estimation=estimation, gap=gap)
+    stock = read_table(market['db_path'], 'stock').dropna()
+    returns = stock.pivot(columns='stkcode', values='return')
+    index = read_table(market['db_path'], 'index')
+    market_return = index.loc[index['index'] == '上证综指', 'return'].reindex(
+        returns.index).values
+    position = returns.index.searchsorted(pd.to_datetime(
+        market['event_date']))
+    summary = result['summary']
+    assert len(summary) > 0
+    for code in summary.index[:10]:
+        y = returns[code].values
+        cars, variances, alphas, betas = [], [], [], []
+        for p in position:
+            est = np.arange(p - before - gap - estimation, p - before - gap)
+            est = est[(est >= 0) & (est < len(y))]
+            valid = est[~np.isnan(y[est]) & ~np.isnan(market_return[est])]
+            if len(valid) <= 2:
+                continue
+            x = np.column_stack([np.ones(len(valid)), market_return[valid]])
+            (alpha, beta), residual = np.linalg.lstsq(x, y[valid],
+                                                      rcond=None)[:2]
+            days = np.arange(p - before, p + after + 1)
+            days = days[(days >= 0) & (days < len(y))]
+            ar = y[days] - alpha - beta * market_return[days]
+            cars.append(np.nansum(ar))
+            variances.append(np.sum(~np.isnan(ar)) * residual[0] /
+                             (len(valid) - 2))
+            alphas.append(alpha)
+            betas.append(beta)
+        car = np.mean(cars)
+        np.testing.assert_allclose(
+            summary.loc[code].values,
+            [car, car / (np.sqrt(np.sum(variances)) / len(cars)),
+             np.mean(alphas), np.mean(betas)], rtol=1e-7)
+
+
+@pytest.mark.parametrize('method', ['median', 'zscore', 'mad'])
+def test_detectors_match_a_loop(method):
+    rng = np.random.default_rng(0)
+    values = rng.gamma(2.0, 100.0, 400)
+    values[rng.choice(400, 40, replace=False)] = np.nan
+    values[[50, 51, 200, 380]] *= 20
+    positions = np.array([-30, 0, 20, 180, 350, 390, 500])
+    window = 60
+    first, last = detector.influence_windows(values, positions,
+                                             method=method, threshold=3,
+                                             window=window)
+    for position, i, j in zip(positions, first, last):
+        data = np.array([values[k] if 0 <= k < len(values) else np.nan
+                         for k in range(position, position + window)])
+        present = data[~np.isnan(data)]
+        if len(present) == 0:
+            assert (i, j) == (-1, -1)
+            continue
+        if method == 'median':
+            crossed = data >= 3 * np.median(present)
+        elif method == 'zscore':
+            crossed = (data - present.mean()) / present.std() >= 3
+        else:
+            median = np.median(present)
+            mad = np.median(np.abs(present - median))
+            crossed = (data - median) / (detector.MAD_SCALE * mad) >= 3
+        found = np.flatnonzero(crossed)
+        assert (i, j) == ((found[0], found[-1]) if len(found) else (-1, -1))
+    assert (first[[2, 3]] >= 0).all()
+
+
+def test_significance_of_a_strong_effect():
+    rng = np.random.default_rng(0)
+    dates = pd.bdate_range('2015-01-01', periods=600)
+    returns = rng.normal(0, 0.01, (len(dates), 2))
+    starts = np.arange(20, 580, 70)
+    for start in starts:
+        returns[start:start + 5, 0] += 0.03
+    periods = [dates[start:start + 5] for start in starts]
+    expected = np.mean([returns[start:start + 5].mean(axis=0)
+                        for start in starts], axis=0)
+    resamples = 999
+    for method in ['permutation', 'bootstrap']:
+        result = significance.effect_significance(
+            dates, returns, periods, resamples=resamples, method=method,
+            seed=1)
+        again = significance.effect_significance(
+            dates, returns, periods, resamples=resamples, method=method,
+            seed=1)
+        np.testing.assert_allclose(result['return'], expected, rtol=1e-9)
+        assert result['up_prob'][0] == 1
+        for name in ['p_value', 'up_prob_p']:
+            np.testing.assert_array_equal(result[name], again[name])
+            assert ((result[name] >= 1 / (resamples + 1)) &
+                    (result[name] <= 1)).all()
+        assert result['p_value'][0] <= 0.01
+        assert result['p_value'][1] > 0.05
+    # every resample of the events keeps the mean and the rise
+    # probability of the first entity above the null
+    assert result['p_value'][0] == result['up_prob_p'][0] == \
+        2 / (resamples + 1)
+
+
+def test_effect_significance_of_the_analyses(market):
+    event = fitted(market)
+    industry = event.get_industry_effect().index[0]
+    for method in ['permutation', 'bootstrap']:
+        for result, plain in [
+                (event.get_index_effect(resamples=99, method=method,
+                                        seed=0),
+                 event.get_index_effect()),
+                (event.get_stock_effect(industry, head=None, resamples=99,
+                                        method=method, seed=0),
+                 event.get_stock_effect(industry, head=None))]:
+            pd.testing.assert_frame_equal(
+                result[['return', 'up_prob']], plain, check_exact=False,
+                rtol=1e-9)
+            assert result[['p_value', 'up_prob_p']].stack().between(
+                0.01, 1).all()
+
+
+def test_workers_match_the_serial_analyses(market):
+    serial = fitted(market)
+    event = fitted(market, workers=2)
+    event._EventDriven__pool.min_size = 2
+    try:
+        industry = serial.get_industry_effect().index[0]
+        pd.testing.assert_frame_equal(
+            event.get_stock_effect(industry, head=None),
+            serial.get_stock_effect(industry, head=None))
+        pd.testing.assert_frame_equal(
+            event.get_market_analysis(before_periods=10, after_periods=10),
+            serial.get_market_analysis(before_periods=10, after_periods=10))
+    finally:
+        event.close()
+
+
+def test_fit_many_fetches_only_the_missing_days(market, tmp_path):
+    events = {EVENT_NAME: market['event_date'],
+              '其他': market['event_date'][:2]}
+    cache = str(tmp_path / 'baidu_index.db')
+    with BaiduIndexStub(events) as stub:
+        def new_event():
+            return EventDriven(baidu_cache=cache, db_path=market['db_path'],
+                               result_cache_size=0,
+                               baidu_options={'base_url': stub.url,
+                                              'rate_limiter': None})
+
+        many = new_event().fit_many(events)
+        calls = stub.calls
+        for event_name, event_date in events.items():
+            influenced = new_event().fit(event_date, event_name)
+            assert list(influenced) == list(many[event_name])
+            for date in influenced:
+                assert influenced[date].equals(many[event_name][date])
+        assert stub.calls == calls
+
+        conn = sqlite3.connect(cache)
+        with conn:
+            conn.execute('delete from baidu_index where keyword = ? and '
+                         'date between ? and ?',
+                         (EVENT_NAME, '2019-03-01', '2019-03-10'))
+        conn.close()
+        influenced = new_event().fit(events[EVENT_NAME], EVENT_NAME)
+        # one request for the data of the missing days, one for its key
+        assert stub.calls == calls + 2
+        for date in influenced:
+            assert influenced[date].equals(many[EVENT_NAME][date])
+
+
+def test_result_cache_follows_the_data(market, tmp_path):
+    db_path = str(tmp_path / 'data.db')
+    shutil.copy(market['db_path'], db_path)
+    event = fitted(market, db_path=db_path, result_cache_size=16,
+                   instrument=True)
+    first = event.get_index_effect()
+    pd.testing.assert_frame_equal(event.get_index_effect(), first)
+    assert event.get_stats()['counters']['result_cache_hits'] == 1
+
+    conn = sqlite3.connect(db_path)
+    with conn:
+        conn.execute('update "index" set return = return + 0.01')
+    conn.close()
+    mtime = os.path.getmtime(db_path) + 10
+    os.utime(db_path, (mtime, mtime))
+    changed = event.get_index_effect()
+    pd.testing.assert_frame_equal(changed, fitted(
+        market, db_path=db_path).get_index_effect())
+    assert not np.allclose(changed['return'], first['return'])
+
+
+def test_store_matches_sqlite(market, tmp_path):
+    db_path = str(tmp_path / 'data.db')
+    shutil.copy(market['db_path'], db_path)
+    conn = sqlite3.connect(db_path)
+    build_store(conn, str(tmp_path / 'data_store'))
+    conn.close()
+    sqlite_event = fitted(market)
+    store_event = fitted(market, db_path=db_path)
+    industry = sqlite_event.get_industry_effect().index[0]
+    for method, kwargs in [('get_index_effect', {}),
+                           ('get_industry_effect', {'head': None}),
+                           ('get_stock_effect', {'industry': industry}),
+                           ('get_market_effect', {}),
+                           ('get_market_analysis', {})]:
+        pd.testing.assert_frame_equal(
+            getattr(store_event, method)(**kwargs),
+            getattr(sqlite_event, method)(**kwargs), check_exact=False,
+            rtol=1e-9)
+    pd.testing.assert_frame_equal(
+        store_event.get_abnormal_return()['summary'],
+        sqlite_event.get_abnormal_return()['summary'], check_exact=False,
+        rtol=1e-9)
+
+
+def test_ingest_matches_a_rebuild(market, tmp_path):
+    cutoff = synthetic.trading_dates(3)[-20].strftime('%Y-%m-%d')
+    db_path = str(tmp_path / 'data.db')
+    shutil.copy(market['db_path'], db_path)
+    conn = sqlite3.connect(db_path)
+    with conn:
+        for table in TABLE_KEYS:
+            conn.execute('delete from "{table}" where date >= ?'.format(
+                table=table), (cutoff,))
+    build_store(conn, str(tmp_path / 'data_store'))
+    conn.close()
+    for table in TABLE_KEYS:
+        rows = read_table(market['db_path'], table)
+        summary = ingest(rows.loc[rows.index >= cutoff], table,
+                         db_path=db_path)
+        assert summary == {'rows': int((rows.index >= cutoff).sum()),
+                           'store': 'updated'}
+
+    conn = sqlite3.connect(market['db_path'])
+    rebuilt = build_store(conn, str(tmp_path / 'rebuilt'))
+    conn.close()
+    ingested = PanelStore(str(tmp_path / 'data_store'))
+    for table, key in TABLE_KEYS.items():
+        order = [key, 'date']
+        pd.testing.assert_frame_equal(
+            read_table(db_path, table).reset_index().sort_values(
+                order).reset_index(drop=True),
+            read_table(market['db_path'], table).reset_index().sort_values(
+                order).reset_index(drop=True))
+        panel, expected = ingested.panel(table), rebuilt.panel(table)
+        assert panel.dates.equals(expected.dates)
+        assert panel.codes.equals(expected.codes)
+        for field in expected.fields:
+            np.testing.assert_array_equal(panel[field], expected[field])
+        for name in CUMULATIVE:
+            np.testing.assert_allclose(panel.cumulative()[name],
+                                       expected.cumulative()[name],
+                                       rtol=1e-9, atol=1e-12)
+
+
+def test_ingest_overwrites_with_missing_values(market, tmp_path):
+    db_path = str(tmp_path / 'data.db')
+    shutil.copy(market['db_path'], db_path)
+    conn = sqlite3.connect(db_path)
+    build_store(conn, str(tmp_path / 'data_store'))
+    conn.close()
+    rows = read_table(db_path, 'stock')
+    rows = rows.loc[rows.index == rows.index.unique()[10]].head(3).copy()
+    rows['return'] = [np.nan, 0.05, np.nan]
+    rows['volume'] = [np.nan, np.nan, 1e6]
+    assert ingest(rows, 'stock', db_path=db_path) == {'rows': 3,
+                                                      'store': 'updated'}
+
+    conn = sqlite3.connect(db_path)
+    rebuilt = build_store(conn, str(tmp_path / 'rebuilt')).panel('stock')
+    conn.close()
+    panel = PanelStore(str(tmp_path / 'data_store')).panel('stock')
+    assert panel.dates.equals(rebuilt.dates)
+    for field in rebuilt.fields:
+        np.testing.assert_array_equal(panel[field], rebuilt[field])
+    for name in CUMULATIVE:
+        np.testing.assert_allclose(panel.cumulative()[name],
+                                   rebuilt.cumulative()[name],
+                                   rtol=1e-9, atol=1e-12)
+
+
+@pytest.mark.parametrize('compact', [False, True])
+def test_market_effect_is_the_same_in_chunks(market, compact):
+    event = fitted(market, compact=compact)
+    whole = event.get_market_effect(chunk_size=None)
+    assert len(whole) > 0
+    for chunk_size in [1, 7, 25]:
+        pd.testing.assert_frame_equal(
+            event.get_market_effect(chunk_size=chunk_size), whole)
+        pd.testing.assert_frame_equal(
+            event.get_market_effect(head=5, chunk_size=chunk_size),
+            whole.head(5))
+
+
+def test_stock_effect_is_the_same_when_compact(market):
+    event, compact = fitted(market), fitted(market, compact=True)
+    industry = event.get_industry_effect().index[0]
+    for ascending in [False, True]:
+        pd.testing.assert_frame_equal(
+            compact.get_stock_effect(industry, ascending=ascending,
+                                     head=None),
+            event.get_stock_effect(industry, ascending=ascending,
+                                   head=None), check_dtype=False,
+            check_exact=False, rtol=1e-5)
+
+
+@pytest.fixture(scope='module')
+def server(market):
+    event = fitted(market)
+    service = AnalysisService(event)
+    busy = AnalysisService(event, max_pending=0)
+    servers = [service.server(port=0), busy.server(port=0)]
+    for server in servers:
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield [server.server_address[1] for server in servers]
+    for server in servers:
+        server.shutdown()
+        server.server_close()
+
+
+def request(port, method, path, body=None):
+    conn = http.client.HTTPConnection('127.0.0.1', port, timeout=60)
+    try:
+        conn.request(method, path, body)
+        response = conn.getresponse()
+        return response.status, json.loads(response.read())
+    finally:
+        conn.close()
+
+
+@pytest.mark.parametrize('path, params, status, error', [
+    ('/index_effect', {}, 200, None),
+    ('/stock_analysis', {'stock': 'nonexistent'}, 400, 'InvalidStockCode'),
+    ('/market_analysis', {'before_periods': -3}, 400,
+     'InvalidWindowLength'),
+    ('/fit', {'window': 0}, 400, 'InvalidWindowLength'),
+    ('/abnormal_return', {'market': 'nonexistent'}, 400,
+     'InvalidIndexName'),
+    ('/industry_effect', {'nonexistent': 1}, 400, 'InvalidRequest'),
+    ('/nonexistent', {}, 400, 'InvalidRequest'),
+    ('/fit', {'threshold': 'x'}, 400, 'InvalidDetector'),
+    ('/fit', {'method': 'x'}, 400, 'InvalidDetector'),
+])
+def test_service_statuses(market, server, path, params, status, error):
+    params = dict(params, event_name=EVENT_NAME,
+                  event_date=market['event_date'])
+    answer_status, answer = request(server[0], 'POST', path,
+                                    json.dumps(params))
+    assert answer_status == status
+    if status != 200:
+        assert set(answer) == {'error', 'message'}
+    if error is not None:
+        assert answer['error'] == error
+
+
+@pytest.mark.parametrize('error, status', [
+    (BaiduIndexError, 502),
+    (RuntimeError, 500),
+])
+def test_service_server_errors(market, server, monkeypatch, error, status):
+    def fail(*args, **kwargs):
+        raise error('broken')
+
+    monkeypatch.setattr(EventDriven, 'get_index_effect', fail)
+    answer = request(server[0], 'POST', '/index_effect', json.dumps(
+        {'event_name': EVENT_NAME, 'event_date': market['event_date']}))
+    assert answer == (status, {'error': error.__name__, 'message': 'broken'})
+
+
+def test_service_other_statuses(market, server):
+    assert request(server[0], 'POST', '/index_effect', b'{')[0] == 400
+    assert request(server[0], 'GET', '/nonexistent')[0] == 404
+    assert request(server[0], 'GET', '/health') == (200, 'ok')
+    status, answer = request(server[1], 'POST', '/index_effect', json.dumps(
+        {'event_name': EVENT_NAME, 'event_date': market['event_date']}))
+    assert (status, answer['error']) == (503, 'ServiceBusy')